@@ -2,6 +2,7 @@
     Given a focal_src and focal_tgt, locate the new parameter class types and find their definitions in the global context.
 """
 
+import os, re, time
 import utils.multilspy.multilspy_types as multilspy_types
 from utils.multilspy import SyncLanguageServer
 from utils.multilspy.multilspy_exceptions import MultilspyException
@@ -16,7 +17,11 @@ from utils.parser import (
     find_parent_classes,
     get_unique_text,
     get_methodname_with_pos,
+    all_methods_from_file,
+    find_method_invocations,
 )
+from utils.configs import DIFFCTX_MODE
+from utils.deadline import deadline_passed
 from utils.logger import logger
 
 
@@ -45,15 +50,18 @@ def collect_usages_diffctx(
         focal_tgt, name_pos["line"], name_pos["character"]
     )
     ln, cn = TextUtils.get_line_col_from_index(focal_file, method_start + name_idx)
-    ref_locs = lsp.request_references(focal_relpath, ln, cn)
-    logger.info(f"+ Found {len(ref_locs)} usages for focal_tgt: {name}")
     # locs should exclude the test tgt itself
-    test_file = repo.get_file_tgt(test_relpath)
-    test_start = test_file.find(test_tgt)
-    assert test_start != -1, "Test tgt not found in test file"
-    test_end = test_start + len(test_tgt) - 1
-    start_ln = TextUtils.get_line_col_from_index(test_file, test_start)[0]
-    end_ln = TextUtils.get_line_col_from_index(test_file, test_end)[0]
+    if update_info.test_lines is not None:
+        start_ln, end_ln = update_info.test_lines
+    else:
+        # the test is not updated in practical usage
+        test_tgt = test_tgt or update_info.test_src
+        test_file = repo.get_file_tgt(test_relpath)
+        test_start = test_file.find(test_tgt)
+        assert test_start != -1, "Test tgt not found in test file"
+        test_end = test_start + len(test_tgt) - 1
+        start_ln = TextUtils.get_line_col_from_index(test_file, test_start)[0]
+        end_ln = TextUtils.get_line_col_from_index(test_file, test_end)[0]
 
     all_texts = set()
     # setup for contexts type (collect_before or collect_after)
@@ -63,23 +71,155 @@ def collect_usages_diffctx(
     if syn_diff["type"]:
         collect_after = True
 
-    # get diff texts from references loc
-    for loc in ref_locs:
-        if loc["uri"].startswith("file:"):
-            rel_path = loc["relativePath"]
-            ln = loc["range"]["start"]["line"]
-            # clean tests if need
+    # get diff texts from references loc, batch by batch while the server is still searching
+    ref_count = 0
+    try:
+        for ref_locs in lsp.request_references_stream(focal_relpath, ln, cn):
+            if deadline_passed():
+                # the request is cancelled, continue with the usages collected so far
+                logger.warning(f"+ Deadline passed, stop collecting usages after {ref_count} references")
+                break
+            ref_count += len(ref_locs)
+            for loc in ref_locs:
+                if loc["uri"].startswith("file:"):
+                    rel_path = loc["relativePath"]
+                    ln = loc["range"]["start"]["line"]
+                    # clean tests if need
+                    if clean_tests and "test" in rel_path.lower():
+                        continue
+                    # exclude the test tgt itself
+                    if rel_path == test_relpath and ln >= start_ln and ln <= end_ln:
+                        continue
+                    # get the diff context for ln
+                    usage_diff = repo.get_diff_from_pos(
+                        rel_path, loc["range"]["start"], collect_before, collect_after
+                    )
+                    if usage_diff:
+                        all_texts.add(usage_diff)
+    except TimeoutError:
+        # a request timed out at the deadline, keep the usages collected so far
+        if not deadline_passed():
+            raise
+        logger.warning(f"+ Deadline passed, stop collecting usages after {ref_count} references")
+    logger.info(f"+ Found {ref_count} usages for focal_tgt: {name}")
+    return all_texts
+
+
+def arity_matches(arg_count: int, param_count: int, varargs: bool) -> bool:
+    if varargs:
+        return arg_count >= param_count - 1
+    return arg_count == param_count
+
+
+def collect_usages_diffctx_scoped(
+    lsp: SyncLanguageServer,
+    repo: UpdateRepo,
+    update_info: UpdateInfo,
+    clean_tests: bool = False,
+) -> set[str]:
+    """
+    Commit-scoped version of collect_usages_diffctx: only the files changed by the commit can have usage diffs,
+    so the call sites are found by tree-sitter (name and arity) in the changed files,
+    and kept if they have a diff context (get_diff_from_pos, as collect_usages_diffctx).
+    The language server is only asked (definition) when the call site is ambiguous:
+    the focal method is overloaded with the same arity, or the file does not mention the focal class.
+    """
+    if not lsp.language_server.server_started:
+        logger.Error("collect_usages_diffctx_scoped called before Language Server started")
+        raise MultilspyException("Language Server not started")
+
+    focal_tgt = update_info.focal_tgt
+    focal_relpath = update_info.focal_relpath
+    test_relpath = update_info.test_relpath
+    syn_diff = update_info.syn_diff
+
+    # locate the focal method in the focal file by its name and the line of its name
+    focal_file = repo.get_file_tgt(focal_relpath)
+    method_start = focal_file.find(focal_tgt)
+    if method_start == -1:
+        logger.warning(f"+ Focal tgt not found in {focal_relpath}, skip collecting usages")
+        return set()
+    name, name_pos = get_methodname_with_pos(focal_tgt)
+    name_ln = focal_file.count("\n", 0, method_start) + name_pos["line"]
+    focal_methods = all_methods_from_file(focal_file)
+    focal = next(
+        (
+            m
+            for m in focal_methods
+            if m["name"] == name and m["start_line"] <= name_ln <= m["sig_end_line"]
+        ),
+        None,
+    )
+    if focal is None:
+        logger.warning(f"+ Focal method {name} not found in {focal_relpath}, skip collecting usages")
+        return set()
+    overloaded = any(
+        m is not focal
+        and m["name"] == name
+        and (m["varargs"] or focal["varargs"] or m["param_count"] == focal["param_count"])
+        for m in focal_methods
+    )
+    class_name = os.path.splitext(os.path.basename(focal_relpath))[0]
+
+    # exclude the test tgt itself
+    test_lines = update_info.test_lines
+    if test_lines is None:
+        test_tgt = update_info.test_tgt or update_info.test_src
+        test_file = repo.get_file_tgt(test_relpath)
+        test_start = test_file.find(test_tgt)
+        if test_start != -1:
+            test_lines = (
+                test_file.count("\n", 0, test_start),
+                test_file.count("\n", 0, test_start + len(test_tgt)),
+            )
+
+    collect_before = bool(syn_diff["param_types"])
+    collect_after = bool(syn_diff["type"])
+
+    all_texts = set()
+    lsp_count = 0
+    call_count = 0
+    try:
+        for rel_path in repo.get_commit_hunks():
+            if deadline_passed():
+                logger.warning(f"+ Deadline passed, stop collecting usages in the changed files")
+                break
             if clean_tests and "test" in rel_path.lower():
                 continue
-            # exclude the test tgt itself
-            if rel_path == test_relpath and ln >= start_ln and ln <= end_ln:
+            file_tgt = repo.get_file_tgt(rel_path)
+            if not file_tgt:
                 continue
-            # get the diff context for ln
-            usage_diff = repo.get_diff_from_pos(
-                rel_path, loc["range"]["start"], collect_before, collect_after
-            )
-            if usage_diff:
+            for call in find_method_invocations(file_tgt, name):
+                ln = call["line"]
+                if not arity_matches(call["arg_count"], focal["param_count"], focal["varargs"]):
+                    continue
+                if rel_path == test_relpath and test_lines and test_lines[0] <= ln <= test_lines[1]:
+                    continue
+                pos = {"line": ln, "character": call["character"]}
+                # the diff context is decided on the formatted files, the raw distance to the hunks is not reliable
+                usage_diff = repo.get_diff_from_pos(rel_path, pos, collect_before, collect_after)
+                if not usage_diff:
+                    continue
+                # disambiguate by the language server
+                if overloaded or (rel_path != focal_relpath and class_name not in file_tgt):
+                    lsp_count += 1
+                    locs = lsp.request_definition(rel_path, ln, call["character"])
+                    if not any(
+                        loc["relativePath"] == focal_relpath
+                        and focal["start_line"] <= loc["range"]["start"]["line"] <= focal["end_line"]
+                        for loc in locs
+                        if loc["uri"].startswith("file:")
+                    ):
+                        continue
+                call_count += 1
                 all_texts.add(usage_diff)
+    except TimeoutError:
+        if not deadline_passed():
+            raise
+        logger.warning(f"+ Deadline passed, stop collecting usages in the changed files")
+    logger.info(
+        f"+ Found {call_count} usages for focal_tgt: {name} in {len(repo.get_commit_hunks())} changed files ({lsp_count} LSP requests)"
+    )
     return all_texts
 
 
@@ -108,21 +248,29 @@ def recurse_class_texts(
                 visited.add(unique_text)
     classes_pos_list = find_parent_classes(file_str, loc["range"]["start"])
     rel_path = loc["relativePath"]
-    for class_pos in classes_pos_list:
-        ln, cn = class_pos["line"], class_pos["character"]
-        locs = lsp.request_definition(rel_path, ln, cn)
-        if locs:
-            loc = locs[0]
-            if loc["uri"].startswith("file:"):
-                rel_path = loc["relativePath"]
-                with lsp.open_file(rel_path):
-                    file_str = lsp.get_open_file_text(rel_path)
-                    class_type = lsp.get_text_between_positions(
-                        rel_path, loc["range"]["start"], loc["range"]["end"]
+    try:
+        for class_pos in classes_pos_list:
+            if deadline_passed():
+                logger.warning(f"# Deadline passed, stop collecting the parent classes of {class_type}")
+                return
+            ln, cn = class_pos["line"], class_pos["character"]
+            locs = lsp.request_definition(rel_path, ln, cn)
+            if locs:
+                loc = locs[0]
+                if loc["uri"].startswith("file:"):
+                    rel_path = loc["relativePath"]
+                    with lsp.open_file(rel_path):
+                        file_str = lsp.get_open_file_text(rel_path)
+                        class_type = lsp.get_text_between_positions(
+                            rel_path, loc["range"]["start"], loc["range"]["end"]
+                        )
+                    recurse_class_texts(
+                        lsp, file_str, class_type, loc, texts, visited, False
                     )
-                recurse_class_texts(
-                    lsp, file_str, class_type, loc, texts, visited, False
-                )
+    except TimeoutError:
+        if not deadline_passed():
+            raise
+        logger.warning(f"# Deadline passed, stop collecting the parent classes of {class_type}")
 
 
 def param_clsctx_from_loc(
@@ -172,15 +320,23 @@ def collect_clsctx_for_params(
         logger.Error("collect_clsctx_for_params called before Language Server started")
         raise MultilspyException("Language Server not started")
     all_clsctx = []
-    for pidr_pos in pidr_pos_list:
-        # check whether the class is defined in Java standard Library
-        ln, cn = pidr_pos["line"], pidr_pos["character"]
-        locs = lsp.request_definition(file_rel_path, ln, cn)
-        # collect the global context for every in_repo class type
-        if locs:
-            loc = locs[0]
-            if loc["uri"].startswith("file:"):
-                all_clsctx.append(param_clsctx_from_loc(lsp, loc))
+    try:
+        for pidr_pos in pidr_pos_list:
+            if deadline_passed():
+                logger.warning(f"# Deadline passed, stop collecting the class contexts")
+                break
+            # check whether the class is defined in Java standard Library
+            ln, cn = pidr_pos["line"], pidr_pos["character"]
+            locs = lsp.request_definition(file_rel_path, ln, cn)
+            # collect the global context for every in_repo class type
+            if locs:
+                loc = locs[0]
+                if loc["uri"].startswith("file:"):
+                    all_clsctx.append(param_clsctx_from_loc(lsp, loc))
+    except TimeoutError:
+        if not deadline_passed():
+            raise
+        logger.warning(f"# Deadline passed, stop collecting the class contexts")
     return all_clsctx
 
 
@@ -226,15 +382,23 @@ def collect_clsctx_for_return(
         logger.Error("collect_clsctx_for_return called before Language Server started")
         raise MultilspyException("Language Server not started")
     all_clsctx = []
-    for ridr_pos in ridr_pos_list:
-        # check whether the class is defined in Java standard Library
-        ln, cn = ridr_pos["line"], ridr_pos["character"]
-        locs = lsp.request_definition(focal_relpath, ln, cn)
-        # collect the global context for every in_repo class type
-        if locs:
-            loc = locs[0]
-            if loc["uri"].startswith("file:"):
-                all_clsctx.append(return_clsctx_from_loc(lsp, loc))
+    try:
+        for ridr_pos in ridr_pos_list:
+            if deadline_passed():
+                logger.warning(f"# Deadline passed, stop collecting the class contexts")
+                break
+            # check whether the class is defined in Java standard Library
+            ln, cn = ridr_pos["line"], ridr_pos["character"]
+            locs = lsp.request_definition(focal_relpath, ln, cn)
+            # collect the global context for every in_repo class type
+            if locs:
+                loc = locs[0]
+                if loc["uri"].startswith("file:"):
+                    all_clsctx.append(return_clsctx_from_loc(lsp, loc))
+    except TimeoutError:
+        if not deadline_passed():
+            raise
+        logger.warning(f"# Deadline passed, stop collecting the class contexts")
     return all_clsctx
 
 
@@ -245,12 +409,18 @@ def recurse_diff_texts(
     class_pos: multilspy_types.Position,
     texts: set[str],
     init_flag=True,
+    mode: str = DIFFCTX_MODE,
 ):
     """
     Given a class type and its definition, recurse over all the texts from the parent classes.
     """
     if init_flag:
         file_tgt = repo.get_file_tgt(rel_path)
+    elif mode == "native":
+        file_tgt = repo.get_file_tgt(rel_path)
+        add_texts = repo.get_file_diff_texts(rel_path, line_limit=10, add_must=True)
+        logger.info(f"$ Found {len(add_texts)} diff texts in {rel_path}")
+        texts.update(add_texts)
     else:
         # generate diff context
         file_src = repo.get_file_src(rel_path)
@@ -264,15 +434,23 @@ def recurse_diff_texts(
         texts.update(add_texts)
 
     parent_clspos_list = find_parent_classes(file_tgt, class_pos)
-    for parent_clspos in parent_clspos_list:
-        ln, cn = parent_clspos["line"], parent_clspos["character"]
-        locs = lsp.request_definition(rel_path, ln, cn)
-        if locs:
-            loc = locs[0]
-            if loc["uri"].startswith("file:"):
-                rel_path = loc["relativePath"]
-                class_pos = loc["range"]["start"]
-                recurse_diff_texts(lsp, repo, rel_path, class_pos, texts, False)
+    try:
+        for parent_clspos in parent_clspos_list:
+            if deadline_passed():
+                logger.warning(f"$ Deadline passed, stop collecting the diff texts of the parent classes")
+                return
+            ln, cn = parent_clspos["line"], parent_clspos["character"]
+            locs = lsp.request_definition(rel_path, ln, cn)
+            if locs:
+                loc = locs[0]
+                if loc["uri"].startswith("file:"):
+                    rel_path = loc["relativePath"]
+                    class_pos = loc["range"]["start"]
+                    recurse_diff_texts(lsp, repo, rel_path, class_pos, texts, False, mode)
+    except TimeoutError:
+        if not deadline_passed():
+            raise
+        logger.warning(f"$ Deadline passed, stop collecting the diff texts of the parent classes")
 
 
 def collect_method_diffctx(
@@ -283,34 +461,174 @@ def collect_method_diffctx(
     method_tgt: str,
     type: str,
     clean_tests: bool = False,
+    mode: str = DIFFCTX_MODE,
 ) -> set[str]:
     """
     Enrich context by collecting diff context for a method in a given file and its parent files.
     type: "focal" or "test"
+    mode: "reformat"(filter and reformat whole files, then diff) or "native"(git's hunks of the commit)
     """
     if not lsp.language_server.server_started:
         logger.Error("collect_method_diffctx called before Language Server started")
         raise MultilspyException("Language Server not started")
-    # clear the methods in the top file
-    file_src = repo.get_file_src(rel_path)
+    texts, class_pos = method_diff_texts(
+        repo, rel_path, method_src, method_tgt, clean_tests, mode
+    )
+    logger.info(f"$ Found {len(texts)} {type} diff texts in {rel_path}")
+
+    recurse_diff_texts(lsp, repo, rel_path, class_pos, texts, mode=mode)
+
+    return texts
+
+
+def method_diff_texts(
+    repo: UpdateRepo,
+    rel_path: str,
+    method_src: str,
+    method_tgt: str,
+    clean_tests: bool = False,
+    mode: str = DIFFCTX_MODE,
+) -> tuple[set[str], multilspy_types.Position]:
+    """
+    Diff texts in the file of a method (the method itself excluded), and the position of the method in the tgt file.
+    """
     file_tgt = repo.get_file_tgt(rel_path)
+    method_start = file_tgt.find(method_tgt)
+    ln, cn = TextUtils.get_line_col_from_index(file_tgt, method_start)
+    class_pos = {"line": ln, "character": cn}
+    if mode == "native":
+        texts = repo.get_file_diff_texts(
+            rel_path, 10, True, clean_tests, method_src, method_tgt
+        )
+        return texts, class_pos
 
+    # clear the methods in the top file
+    file_src = repo.get_file_src(rel_path)
     file_src = file_src.replace(method_src, "")
-    method_start = file_tgt.find(method_tgt)
     file_tgt = file_tgt[:method_start] + file_tgt[method_start + len(method_tgt) :]
     file_src_clean = filter_file_code(file_src, clean_tests)
     file_tgt_clean = filter_file_code(file_tgt, clean_tests)
 
     texts = get_diff_texts(file_src_clean, file_tgt_clean, line_limit=10, add_must=True)
-    logger.info(f"$ Found {len(texts)} {type} diff texts in {rel_path}")
-    ln, cn = TextUtils.get_line_col_from_index(file_tgt, method_start)
-    class_pos = {"line": ln, "character": cn}
+    return texts, class_pos
 
-    recurse_diff_texts(lsp, repo, rel_path, class_pos, texts)
 
-    return texts
+def compare_diffctx_modes(
+    repo: UpdateRepo, rel_path: str, method_src: str, method_tgt: str
+) -> dict:
+    """
+    Validate the native mode against the reformat mode on the file of a method.
+    Formatting differs between the modes (clang-format joins lines), so the changed tokens are compared.
+    """
+
+    def changed_tokens(texts: set[str], sign: str) -> set[str]:
+        return {
+            token
+            for text in texts
+            for line in text.splitlines()
+            if line.startswith(sign)
+            for token in re.findall(r"\w+|[^\w\s]", line[1:])
+        }
+
+    res = {}
+    for mode in ["reformat", "native"]:
+        start = time.perf_counter()
+        texts, _ = method_diff_texts(repo, rel_path, method_src, method_tgt, mode=mode)
+        res[f"{mode}_time"] = time.perf_counter() - start
+        res[mode] = texts
+    for sign, name in [("+", "add"), ("-", "delete")]:
+        ref_tokens = changed_tokens(res["reformat"], sign)
+        new_tokens = changed_tokens(res["native"], sign)
+        union = ref_tokens | new_tokens
+        res[f"{name}_jaccard"] = len(ref_tokens & new_tokens) / len(union) if union else 1.0
+    return res
+
+
+def compare_usages_scopes(
+    lsp: SyncLanguageServer, repo: UpdateRepo, update_info: UpdateInfo, clean_tests: bool = False
+) -> dict:
+    """
+    Validate the commit scope of the usages against the repo scope (all the references) on an example:
+    the usage diffs of the repo scope missed by the commit scope are "lost".
+    """
+    res = {}
+    for scope, collect in [("repo", collect_usages_diffctx), ("commit", collect_usages_diffctx_scoped)]:
+        start = time.perf_counter()
+        res[scope] = collect(lsp, repo, update_info, clean_tests)
+        res[f"{scope}_time"] = time.perf_counter() - start
+    res["lost"] = res["repo"] - res["commit"]
+    res["extra"] = res["commit"] - res["repo"]
+    return res
+
+
+def validate_usages_scopes(datafile: str, max_examples: int = 50, clean_tests: bool = True):
+    """Run compare_usages_scopes on the first examples of the dataset, one language server per example."""
+    from utils.dataset import ExampleDataset
+    from retriever.main_retriever import lsp_config_for, lsp_logger
+
+    logger.set_log_file("logs/validate_usages_scope.log", "w")
+    examples = ExampleDataset(datafile)
+    results = []
+    for i, exp in examples.iter_examples(ids=list(range(min(max_examples, len(examples))))):
+        update_info = UpdateInfo(exp)
+        repo = UpdateRepo(update_info.repo_root, update_info.commit_id)
+        config = lsp_config_for(repo, [update_info.focal_relpath, update_info.test_relpath])
+        lsp = SyncLanguageServer.create(config, lsp_logger, update_info.repo_root)
+        with lsp.start_server():
+            # load and build
+            time.sleep(10)
+            res = compare_usages_scopes(lsp, repo, update_info, clean_tests)
+        logger.info(
+            f"item {i}: repo {len(res['repo'])} usages ({res['repo_time']:.1f}s), "
+            f"commit {len(res['commit'])} usages ({res['commit_time']:.1f}s), "
+            f"lost {len(res['lost'])}, extra {len(res['extra'])}"
+        )
+        for text in res["lost"]:
+            logger.warning(f"item {i}: lost usage diff:\n{text}")
+        results.append(res)
+    n = len(results)
+    logger.info(
+        f"{n} examples: {sum(len(r['repo']) for r in results)} repo usages, "
+        f"{sum(len(r['lost']) for r in results)} lost by the commit scope "
+        f"in {sum(bool(r['lost']) for r in results)} examples, "
+        f"repo {sum(r['repo_time'] for r in results):.1f}s, commit {sum(r['commit_time'] for r in results):.1f}s"
+    )
 
 
 if __name__ == "__main__":
-    logger.info("This module is used in main_retriever")
-    pass
+    # validate the native diffctx mode against the reformat mode: python -m retriever.global_collector [datafile]
+    # validate the commit scope of the usages against the repo scope: python -m retriever.global_collector usages [datafile] [n]
+    import sys
+    from utils.gitter import setup_repo
+    from utils.helper import read_examples
+
+    if len(sys.argv) > 1 and sys.argv[1] == "usages":
+        validate_usages_scopes(
+            sys.argv[2] if len(sys.argv) > 2 else "dataset/synPTCEvo4j/test_part.json",
+            int(sys.argv[3]) if len(sys.argv) > 3 else 50,
+        )
+        sys.exit(0)
+    datafile = sys.argv[1] if len(sys.argv) > 1 else "dataset/synPTCEvo4j/test.json"
+    logger.set_log_file("logs/validate_diffctx.log", "w")
+    results = []
+    for exp in read_examples(datafile):
+        repo = setup_repo(exp.repo_name, exp.commit_id)
+        for db in [exp.focal_db, exp.test_db]:
+            res = compare_diffctx_modes(
+                repo, db["rel_path"], db["method_src"], db["method_tgt"]
+            )
+            logger.info(
+                f"{exp.repo_name}@{exp.commit_id[:6]} {db['rel_path']}: "
+                f"add jaccard {res['add_jaccard']:.2f}, delete jaccard {res['delete_jaccard']:.2f}, "
+                f"reformat {res['reformat_time']:.3f}s, native {res['native_time']:.3f}s"
+            )
+            results.append(res)
+    n = len(results)
+    logger.info(
+        f"{n} files: mean add jaccard {sum(r['add_jaccard'] for r in results) / n:.3f}, "
+        f"mean delete jaccard {sum(r['delete_jaccard'] for r in results) / n:.3f}, "
+        f"identical changed tokens {sum(r['add_jaccard'] == r['delete_jaccard'] == 1.0 for r in results)}/{n}"
+    )
+    logger.info(
+        f"reformat {sum(r['reformat_time'] for r in results):.1f}s, native {sum(r['native_time'] for r in results):.1f}s"
+    )
@@ -11,7 +11,7 @@ from langchain_core.prompts.chat import (
     SystemMessagePromptTemplate,
 )
 from langchain_core.output_parsers import StrOutputParser
-from utils.llm import model_gpt4 as model
+from utils.llm import model_gpt4_cached as model
 from utils.helper import extract_code
 from utils.parser import get_code_without_comments
 from utils.formatter import formatted_java_code
@@ -104,7 +104,10 @@ def extract_stmts_to_update(
             "focal_tgt_sig": focal_tgt_sig,
         }
     ] * k
-    res = extract_chain.batch(query_batch)
+    # every sample has its own entry in the llm cache
+    res = extract_chain.batch(
+        query_batch, config=[{"metadata": {"sample_idx": i}} for i in range(k)]
+    )
     # min : more precise
     anal_final = min(res, key=lambda x: len(x[0]))[0]
     stmts_final = min(res, key=lambda x: len(x[1]))[1]
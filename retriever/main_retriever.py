@@ -4,7 +4,8 @@
     - Documents: collected global context from focal method by global_collector.
 """
 
-import time, random, json, os
+import time, random, json, os, atexit, dataclasses
+from contextlib import ExitStack
 from langsmith import Client
 from utils.types import UpdateInfo, RetCtx
 from utils.multilspy import SyncLanguageServer
@@ -13,18 +14,29 @@ from utils.multilspy.multilspy_logger import MultilspyLogger
 from utils.multilspy.multilspy_types import Position
 from utils.multilspy.multilspy_exceptions import MultilspyException
 from utils.gitter import UpdateRepo
+from utils.lsp_host import LSPHost
+from utils.deadline import (
+    deadline,
+    check_deadline,
+    remaining_seconds,
+    call_with_deadline,
+    DeadlineExceeded,
+)
 from utils.reranker import rerank_with_query, rerank_usages_with_query
-from utils.helper import read_examples, expand_pos_list_fmtf
+from utils.helper import expand_pos_list_fmtf
+from utils.dataset import ExampleDataset
 from utils.parser import (
     extract_method_metadata,
     get_param_idx_diff,
     get_new_types_poslist,
     get_method_signature,
     divide_texts_by_type,
+    get_source_root,
 )
 from .global_collector import (
     collect_method_diffctx,
     collect_usages_diffctx,
+    collect_usages_diffctx_scoped,
     collect_clsctx_for_params,
     collect_clsctx_for_return,
 )
@@ -33,14 +45,62 @@ from .local_extractor_operations import (
     extract_args_operations,
     extract_return_operations,
 )
+from utils.configs import (
+    USAGES_SCOPE,
+    LSP_MAX_OPEN_FILES,
+    LSP_IMPORT_MODE,
+    LSP_LIGHT_EXTRA_ROOTS,
+    LSP_INIT_PROFILE,
+    LSP_JVM_CDS,
+    LSP_MULTI_ROOT_FOLDERS,
+    STAGE_DEADLINES,
+)
 from utils.logger import logger
 
 
 # [SETUP] Basic config for LSP
 lsp_config = MultilspyConfig.from_dict(
-    {"code_language": "java", "trace_lsp_communication": True}
+    {
+        "code_language": "java",
+        "trace_lsp_communication": True,
+        "max_open_files": LSP_MAX_OPEN_FILES,
+        "init_profile": LSP_INIT_PROFILE,
+        "jvm_cds": LSP_JVM_CDS,
+    }
 )
 lsp_logger = MultilspyLogger()
+# the shared language server of the repos (if LSP_MULTI_ROOT_FOLDERS > 0), started by the first example
+lsp_host = None
+
+
+def get_lsp_host() -> LSPHost:
+    global lsp_host
+    if lsp_host is None:
+        lsp_host = LSPHost(lsp_config, lsp_logger, max_folders=LSP_MULTI_ROOT_FOLDERS)
+        atexit.register(lsp_host.close)
+    return lsp_host
+
+
+def lsp_config_for(
+    repo: UpdateRepo, rel_paths: list[str], import_mode: str = LSP_IMPORT_MODE
+) -> MultilspyConfig:
+    """
+    The LSP config to retrieve the contexts of the given files.
+    The light import is restricted to the source roots of the files (with their sibling test/main roots) and the extras.
+    """
+    if import_mode != "light":
+        return lsp_config
+    source_paths = set(LSP_LIGHT_EXTRA_ROOTS)
+    for rel_path in rel_paths:
+        root = get_source_root(repo.get_file_tgt(rel_path), rel_path) or "."
+        source_paths.add(root)
+        for main, test in [("/main/", "/test/"), ("/test/", "/main/")]:
+            sibling = f"/{root}/".replace(main, test, 1).strip("/")
+            if f"/{root}/" != f"/{sibling}/" and os.path.isdir(os.path.join(repo.working_tree_dir, sibling)):
+                source_paths.add(sibling)
+    return dataclasses.replace(
+        lsp_config, import_mode="light", source_paths=sorted(source_paths)
+    )
 
 
 # [Diff Context]Retrieve usages contexts
@@ -54,7 +114,17 @@ def run_usages_retriever(
     logger.info(f"[Enter Usages Retriever]")
     logger.info(f"+++ Starting Usages DiffCtx Retriever")
     logger.info(f"+ Running Usages DiffCtx Collector")
-    usage_diff_texts = list(collect_usages_diffctx(lsp, repo, update_info, clean_tests))
+    usage_diff_texts = []
+    # the collectors stop at the deadline with the usages found so far
+    with deadline("usages", STAGE_DEADLINES.get("usages"), degrade=True):
+        if USAGES_SCOPE == "commit":
+            usage_diff_texts = list(
+                collect_usages_diffctx_scoped(lsp, repo, update_info, clean_tests)
+            )
+        else:
+            usage_diff_texts = list(
+                collect_usages_diffctx(lsp, repo, update_info, clean_tests)
+            )
     logger.info(f"+ Found {len(usage_diff_texts)} diff texts for usages.")
     usage_info = "Usages diff texts of the focal method (examples of changes to use the updated focal method)"
 
@@ -382,15 +452,14 @@ def run_test_retriever(
     logger.info(f"$$$ Starting Test DiffCtx Retriever")
     logger.info(f"$ Running Test DiffCtx Collector")
     # For practical usage, test has not been updated. Therefore, test_tgt = test_src
-    if not update_info.test_tgt:
-        update_info.test_tgt = update_info.test_src
+    test_tgt = update_info.test_tgt or update_info.test_src
     # collect test method diffctx
     test_diff_texts = collect_method_diffctx(
         lsp,
         repo,
         update_info.test_relpath,
         update_info.test_src,
-        update_info.test_tgt,
+        test_tgt,
         "test",
         clean_tests,
     )
@@ -432,6 +501,73 @@ def run_general_retriever(
     return focal_retctx, test_retctx
 
 
+def retrieve_context_with_lsp(
+    lsp: SyncLanguageServer,
+    update_repo: UpdateRepo,
+    update_info: UpdateInfo,
+    clean_tests: bool = False,
+    save_cache=False,
+) -> list[RetCtx]:
+    """
+    Retrieve context with a started language server, which can be shared by the updates in one repo.
+    """
+    all_retctx = []
+    # extract stmts and analysis
+    focal_src_sig = get_method_signature(update_info.focal_src)
+    focal_tgt_sig = get_method_signature(update_info.focal_tgt)
+    # the usages and general retrievers need the stmts, a timeout of the extractor is raised as DeadlineExceeded("llm")
+    with deadline("llm", STAGE_DEADLINES.get("llm")):
+        anal, stmts = call_with_deadline(
+            extract_stmts_to_update, update_info.test_src, focal_src_sig, focal_tgt_sig
+        )
+    logger.info(f"$ [Local Extractor]Extracted focal diff analysis: {anal}")
+    logger.info(f"$ [Local Extractor]Extracted obsolete stmts:\n{stmts}")
+
+    # usages context
+    usages_retctx = run_usages_retriever(
+        lsp, update_info, update_repo, stmts, clean_tests
+    )
+    all_retctx.append(usages_retctx)
+    # class context (the partial contexts are kept at the stage deadline, the example deadline is checked between stages)
+    check_deadline()
+    class_retctx = []
+    with deadline("class", STAGE_DEADLINES.get("class"), degrade=True):
+        class_retctx = run_class_retriever(lsp, update_info)
+    all_retctx.extend(class_retctx)
+    # general context
+    check_deadline()
+    env_retctx = []
+    with deadline("general", STAGE_DEADLINES.get("general"), degrade=True):
+        env_retctx = run_general_retriever(
+            lsp, update_info, update_repo, anal, stmts, clean_tests
+        )
+    all_retctx.extend(env_retctx)
+
+    # save intermediate results
+    if save_cache:
+        cache_path = "outputs/SynBCIATR/cache.json"
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                caches = json.load(f)
+        else:
+            caches = []
+        caches.append(
+            {
+                "id": len(caches),
+                "Anal": anal,
+                "Stmts": stmts,
+                "UsagesCtx": usages_retctx,
+                "ClassCtx": class_retctx,
+                "EnvCtx": env_retctx,
+            }
+        )
+        with open(cache_path, "w") as f:
+            json.dump(caches, f, indent=4)
+        logger.info(f"Saved intermediate results to {cache_path}")
+
+    return all_retctx
+
+
 def retrieve_context(
     update_info: UpdateInfo, clean_tests: bool = False, save_cache=False
 ) -> list[RetCtx]:
@@ -443,61 +579,37 @@ def retrieve_context(
     args: clean_tests: ignore other test codes when extracting contexts if True
           save_cache: save the intermediate values to cache if True
     """
-    update_repo = UpdateRepo(update_info.repo_root, update_info.commit_id)
-
     repo_root = update_info.repo_root
-    lsp = SyncLanguageServer.create(lsp_config, lsp_logger, repo_root)
-    logger.info(f"Initializing LSP for {repo_root}")
-    all_retctx = []
-    with lsp.start_server():
-        # load and build
-        time.sleep(10)
-        logger.info(f"LSP loaded for {repo_root}")
-
-        # extract stmts and analysis
-        focal_src_sig = get_method_signature(update_info.focal_src)
-        focal_tgt_sig = get_method_signature(update_info.focal_tgt)
-        anal, stmts = extract_stmts_to_update(
-            update_info.test_src, focal_src_sig, focal_tgt_sig
-        )
-        logger.info(f"$ [Local Extractor]Extracted focal diff analysis: {anal}")
-        logger.info(f"$ [Local Extractor]Extracted obsolete stmts:\n{stmts}")
-
-        # usages context
-        usages_retctx = run_usages_retriever(
-            lsp, update_info, update_repo, stmts, clean_tests
-        )
-        all_retctx.append(usages_retctx)
-        # class context
-        class_retctx = run_class_retriever(lsp, update_info)
-        all_retctx.extend(class_retctx)
-        # general context
-        env_retctx = run_general_retriever(
-            lsp, update_info, update_repo, anal, stmts, clean_tests
-        )
-        all_retctx.extend(env_retctx)
-
-        # save intermediate results
-        if save_cache:
-            cache_path = "outputs/SynBCIATR/cache.json"
-            if os.path.exists(cache_path):
-                with open(cache_path, "r") as f:
-                    caches = json.load(f)
+    # the server is stopped (or the repo released) on exit, also when a deadline passes
+    with ExitStack() as stack:
+        lsp = None
+        with deadline("lsp_startup", STAGE_DEADLINES.get("lsp_startup"), degrade=True):
+            if LSP_MULTI_ROOT_FOLDERS > 0:
+                # the repo is a workspace folder of the shared server (the light import is per server, not used here),
+                # the host checks out the commit when the other users of the folder are done
+                lsp = stack.enter_context(
+                    get_lsp_host().repository(repo_root, update_info.commit_id)
+                )
+                update_repo = UpdateRepo(update_info.repo_root, update_info.commit_id)
             else:
-                caches = []
-            caches.append(
-                {
-                    "id": len(caches),
-                    "Anal": anal,
-                    "Stmts": stmts,
-                    "UsagesCtx": usages_retctx,
-                    "ClassCtx": class_retctx,
-                    "EnvCtx": env_retctx,
-                }
-            )
-            with open(cache_path, "w") as f:
-                json.dump(caches, f, indent=4)
-            logger.info(f"Saved intermediate results to {cache_path}")
+                update_repo = UpdateRepo(update_info.repo_root, update_info.commit_id)
+                config = lsp_config_for(
+                    update_repo, [update_info.focal_relpath, update_info.test_relpath]
+                )
+                server = SyncLanguageServer.create(config, lsp_logger, repo_root)
+                # the requests wait at most until the nearest deadline
+                server.request_timeout = remaining_seconds
+                logger.info(f"Initializing LSP for {repo_root}")
+                lsp = stack.enter_context(server.start_server())
+                # load and build
+                time.sleep(10)
+                logger.info(f"LSP loaded for {repo_root}")
+        if lsp is None:
+            logger.warning(f"LSP is not ready for {repo_root}, continue without contexts")
+            return []
+        all_retctx = retrieve_context_with_lsp(
+            lsp, update_repo, update_info, clean_tests, save_cache
+        )
 
     return all_retctx
 
@@ -513,18 +625,22 @@ if __name__ == "__main__":
     clean_tests = True
     logger.set_log_file("logs/main_retriever.log", mode="a")
 
-    examples = read_examples(input_dataset)
+    examples = ExampleDataset(input_dataset)
     logger.info(f"{'========='*5}")
     logger.info(f"{'========='*5}")
     logger.info(
         f"Start processing {len(examples)} items in {input_dataset} (collect caches, clean Tests: {clean_tests})"
     )
 
-    for i, exp in enumerate(examples):
+    for i, exp in examples.iter_examples():
         logger.info(f"==> Processing item: {i}")
         update_info = UpdateInfo(exp)
         # retctx_list = retrieve_context(update_info, clean_tests, save_cache=True)
-        retctx_list = retrieve_context(update_info, clean_tests, save_cache=True)
+        try:
+            retctx_list = retrieve_context(update_info, clean_tests, save_cache=True)
+        except DeadlineExceeded as e:
+            logger.error(f"[Deadline]Item {i} is skipped at the deadline of {e.stage}.")
+            continue
         contexts = ""
         for retctx in retctx_list:
             if len(retctx["contexts"]) > 0:
@@ -0,0 +1,141 @@
+"""
+    Practical repair mode: given only a commit and a focal method, locate the obsolete tests and retrieve their contexts.
+    No target test is required, tests are located by the method index of the test files instead of string search.
+"""
+
+import time
+from utils.types import UpdateInfo, RetCtx
+from utils.multilspy import SyncLanguageServer
+from utils.gitter import UpdateRepo, all_code_delete_lines, match_focal_paths
+from utils.deadline import DeadlineExceeded
+from utils.miner import is_test_path, changed_focal_pairs
+from utils.parser import (
+    all_methods_from_file,
+    has_method_invocation,
+    compare_syndiff,
+    get_methodname_with_pos,
+)
+from utils.multilspy.multilspy_utils import TextUtils
+from .main_retriever import lsp_config_for, lsp_logger, retrieve_context_with_lsp
+from utils.logger import logger
+
+
+def find_focal_change(
+    repo: UpdateRepo, focal_relpath: str, focal_name: str
+) -> tuple[str, str]:
+    """
+    Find the (focal_src, focal_tgt) of the method whose signature is changed by the commit.
+    Returns ("", "") if the method has no signature change.
+    """
+    delete_lines = all_code_delete_lines(repo.get_file_diff(focal_relpath))
+    pairs = changed_focal_pairs(
+        repo.get_file_src(focal_relpath), repo.get_file_tgt(focal_relpath), delete_lines
+    )
+    for focal_src, focal_tgt in pairs:
+        if get_methodname_with_pos(focal_tgt)[0] == focal_name:
+            return focal_src, focal_tgt
+    return "", ""
+
+
+def locate_tests(
+    repo: UpdateRepo,
+    focal_relpath: str,
+    focal_name: str,
+    focal_tgt: str,
+    lsp: SyncLanguageServer = None,
+) -> list[dict]:
+    """
+    Locate the test methods invoking the focal method in the tgt commit.
+    Test files: the tests of the focal file by naming convention, and the test files
+    referencing the focal method in the symbol index of the language server (if given).
+    Test methods are taken from the method index of the test files (name and line span).
+
+    Returns:
+        list[dict]: {"rel_path", "name", "text", "start_line", "end_line"}
+    """
+    all_paths = repo.git.ls_tree("-r", "--name-only", repo.commit_id).splitlines()
+    test_paths = {
+        p
+        for p in all_paths
+        if p.endswith(".java") and is_test_path(p) and match_focal_paths([p], [focal_relpath])
+    }
+    if lsp is not None:
+        focal_file = repo.get_file_tgt(focal_relpath)
+        method_start = focal_file.find(focal_tgt)
+        _, name_pos = get_methodname_with_pos(focal_tgt)
+        name_idx = TextUtils.get_index_from_line_col(
+            focal_tgt, name_pos["line"], name_pos["character"]
+        )
+        ln, cn = TextUtils.get_line_col_from_index(focal_file, method_start + name_idx)
+        for loc in lsp.request_references(focal_relpath, ln, cn):
+            if loc["uri"].startswith("file:") and is_test_path(loc["relativePath"]):
+                test_paths.add(loc["relativePath"])
+
+    tests = []
+    for test_path in sorted(test_paths):
+        for m in all_methods_from_file(repo.get_file_tgt(test_path)):
+            if "@Test" in m["text"] and has_method_invocation(m["text"], focal_name):
+                tests.append(
+                    {
+                        "rel_path": test_path,
+                        "name": m["name"],
+                        "text": m["text"],
+                        "start_line": m["start_line"],
+                        "end_line": m["end_line"],
+                    }
+                )
+    logger.info(f"Located {len(tests)} tests of {focal_name} in {len(test_paths)} test files")
+    return tests
+
+
+def retrieve_practical(
+    repo_root: str,
+    commit_id: str,
+    focal_relpath: str,
+    focal_name: str,
+    clean_tests: bool = True,
+) -> list[tuple[UpdateInfo, list[RetCtx]]]:
+    """
+    Retrieve the contexts for every test of the focal method changed by the commit,
+    all the tests share one language server.
+    """
+    update_repo = UpdateRepo(repo_root, commit_id)
+    focal_src, focal_tgt = find_focal_change(update_repo, focal_relpath, focal_name)
+    if not focal_src:
+        logger.warning(f"No signature change of {focal_name} in {focal_relpath}@{commit_id[:6]}")
+        return []
+    syn_diff = compare_syndiff(focal_src, focal_tgt)
+
+    results = []
+    # the tests are located by the server, the light import covers the test root next to the focal one
+    lsp = SyncLanguageServer.create(
+        lsp_config_for(update_repo, [focal_relpath]), lsp_logger, repo_root
+    )
+    logger.info(f"Initializing LSP for {repo_root}")
+    with lsp.start_server():
+        # load and build
+        time.sleep(10)
+        logger.info(f"LSP loaded for {repo_root}")
+        tests = locate_tests(update_repo, focal_relpath, focal_name, focal_tgt, lsp)
+        for test in tests:
+            logger.info(f"==> Retrieving contexts for test: {test['rel_path']}#{test['name']}")
+            update_info = UpdateInfo.practical(
+                repo_root,
+                commit_id,
+                focal_relpath,
+                focal_src,
+                focal_tgt,
+                syn_diff,
+                test["rel_path"],
+                test["text"],
+                (test["start_line"], test["end_line"]),
+            )
+            try:
+                retctx_list = retrieve_context_with_lsp(
+                    lsp, update_repo, update_info, clean_tests
+                )
+            except DeadlineExceeded as e:
+                logger.error(f"[Deadline]Test {test['name']} is skipped at the deadline of {e.stage}.")
+                continue
+            results.append((update_info, retctx_list))
+    return results
@@ -4,7 +4,9 @@
 
 import json
 import os
+import hashlib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from codebleu import calc_codebleu
 from codebleu.bleu import sentence_bleu
 from utils.formatter import formatted_java_code
@@ -13,74 +15,67 @@ from utils.logger import logger
 from utils.helper import get_diff
 
 do_pass = False
-
-# Baselines -- RQ1
-# eval_datafile = "outputs/CEPROT/test_ceprot.json"
-# type_info = "CEPROT"
-# eval_datafile = "outputs/NaiveLLM/test_woctx.json"
-# type_info = "NaiveLLM"
-eval_datafile = "outputs/SynBCIATR/test_all_ctx_wot.json"
-type_info = "SynBCIATR"
+k = 3
+# processes used to normalize code and compute metrics
+num_workers = os.cpu_count()
+
+# Baselines -- RQ1 (multiple outputs can be evaluated in one invocation)
+eval_targets = [
+    # ("CEPROT", "outputs/CEPROT/test_ceprot.json"),
+    # ("NaiveLLM", "outputs/NaiveLLM/test_woctx.json"),
+    ("SynBCIATR", "outputs/SynBCIATR/test_all_ctx_wot.json"),
+]
 eval_resfile = "outputs/Evaluation/RQ1/summary.json"
+# per-item scores of every evaluated output, only changed predictions are rescored
+eval_storedir = "outputs/Evaluation/RQ1/store"
 
+METRICS = ["accuracy", "codebleu", "diffbleu", "syntax_pass"]
 
-# eval_resfile = os.path.splitext(eval_datafile)[0] + "_eval.json"
-log_file = (
-    f"outputs/Evaluation/RQ1/{os.path.splitext(os.path.basename(eval_datafile))[0]}.log"
-)
-logger.set_log_file(log_file)
-
-
-def eval_accuracy(data):
-    """Evaluate the data based on accuracy."""
-    logger.info(f"{'=' * 10}[Accuracy]{'=' * 10}")
-    accus = []
-    for item in data:
-        if item["prediction"] == item["reference"]:
-            accus.append(1)
-            logger.info(f"{item['id']}: Accurately correct")
-        else:
-            accus.append(0)
-
-    accus = np.array(accus)
-    logger.info(f"Accuracy: {accus.sum()} / {len(data)} = {accus.sum()/len(data)}")
-    logger.info(f"{'=' * 10}[Accuracy]{'=' * 10}")
-    return accus
-
-
-def eval_codebleu(data):
-    """Evaluate the data based on CodeBLEU."""
-    logger.info(f"{'=' * 10}[CodeBLEU]{'=' * 10}")
-    # results = []
-    all_codebleu = []
-    for item in data:
-        prediction = filter_code(item["prediction"])
-        reference = filter_code(item["reference"])
-        result = calc_codebleu(
-            [prediction],
-            [reference],
-            lang="java",
-            weights=(0.25, 0.25, 0.25, 0.25),
-            tokenizer=None,
-        )
-        # results.append({"id": item["id"], "codebleu": result["codebleu"]})
-        logger.info(f"{item['id']}: {result['codebleu']:.2f}")
-        all_codebleu.append(result["codebleu"])
+# normalized(clean & formatted) code keyed by the hash of the raw code
+fmt_cache: dict[str, str] = dict()
+
+
+def text_hash(code: str) -> str:
+    return hashlib.sha1(code.encode()).hexdigest()
+
+
+def normalize_code(code: str) -> str:
+    """Remove comments and format the code, "" means format error."""
+    return formatted_java_code(get_code_without_comments(code))
 
-    all_codebleu = np.array(all_codebleu)
-    # logger.info(f"Highest codebleu: {max([r['codebleu'] for r in results])}")
-    # logger.info(f"Lowest codebleu: {min([r['codebleu'] for r in results])}")
-    codebleu_average = all_codebleu.sum() / len(data)
-    logger.info(f"Average codebleu: {codebleu_average}")
-    logger.info(f"{'=' * 10}[CodeBLEU]{'=' * 10}")
-    return all_codebleu
 
+def normalize_all(texts: list[str], executor: ProcessPoolExecutor):
+    """
+    Normalize all the unique texts in the process pool and store them in fmt_cache.
+    Originals and references shared by several outputs are only normalized once.
+    """
+    todo = dict()
+    for text in texts:
+        h = text_hash(text)
+        if h not in fmt_cache:
+            todo[h] = text
+    if not todo:
+        return
+    logger.info(f"Normalizing {len(todo)} unique code snippets with {num_workers} workers")
+    hashes = list(todo.keys())
+    fmts = executor.map(normalize_code, [todo[h] for h in hashes], chunksize=16)
+    for h, fmt in zip(hashes, fmts):
+        fmt_cache[h] = fmt
 
-def retain_new(pred, ref):
-    pred_clean = get_code_without_comments(pred)
-    ref_clean = get_code_without_comments(ref)
-    pred_fmt = formatted_java_code(pred_clean)
-    ref_fmt = formatted_java_code(ref_clean)
+
+def get_fmt(code: str) -> str:
+    h = text_hash(code)
+    if h not in fmt_cache:
+        fmt_cache[h] = normalize_code(code)
+    return fmt_cache[h]
+
+
+def retain_new(pred, ref, pred_fmt=None, ref_fmt=None):
+    """Collect the added texts from pred to ref. pred_fmt/ref_fmt: normalized code if available."""
+    if pred_fmt is None:
+        pred_fmt = normalize_code(pred)
+    if ref_fmt is None:
+        ref_fmt = normalize_code(ref)
 
     format_prefix = "@@\n\n"
     if pred_fmt and ref_fmt:
@@ -106,45 +101,142 @@ def tokenizer(s):
     return s.split()
 
 
-def eval_diffbleu(data):
-    logger.info(f"{'=' * 10}[DiffBLEU]{'=' * 10}")
-    diffbleu_all = []
-    for item in data:
-        pred_add = retain_new(item["original"], item["prediction"])
-        ref_add = retain_new(item["original"], item["reference"])
-        diffbleu = sentence_bleu([tokenizer(ref_add)], tokenizer(pred_add))
-        diffbleu_all.append(diffbleu)
-
-        logger.info(f"{item['id']}: DiffBLEU: {diffbleu:.2f}.")
-
-    diffbleu_all = np.array(diffbleu_all)
-    diffbleu_average = diffbleu_all.mean()
-
-    logger.info(f"Average DiffBLEU: {diffbleu_average}")
+def eval_item(task: tuple[dict, str, str, str]) -> dict:
+    """
+    Compute all the metrics for a single item in one pass.
+    task: (item, original_fmt, prediction_fmt, reference_fmt)
+    """
+    item, original_fmt, prediction_fmt, reference_fmt = task
+    original, prediction, reference = (
+        item["original"],
+        item["prediction"],
+        item["reference"],
+    )
+    # Accuracy
+    accuracy = 1 if prediction == reference else 0
+    # CodeBLEU
+    codebleu = calc_codebleu(
+        [filter_code(prediction)],
+        [filter_code(reference)],
+        lang="java",
+        weights=(0.25, 0.25, 0.25, 0.25),
+        tokenizer=None,
+    )["codebleu"]
+    # DiffBLEU
+    pred_add = retain_new(original, prediction, original_fmt, prediction_fmt)
+    ref_add = retain_new(original, reference, original_fmt, reference_fmt)
+    diffbleu = sentence_bleu([tokenizer(ref_add)], tokenizer(pred_add))
+    # Syntax Pass
+    syntax_pass = 0 if has_parse_error(prediction) else 1
+    return {
+        "id": item["id"],
+        "accuracy": accuracy,
+        "codebleu": codebleu,
+        "diffbleu": diffbleu,
+        "syntax_pass": syntax_pass,
+    }
 
-    logger.info(f"{'=' * 10}[DiffBLEU]{'=' * 10}")
-    return diffbleu_all
 
+def eval_data(data: list[dict], executor: ProcessPoolExecutor) -> dict[str, np.ndarray]:
+    """Evaluate the data on all the metrics, items are evaluated in the process pool."""
+    tasks = [
+        (
+            item,
+            get_fmt(item["original"]),
+            get_fmt(item["prediction"]),
+            get_fmt(item["reference"]),
+        )
+        for item in data
+    ]
+    results = list(executor.map(eval_item, tasks, chunksize=8))
+    for res in results:
+        logger.info(
+            f"{res['id']}: Accuracy: {res['accuracy']}, CodeBLEU: {res['codebleu']:.2f}, DiffBLEU: {res['diffbleu']:.2f}, Syntax Pass: {res['syntax_pass']}"
+        )
+    return {
+        metric: np.array([res[metric] for res in results], dtype=float)
+        for metric in METRICS
+    }
 
-def eval_syntaxpass(data):
-    """Check the syntax of the code."""
-    logger.info(f"{'=' * 10}[Syntax Pass]{'=' * 10}")
-    syntax_pass = []
-    for item in data:
-        code = item["prediction"]
-        if has_parse_error(code):
-            syntax_pass.append(0)
-            logger.info(f"Syntax error: {item['id']}")
-        else:
-            syntax_pass.append(1)
 
-    syntax_pass = np.array(syntax_pass)
-    pass_rate = syntax_pass.mean()
+def log_scores(scores: dict[str, np.ndarray]):
+    """Log the corpus-level results of the per-item scores."""
+    n = len(scores["accuracy"])
+    logger.info(f"Accuracy: {int(scores['accuracy'].sum())} / {n} = {scores['accuracy'].mean()}")
+    logger.info(f"Average codebleu: {scores['codebleu'].mean()}")
+    logger.info(f"Average DiffBLEU: {scores['diffbleu'].mean()}")
     logger.info(
-        f"Average Pass Rate of Syntax: {syntax_pass.sum()} / {len(data)} = {pass_rate}"
+        f"Average Pass Rate of Syntax: {int(scores['syntax_pass'].sum())} / {n} = {scores['syntax_pass'].mean()}"
     )
-    logger.info(f"{'=' * 10}[Syntax Pass]{'=' * 10}")
-    return syntax_pass
+
+
+def item_key(item: dict) -> str:
+    """id and the hash of the prediction (with its original and reference) of an item."""
+    content = "\0".join([item["original"], item["prediction"], item["reference"]])
+    return f"{item['id']}:{text_hash(content)}"
+
+
+def store_path(eval_datafile: str, sample_idx: int, pass_mode: bool = False) -> str:
+    """
+    The store of the per-item scores of a sample, the outputs with the same file name in different directories
+    (and the pass@k samples of an output) have their own stores.
+    """
+    name = os.path.splitext(os.path.basename(eval_datafile))[0]
+    path_hash = text_hash(os.path.abspath(eval_datafile))[:8]
+    tag = "pass" if pass_mode else "single"
+    return os.path.join(eval_storedir, f"{name}_{path_hash}_{tag}_s{sample_idx}.npz")
+
+
+def match_store(
+    data: list[dict], path: str
+) -> tuple[np.ndarray, dict[str, np.ndarray], np.ndarray]:
+    """
+    Match the items with the stored per-item scores.
+
+    Returns:
+        keys: the item keys of the data.
+        scores: per-item scores, the stale items are filled with 0.
+        stale_idx: the indices of the items to (re)score.
+    """
+    keys = np.array([item_key(item) for item in data])
+    scores = {metric: np.zeros(len(data)) for metric in METRICS}
+    found = np.zeros(len(data), dtype=bool)
+    if os.path.exists(path) and len(data) > 0:
+        store = np.load(path)
+        if len(store["keys"]) > 0:
+            order = np.argsort(store["keys"])
+            sorted_keys = store["keys"][order]
+            pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+            found = sorted_keys[pos] == keys
+            for metric in METRICS:
+                scores[metric][found] = store[metric][order[pos[found]]]
+    return keys, scores, np.flatnonzero(~found)
+
+
+def save_store(path: str, keys: np.ndarray, scores: dict[str, np.ndarray]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, keys=keys, **scores)
+
+
+def update_summary(resfile: str, res: dict):
+    """Replace the result of the same approach in the summary (a list of results)."""
+    results = []
+    if os.path.exists(resfile):
+        with open(resfile) as f:
+            content = f.read().strip()
+        # the previous summary may be a sequence of appended json objects
+        decoder = json.JSONDecoder()
+        idx = 0
+        while idx < len(content):
+            obj, end = decoder.raw_decode(content, idx)
+            results.extend(obj if isinstance(obj, list) else [obj])
+            idx = end
+            while idx < len(content) and content[idx].isspace():
+                idx += 1
+    results = [r for r in results if r.get("Approach") != res["Approach"]]
+    results.append(res)
+    with open(resfile, "w") as fo:
+        json.dump(results, fo, indent=4)
 
 
 def read_data(filename):
@@ -153,46 +245,95 @@ def read_data(filename):
     return data
 
 
-if __name__ == "__main__":
-    logger.info(f"#########{type_info}#########")
-
-    if do_pass:
-        k = 3
-        accus_full = np.array([])
-        codebleu_full = np.array([])
-        diffbleu_full = np.array([])
-        syntax_pass_full = np.array([])
-
-        for i in range(k):
-            logger.info(f"\n{'***' * 4}[Pass-{i+1}]{'***' * 4}\n")
-            datafile = f"{os.path.splitext(eval_datafile)[0]}_n{i+1}.json"
-            data = read_data(datafile)
-            accus_full = np.append(accus_full, eval_accuracy(data))
-            codebleu_full = np.append(codebleu_full, eval_codebleu(data))
-            diffbleu_full = np.append(diffbleu_full, eval_diffbleu(data))
-            syntax_pass_full = np.append(syntax_pass_full, eval_syntaxpass(data))
-
-        accus_agg = np.max(accus_full.reshape((3, -1)), axis=0)
-        codebleu_agg = np.max(codebleu_full.reshape((3, -1)), axis=0)
-        diffbleu_agg = np.max(diffbleu_full.reshape((3, -1)), axis=0)
-        syntax_pass_agg = np.max(syntax_pass_full.reshape((3, -1)), axis=0)
+def read_pass_data(filename, k):
+    """
+    Read k lists of samples for pass@k evaluation.
+    Samples are taken from the "predictions" of a single pass@k output (run_update_ctx with pass_k),
+    otherwise from the separate runs in xxx_n1.json ... xxx_nk.json.
+    """
+    if os.path.exists(filename):
+        data = read_data(filename)
+        if data and "predictions" in data[0]:
+            short = [item for item in data if len(item["predictions"]) < k]
+            if short:
+                raise ValueError(
+                    f"pass@{k} needs {k} predictions per item, {len(short)} items of {filename} have fewer "
+                    f"(e.g. item {short[0]['id']} has {len(short[0]['predictions'])}), "
+                    f"rerun run_update_ctx.py with pass_k >= {k}"
+                )
+            return [
+                [{**item, "prediction": item["predictions"][i]} for item in data]
+                for i in range(k)
+            ]
+    return [read_data(f"{os.path.splitext(filename)[0]}_n{i+1}.json") for i in range(k)]
+
 
+if __name__ == "__main__":
+    if len(eval_targets) == 1:
+        eval_datafile = eval_targets[0][1]
+        log_file = f"outputs/Evaluation/RQ1/{os.path.splitext(os.path.basename(eval_datafile))[0]}.log"
     else:
-        with open(eval_datafile) as f:
-            data: list = json.load(f)
-        logger.info(f"Start evaluating {len(data)} items in {eval_datafile}")
-        accus_agg = eval_accuracy(data)
-        codebleu_agg = eval_codebleu(data)
-        diffbleu_agg = eval_diffbleu(data)
-        syntax_pass_agg = eval_syntaxpass(data)
-
-    res = {
-        "Approach": f"{type_info}({eval_datafile})",
-        "Accuracy": accus_agg.mean(),
-        "Codebleu": codebleu_agg.mean(),
-        "DiffBLEU": diffbleu_agg.mean(),
-        "syntax_pass": syntax_pass_agg.mean(),
-    }
-    with open(eval_resfile, "a") as fo:
-        json.dump(res, fo, indent=4)
-        fo.write("\n")
+        log_file = "outputs/Evaluation/RQ1/evaluate_all.log"
+    logger.set_log_file(log_file)
+
+    # read all the outputs
+    all_datasets: list[list[list[dict]]] = []
+    for type_info, eval_datafile in eval_targets:
+        datasets = read_pass_data(eval_datafile, k) if do_pass else [read_data(eval_datafile)]
+        all_datasets.append(datasets)
+
+    # match every sample with the stored scores, only stale items are evaluated
+    pending = []
+    for (type_info, eval_datafile), datasets in zip(eval_targets, all_datasets):
+        for i, data in enumerate(datasets):
+            path = store_path(eval_datafile, i, do_pass)
+            keys, scores, stale_idx = match_store(data, path)
+            pending.append((path, data, keys, scores, stale_idx))
+    stale_count = sum(len(p[4]) for p in pending)
+    total_count = sum(len(p[1]) for p in pending)
+    logger.info(f"{stale_count} / {total_count} items need to be evaluated")
+
+    with ProcessPoolExecutor(num_workers) as executor:
+        # shared preprocessing: normalize originals, predictions and references of all stale items at once
+        all_texts = []
+        for _, data, _, _, stale_idx in pending:
+            for j in stale_idx:
+                item = data[j]
+                all_texts.extend([item["original"], item["prediction"], item["reference"]])
+        normalize_all(all_texts, executor)
+
+        for path, data, keys, scores, stale_idx in pending:
+            if len(stale_idx) == 0:
+                continue
+            new_scores = eval_data([data[j] for j in stale_idx], executor)
+            for metric in METRICS:
+                scores[metric][stale_idx] = new_scores[metric]
+            save_store(path, keys, scores)
+
+    pending_iter = iter(pending)
+    for (type_info, eval_datafile), datasets in zip(eval_targets, all_datasets):
+        logger.info(f"#########{type_info}#########")
+        logger.info(f"Results of {len(datasets[0])} items in {eval_datafile}")
+        all_scores = []
+        for i in range(len(datasets)):
+            if do_pass:
+                logger.info(f"\n{'***' * 4}[Pass-{i+1}]{'***' * 4}\n")
+            scores = next(pending_iter)[3]
+            log_scores(scores)
+            all_scores.append(scores)
+        # pass@k: the max score over k samples for every item
+        agg = {
+            metric: np.max(np.stack([s[metric] for s in all_scores]), axis=0)
+            for metric in METRICS
+        }
+
+        res = {
+            "Approach": f"{type_info}({eval_datafile})",
+            "Accuracy": agg["accuracy"].mean(),
+            "Codebleu": agg["codebleu"].mean(),
+            "DiffBLEU": agg["diffbleu"].mean(),
+            "syntax_pass": agg["syntax_pass"].mean(),
+        }
+        if do_pass:
+            res["Approach"] += f"[pass@{k}]"
+        update_summary(eval_resfile, res)
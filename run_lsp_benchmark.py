@@ -0,0 +1,154 @@
+"""
+    Benchmark the startup profiles of the language server on the dataset:
+    startup time (and handshake latency), memory of the server, and the hit rate of the definition/reference requests issued by the retrievers.
+    Every launch imports the repository in a fresh workspace (persistent_workspace=False),
+    so that a profile does not start from the index built by another one.
+    The cds profile also counts the classes of the JVM served by the archive (jvm_cds_log).
+"""
+
+import json, os, time, dataclasses
+from utils.types import UpdateInfo
+from utils.dataset import ExampleDataset
+from utils.gitter import UpdateRepo
+from utils.multilspy import SyncLanguageServer
+from utils.multilspy.multilspy_utils import TextUtils
+from utils.parser import get_methodname_with_pos, find_method_invocations
+from retriever.main_retriever import lsp_config_for, lsp_logger
+from utils.logger import logger
+
+
+def probe_requests(lsp: SyncLanguageServer, repo: UpdateRepo, update_info: UpdateInfo) -> dict:
+    """
+    references: the usages of the focal method (as collect_usages_diffctx).
+    definition: the focal method invoked by the test method.
+    """
+    focal_file = repo.get_file_tgt(update_info.focal_relpath)
+    name, name_pos = get_methodname_with_pos(update_info.focal_tgt)
+    name_idx = TextUtils.get_index_from_line_col(
+        update_info.focal_tgt, name_pos["line"], name_pos["character"]
+    )
+    method_start = focal_file.find(update_info.focal_tgt)
+    ln, cn = TextUtils.get_line_col_from_index(focal_file, method_start + name_idx)
+    start = time.time()
+    refs = lsp.request_references(update_info.focal_relpath, ln, cn)
+    ref_seconds = time.time() - start
+    ref_locs = sorted(
+        f"{loc['relativePath']}:{loc['range']['start']['line']}"
+        for loc in refs
+        if loc["uri"].startswith("file:")
+    )
+
+    test_file = repo.get_file_tgt(update_info.test_relpath)
+    test_start = test_file.find(update_info.test_tgt)
+    test_ln = TextUtils.get_line_col_from_index(test_file, max(test_start, 0))[0]
+    test_end_ln = test_ln + update_info.test_tgt.count("\n")
+    calls = [
+        call
+        for call in find_method_invocations(test_file, name)
+        if test_start != -1 and test_ln <= call["line"] <= test_end_ln
+    ]
+    def_hit = None
+    if calls:
+        locs = lsp.request_definition(
+            update_info.test_relpath, calls[0]["line"], calls[0]["character"]
+        )
+        def_hit = any(loc["relativePath"] == update_info.focal_relpath for loc in locs)
+    return {
+        "ref_locs": ref_locs,
+        "ref_hit": len(ref_locs) > 0,
+        "ref_seconds": round(ref_seconds, 3),
+        "def_hit": def_hit,
+    }
+
+
+def main():
+    input_dataset = "dataset/synPTCEvo4j/test_part.json"
+    output_file = "outputs/LSPBench/profiles.json"
+    # number of examples to benchmark (the first ones of the dataset)
+    max_examples = 20
+    # profile name -> overrides of the lsp config (the fields of MultilspyConfig)
+    profiles = {
+        "full": {"import_mode": "full", "init_profile": "full"},
+        "light": {"import_mode": "light", "init_profile": "full"},
+        "retrieval": {"import_mode": "full", "init_profile": "retrieval"},
+        # the first launch creates the archive, the later ones map it
+        "cds": {"import_mode": "full", "init_profile": "full", "jvm_cds": True, "jvm_cds_log": True},
+    }
+    # a cold import per launch: the workspaces of the profiles would be shared otherwise (same repository and import mode)
+    common_overrides = {"persistent_workspace": False}
+    logger.set_log_file("logs/run_lsp_benchmark.log", "a")
+
+    examples = ExampleDataset(input_dataset)
+    results = {name: [] for name in profiles}
+    for i, exp in examples.iter_examples(ids=list(range(min(max_examples, len(examples))))):
+        update_info = UpdateInfo(exp)
+        repo = UpdateRepo(update_info.repo_root, update_info.commit_id)
+        for name, overrides in profiles.items():
+            config = lsp_config_for(
+                repo,
+                [update_info.focal_relpath, update_info.test_relpath],
+                overrides.get("import_mode", "full"),
+            )
+            config = dataclasses.replace(config, **common_overrides, **overrides)
+            lsp = SyncLanguageServer.create(config, lsp_logger, update_info.repo_root)
+            start = time.time()
+            with lsp.start_server():
+                startup_seconds = time.time() - start
+                record = {"id": i, "startup_seconds": round(startup_seconds, 3)}
+                record.update(lsp.language_server.startup_metrics or {})
+                try:
+                    record.update(probe_requests(lsp, repo, update_info))
+                except Exception as e:
+                    logger.error(f"[{name}] Probe failed for item {i}: {e}")
+                    record.update({"ref_locs": [], "ref_hit": False, "def_hit": False})
+                # memory and cpu time of the server's process tree after the requests
+                record["usage"] = lsp.language_server.server.resource_usage()
+            results[name].append(record)
+            logger.info(
+                f"[{name}] item {i}: startup {record['startup_seconds']}s, "
+                f"{len(record['ref_locs'])} references, definition hit: {record['def_hit']}"
+            )
+
+    # summary, the reference recall is against the first profile
+    base_name = list(profiles)[0]
+    summary = {}
+    for name, records in results.items():
+        defs = [r["def_hit"] for r in records if r["def_hit"] is not None]
+        recalls = []
+        for record, base in zip(records, results[base_name]):
+            if base["ref_locs"]:
+                recalls.append(
+                    len(set(record["ref_locs"]) & set(base["ref_locs"])) / len(base["ref_locs"])
+                )
+        handshakes = [r["handshake_seconds"] for r in records if "handshake_seconds" in r]
+        # launches that mapped the cds archive, and the share of their classes served by the archive of JDTLS
+        cds_used = [r["startup_seconds"] for r in records if r.get("cds") == "use"]
+        cds_classes = [r["cds_classes"] for r in records if r.get("cds") == "use" and r.get("cds_classes")]
+        loaded = sum(c["loaded"] for c in cds_classes)
+        rss = [r["usage"]["rss_mb"] for r in records if r.get("usage")]
+        summary[name] = {
+            "examples": len(records),
+            "mean_startup_seconds": round(sum(r["startup_seconds"] for r in records) / max(len(records), 1), 3),
+            "mean_handshake_seconds": round(sum(handshakes) / len(handshakes), 3) if handshakes else None,
+            "mean_startup_seconds_with_cds": round(sum(cds_used) / len(cds_used), 3) if cds_used else None,
+            "cds_top_archive_class_share": (
+                round(sum(c["top_archive"] for c in cds_classes) / loaded, 3) if loaded else None
+            ),
+            "cds_base_archive_class_share": (
+                round(sum(c["base_archive"] for c in cds_classes) / loaded, 3) if loaded else None
+            ),
+            "mean_rss_mb": round(sum(rss) / len(rss), 1) if rss else None,
+            "ref_hit_rate": round(sum(r["ref_hit"] for r in records) / max(len(records), 1), 3),
+            "def_hit_rate": round(sum(defs) / len(defs), 3) if defs else None,
+            f"ref_recall_vs_{base_name}": round(sum(recalls) / len(recalls), 3) if recalls else None,
+        }
+        logger.info(f"[{name}] {summary[name]}")
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, "w") as fo:
+        json.dump({"summary": summary, "results": results}, fo, indent=4)
+    logger.info(f"Benchmark results are written to {output_file}.")
+
+
+if __name__ == "__main__":
+    main()
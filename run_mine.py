@@ -0,0 +1,28 @@
+"""
+    Mine Repositories for Production-test Co-evolution Candidates
+"""
+
+from utils.miner import mine_repo
+from utils.logger import logger
+
+
+def main():
+    # config for mining
+    repo_names = ["Alluxio/alluxio"]
+    output_datafile = "dataset/mined/candidates.jsonl"
+    # -1: the whole history
+    max_count = -1
+
+    # logger setup
+    logger.set_log_file("logs/run_mine.log", "a")
+
+    total_count = 0
+    for repo_name in repo_names:
+        total_count += mine_repo(repo_name, output_datafile, max_count=max_count)
+    logger.info(
+        f"{total_count} new candidate commits of {len(repo_names)} repos are written to {output_datafile}."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+    Run SynBCIATR in Practical Mode: repair the tests of a focal method changed by a fresh commit
+"""
+
+import json, os
+from retriever.practical_retriever import retrieve_practical
+from run_update_ctx import chain, construct_update_query
+from utils.configs import REPO_BASE
+from utils.llm import llm_cache
+from utils.logger import logger
+
+
+def main():
+    # config for the commit and the focal method (no target tests are needed)
+    repo_name = "Alluxio/alluxio"
+    commit_id = "c1daabcbd9a604557d7ca3d05d3d8a63f95d2885"
+    focal_relpath = "core/common/src/main/java/alluxio/util/SecurityUtils.java"
+    focal_name = "getGroupFromGrpcClient"
+    output_datafile = f"outputs/Practical/{commit_id[:8]}_{focal_name}.json"
+    clean_tests = True
+
+    # logger setup
+    logger.set_log_file("logs/run_practical.log", "a")
+
+    repo_root = os.path.join(REPO_BASE, repo_name)
+    results = retrieve_practical(
+        repo_root, commit_id, focal_relpath, focal_name, clean_tests
+    )
+    outputs = []
+    for update_info, retctx_list in results:
+        update_query = construct_update_query(update_info, clean_tests, retctx_list)
+        res = chain.invoke(update_query)
+        outputs.append(
+            {
+                "id": len(outputs),
+                "test_relpath": update_info.test_relpath,
+                "test_lines": update_info.test_lines,
+                "original": update_query["test_src"],
+                "prediction": res,
+            }
+        )
+        if res:
+            logger.info(f"Output updated test code:\n{res}")
+        else:
+            logger.error(f"[Parse Error]LLM output cannot be parsed as code.")
+
+    os.makedirs(os.path.dirname(output_datafile), exist_ok=True)
+    with open(output_datafile, "w") as fo:
+        json.dump(outputs, fo, indent=4)
+    logger.info(f"All {len(outputs)} repaired tests are written to {output_datafile}.")
+    llm_cache.log_stats()
+
+
+if __name__ == "__main__":
+    main()
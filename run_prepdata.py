@@ -0,0 +1,36 @@
+"""
+    Build the Dataset from Mined Candidate Commits
+"""
+
+import json
+from utils.miner import build_dataset, read_jsonl
+from utils.logger import logger
+
+
+def main():
+    # config for data files
+    candidate_datafile = "dataset/mined/candidates.jsonl"
+    output_datafile = "dataset/mined/examples.jsonl"
+    # json list that can be read by read_examples
+    export_datafile = "dataset/mined/examples.json"
+
+    # logger setup
+    logger.set_log_file("logs/run_prepdata.log", "a")
+
+    build_dataset(candidate_datafile, output_datafile)
+
+    # export the examples as a json list (streamed, examples are not all loaded)
+    count = 0
+    with open(export_datafile, "w") as fo:
+        fo.write("[\n")
+        for record in read_jsonl(output_datafile):
+            if count > 0:
+                fo.write(",\n")
+            fo.write(json.dumps(record, indent=4))
+            count += 1
+        fo.write("\n]\n")
+    logger.info(f"All {count} examples are written to {export_datafile}.")
+
+
+if __name__ == "__main__":
+    main()
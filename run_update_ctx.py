@@ -3,7 +3,7 @@
 """
 
 import json, time, os
-from utils.configs import LANGCHAIN_API_KEY
+from utils.configs import LANGCHAIN_API_KEY, STAGE_DEADLINES, EXAMPLE_DEADLINE
 from langsmith import Client
 from langchain_core.prompts.chat import (
     ChatPromptTemplate,
@@ -15,8 +15,10 @@ from utils.types import UpdateInfo
 from utils.parser import get_code_without_comments
 from utils.formatter import formatted_java_code
 from retriever.main_retriever import retrieve_context
-from utils.helper import get_diff, read_examples, extract_code
-from utils.llm import model_gpt4 as model
+from utils.helper import get_diff, extract_code
+from utils.dataset import ExampleDataset
+from utils.deadline import deadline, call_with_deadline, DeadlineExceeded
+from utils.llm import model_gpt4_cached as model, llm_cache
 from utils.logger import logger
 
 # Langsmith setup
@@ -58,9 +60,12 @@ prompt = ChatPromptTemplate.from_messages(
 chain = prompt | model | StrOutputParser() | extract_code
 
 
-def construct_update_query(update_info: UpdateInfo, clean_tests: bool = False) -> dict:
+def construct_update_query(
+    update_info: UpdateInfo, clean_tests: bool = False, retctx_list: list = None
+) -> dict:
     """
     For every example in the dataset, construct the query with inputs and contexts
+    retctx_list: the contexts already retrieved (e.g. in practical mode), retrieved here if None
     """
     # Construct query
     query_json = dict()
@@ -83,7 +88,8 @@ def construct_update_query(update_info: UpdateInfo, clean_tests: bool = False) -
     query_json["test_src"] = test_src_fmt if test_src_fmt else update_info.test_src
     # retrieve contexts
     contexts = ""
-    retctx_list = retrieve_context(update_info, clean_tests, save_cache=True)
+    if retctx_list is None:
+        retctx_list = retrieve_context(update_info, clean_tests, save_cache=True)
     for retctx in retctx_list:
         if len(retctx["contexts"]) > 0:
             contexts += f'- {retctx["info"]}\n'
@@ -106,50 +112,94 @@ def main():
     write_to_file = True
     # Default Setting: we ignore contexts in the test codes
     clean_tests = True
+    # pass@k: retrieve contexts once and sample k predictions for every item
+    pass_k = 1
+    if pass_k > 1:
+        output_datafile = f"{os.path.splitext(output_datafile)[0]}_pass{pass_k}.json"
     # construct query_json from datafile
     error_list = []
+    # the items timed out at a deadline (also in error_list), retried on the next run
+    timeout_list = []
     outputs = []
 
-    examples = read_examples(query_datafile)
+    examples = ExampleDataset(query_datafile)
     logger.info(f"{'*******'*5}")
     logger.info(f"{'*******'*5}")
     logger.info(
-        f"Start processing {len(examples)} items in {query_datafile} (write_to_file:{write_to_file}, clean_tests:{clean_tests})"
+        f"Start processing {len(examples)} items in {query_datafile} (write_to_file:{write_to_file}, clean_tests:{clean_tests}, pass_k:{pass_k})"
     )
 
-    # incremental update
+    # incremental update, the items timed out in the previous runs are processed again first
     processed_count = 0
+    retry_ids = []
     if write_to_file and os.path.exists(output_datafile):
         with open(output_datafile, "r") as fo:
             content = json.load(fo)
         if content:
             outputs = content
             processed_count = len(outputs)
+            retry_ids = [o["id"] for o in outputs if o.get("status") == "timeout"]
             # not include
-            logger.info(f"Continue processing from item: {outputs[-1]['id']}")
+            logger.info(f"Continue processing from item: {outputs[-1]['id']}, retry timed out items: {retry_ids}")
+    # position of every item in outputs
+    positions = {o["id"]: pos for pos, o in enumerate(outputs)}
 
-    for i, exp in enumerate(examples[processed_count:]):
-        i = processed_count + i
+    ids = retry_ids + list(range(processed_count, len(examples)))
+    for i, exp in examples.iter_examples(ids=ids):
         logger.info(f"==> Processing item: {i}")
 
         # construct query and invoke LLM chain
         update_info = UpdateInfo(exp)
-        update_query = construct_update_query(update_info, clean_tests)
-        res = chain.invoke(update_query)
+        timeout_stage = None
+        try:
+            with deadline("example", EXAMPLE_DEADLINE):
+                update_query = construct_update_query(update_info, clean_tests)
+                with deadline("llm", STAGE_DEADLINES.get("llm")):
+                    if pass_k > 1:
+                        # k concurrent samples sharing the same query (cached by sample index)
+                        res_list = call_with_deadline(
+                            chain.batch,
+                            [update_query] * pass_k,
+                            config=[{"metadata": {"sample_idx": k}} for k in range(pass_k)],
+                        )
+                        # the first sample that can be parsed as code
+                        res = next((r for r in res_list if r), "")
+                    else:
+                        res = call_with_deadline(chain.invoke, update_query)
+        except DeadlineExceeded as e:
+            # the language server of the item is already stopped, record the item without prediction
+            timeout_stage = e.stage
+            update_query = {"test_src": update_info.test_src}
+            res, res_list = "", [""] * pass_k
 
         test_tgt_clean = get_code_without_comments(exp.test_db["method_tgt"])
         test_tgt_fmt = formatted_java_code(test_tgt_clean)
-        outputs.append(
-            {
-                "id": i,
-                "original": update_query["test_src"],
-                "prediction": res,
-                "reference": test_tgt_fmt,
-            }
-        )
+        output = {
+            "id": i,
+            "original": update_query["test_src"],
+            "prediction": res,
+            "reference": test_tgt_fmt,
+        }
+        if timeout_stage:
+            output["status"] = "timeout"
+            output["timeout_stage"] = timeout_stage
+        if pass_k > 1:
+            output["predictions"] = res_list
+            logger.info(
+                f"Sampled {pass_k} predictions, {sum(1 for r in res_list if r)} can be parsed as code."
+            )
+        if i in positions:
+            outputs[positions[i]] = output
+        else:
+            positions[i] = len(outputs)
+            outputs.append(output)
         if res:
             logger.info(f"Output updated test code:\n{res}")
             logger.info(f"Complete for item: {i}; Error list: {error_list}")
+        elif timeout_stage:
+            logger.error(f"[Deadline]Item {i} timed out at the deadline of {timeout_stage}, retried on the next run.")
+            error_list.append(i)
+            timeout_list.append(i)
         else:
             logger.error(f"[Parse Error]LLM output cannot be parsed as code.")
             error_list.append(i)
@@ -168,9 +218,14 @@ def main():
             logger.error(
                 f"Error occurs in process!\nError list[{len(error_list)}]: {error_list}"
             )
+        if len(timeout_list) > 0:
+            logger.error(
+                f"Timed out at deadlines[{len(timeout_list)}]: {timeout_list}"
+            )
         logger.info(
             f"All {len(examples)-len(error_list)} results are written to {output_datafile}."
         )
+    llm_cache.log_stats()
 
 
 if __name__ == "__main__":
@@ -14,8 +14,9 @@ from langchain_core.output_parsers import StrOutputParser
 from utils.types import UpdateInfo
 from utils.parser import get_code_without_comments
 from utils.formatter import formatted_java_code
-from utils.helper import get_diff, read_examples, extract_code
-from utils.llm import model_gpt4 as model
+from utils.helper import get_diff, extract_code
+from utils.dataset import ExampleDataset
+from utils.llm import model_gpt4_cached as model, llm_cache
 from utils.logger import logger
 
 # Langsmith setup
@@ -91,7 +92,7 @@ def main():
     # logger setup
     logger.set_log_file("logs/run_update_woctx.log")
 
-    examples = read_examples(query_datafile)
+    examples = ExampleDataset(query_datafile)
 
     logger.info(f"{'@@@@@@@'*5}")
     logger.info(f"{'@@@@@@@'*5}")
@@ -112,8 +113,7 @@ def main():
             # not include
             logger.info(f"Continue processing from item: {outputs[-1]['id']}")
 
-    for i, exp in enumerate(examples[processed_count:]):
-        i = processed_count + i
+    for i, exp in examples.iter_examples(start=processed_count):
         logger.info(f"==> Processing item: {i}")
 
         # construct query and invoke LLM chain
@@ -155,6 +155,7 @@ def main():
         logger.info(
             f"All {len(examples)-len(error_list)} results are written to {output_datafile}."
         )
+    llm_cache.log_stats()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,12 @@
 # The path where you save all the repos
 REPO_BASE = "xxxxxxx/SynPTCEvo4J/repos"
 
+# The path of the shared bare object stores (one per upstream repo, see utils/repo_store.py)
+REPO_STORE_BASE = "xxxxxxx/SynPTCEvo4J/stores"
+# Layout of the repos set up by utils/gitter.py
+# clone: a full clone per repo in REPO_BASE | worktree/alternates: checkouts of the stores in REPO_BASE created on demand
+REPO_LAYOUT = "clone"
+
 # The path of your reranker
 RERANKER_MODEL_PATH = "xxxxxxxxx/bge-reranker-v2-m3"
 
@@ -16,3 +22,59 @@ LANGCHAIN_API_KEY = "xxxxxxxxxx"
 # TREESITTER_LANG_SO = (
 #     "xxxx/tools/parser/build/my-languages.so"
 # )
+
+# Persistent cache of LLM responses (SQLite)
+# mode: off | read_through | write_through | replay_only (see utils/llm_cache.py)
+# off by default: the repeated full runs of pass@k (xxx_n1.json ... xxx_nk.json) would get the same cached samples
+LLM_CACHE_PATH = "outputs/llm_cache.sqlite"
+LLM_CACHE_MODE = "off"
+
+# Persistent memo of method signature lines per blob sha (SQLite), used when mining commits
+SIG_MEMO_PATH = "outputs/sig_lines_memo.sqlite"
+
+# Diff backend of get_diff/get_diff_texts in utils/helper.py
+# difflib | cdifflib (byte-identical output, C matcher, falls back to difflib if cdifflib is not installed)
+DIFF_BACKEND = "cdifflib"
+
+# Diff context of the files of focal/test methods (see retriever/global_collector.py)
+# reformat: filter and reformat whole files, then diff | native: git's hunks of the commit, only touched lines filtered
+DIFFCTX_MODE = "reformat"
+
+# Scope of the usages of the focal method (see retriever/global_collector.py)
+# repo: references of the whole repo by the language server | commit: call sites in the changed files by tree-sitter
+# the commit scope is checked against the repo scope by: python -m retriever.global_collector usages [datafile] [n]
+USAGES_SCOPE = "repo"
+
+# Documents kept open in the language server after use (LRU, see utils/multilspy/language_server.py)
+# 0 closes every document right after the request
+LSP_MAX_OPEN_FILES = 64
+
+# Project import of JDTLS (see retriever/main_retriever.py and utils/multilspy/multilspy_config.py)
+# full: import the maven/gradle build | light: invisible project of the source roots of the focal/test files and the extras
+LSP_IMPORT_MODE = "full"
+# extra source roots (relative to the repo root) of the light import
+LSP_LIGHT_EXTRA_ROOTS = []
+
+# Initialization of JDTLS (see utils/multilspy/multilspy_config.py)
+# full: all the client capabilities and IntelliCode | retrieval: only the capabilities used by the retrievers
+LSP_INIT_PROFILE = "full"
+
+# Class-data-sharing archive of the JVM of JDTLS (see utils/multilspy/language_servers/eclipse_jdtls/cds.py)
+# experimental: the dynamic archive skips the plugin classes of Equinox's class loaders, measure it by run_lsp_benchmark.py
+LSP_JVM_CDS = False
+
+# Repos hosted by one shared language server (multi-root workspace, see utils/lsp_host.py)
+# 0: one language server per example
+LSP_MULTI_ROOT_FOLDERS = 0
+
+# Deadlines in seconds of the stages of an example and of the whole example (see utils/deadline.py), None: no deadline
+# a stage past its deadline continues with the contexts collected so far (none if the LSP is not started in time),
+# an example past its deadline (or the llm deadline) is skipped and recorded with an empty prediction
+STAGE_DEADLINES = {
+    "lsp_startup": 300,
+    "usages": 180,
+    "class": 120,
+    "general": 120,
+    "llm": 180,
+}
+EXAMPLE_DEADLINE = 900
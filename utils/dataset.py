@@ -0,0 +1,259 @@
+"""
+Stream examples from data files (json list or jsonl) without loading the whole file.
+A sidecar index (<datafile>.idx) keeps the byte offsets and the metadata of every record,
+so examples can be accessed by id (the index in the data file) and filtered without being materialized.
+"""
+
+import os, re, json, codecs
+from typing import Iterator, Optional
+from .types import Example, TextPool
+from .logger import logger
+
+# separators between the records of a json list
+_SKIP_PATTERN = re.compile(r"[\s,]*")
+
+
+def _iter_json_list(f, chunk_size: int) -> Iterator[tuple[int, int, dict]]:
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos = "", 0
+    # byte offset of buf[pos] in the file
+    byte_pos = 0
+    eof = False
+    started = False
+
+    def read_more():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+    while True:
+        # skip the separators (ascii: one char is one byte)
+        while True:
+            end = _SKIP_PATTERN.match(buf, pos).end()
+            byte_pos += end - pos
+            pos = end
+            if pos < len(buf) or eof:
+                break
+            read_more()
+        if pos >= len(buf) or buf[pos] == "]":
+            return
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError(f"Expected a json list at byte {byte_pos}")
+            started = True
+            pos, byte_pos = pos + 1, byte_pos + 1
+            continue
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # the record is not complete in the buffer
+            if eof:
+                raise
+            read_more()
+            continue
+        length = len(buf[pos:end].encode())
+        yield byte_pos, length, record
+        byte_pos += length
+        pos = end
+
+
+def _iter_jsonl(f) -> Iterator[tuple[int, int, dict]]:
+    offset = 0
+    for line in f:
+        if line.strip():
+            yield offset, len(line), json.loads(line)
+        offset += len(line)
+
+
+def iter_json_records(
+    filepath: str, chunk_size: int = 1 << 20
+) -> Iterator[tuple[int, int, dict]]:
+    """
+    Incrementally parse the records of a json list or jsonl file.
+
+    Yields:
+        tuple: (byte offset, byte length, record)
+    """
+    with open(filepath, "rb") as f:
+        head = f.read(64).lstrip()
+        f.seek(0)
+        if filepath.endswith(".jsonl") or head.startswith(b"{"):
+            yield from _iter_jsonl(f)
+        else:
+            yield from _iter_json_list(f, chunk_size)
+
+
+class ExampleDataset(object):
+    """
+    Lazy dataset of examples, the id of an example is its index in the data file
+    (the same as the "id" of the outputs in run_update_xxx.py).
+    """
+
+    def __init__(self, filepath: str, index_path: str = None, pool: TextPool = None):
+        """
+        pool: share the equal texts among the materialized examples (for holding many examples in memory).
+        """
+        self.filepath = filepath
+        self.index_path = index_path or filepath + ".idx"
+        self.pool = pool
+        self._index: Optional[dict] = None
+
+    def _file_stat(self) -> dict:
+        stat = os.stat(self.filepath)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def build_index(self) -> dict:
+        """Stream the data file once and save the offsets and metadata of every record."""
+        index = {**self._file_stat(), "offsets": [], "repo_names": [], "syn_diffs": []}
+        for offset, length, record in iter_json_records(self.filepath):
+            index["offsets"].append((offset, length))
+            index["repo_names"].append(record["repo_name"])
+            index["syn_diffs"].append(record["syn_diff"])
+        with open(self.index_path, "w") as f:
+            json.dump(index, f)
+        logger.info(
+            f"Indexed {len(index['offsets'])} examples of {self.filepath} at {self.index_path}"
+        )
+        return index
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            index = None
+            if os.path.exists(self.index_path):
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+                # the data file is changed after indexing
+                stat = self._file_stat()
+                if index["size"] != stat["size"] or index["mtime"] != stat["mtime"]:
+                    index = None
+            self._index = index or self.build_index()
+        return self._index
+
+    def __len__(self) -> int:
+        return len(self.index["offsets"])
+
+    def record(self, idx: int) -> dict:
+        offset, length = self.index["offsets"][idx]
+        with open(self.filepath, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def __getitem__(self, idx: int) -> Example:
+        return Example.from_dict(self.record(idx), self.pool)
+
+    def select(
+        self, repo_names: list[str] = None, syn_diff: dict[str, int] = None
+    ) -> list[int]:
+        """
+        The ids of the examples in the given repos and with the given syn_diff flags,
+        e.g. syn_diff={"param_types": 1}. Only the index is read.
+        """
+        repo_names = set(repo_names) if repo_names else None
+        ids = []
+        for idx, (repo_name, diff) in enumerate(
+            zip(self.index["repo_names"], self.index["syn_diffs"])
+        ):
+            if repo_names is not None and repo_name not in repo_names:
+                continue
+            if syn_diff and any(diff.get(k) != v for k, v in syn_diff.items()):
+                continue
+            ids.append(idx)
+        return ids
+
+    def iter_examples(
+        self, ids: list[int] = None, start: int = 0
+    ) -> Iterator[tuple[int, Example]]:
+        """
+        Yield (id, Example) for the given ids (default: all) from the start-th one,
+        the examples are materialized one by one.
+        """
+        ids = list(range(len(self))) if ids is None else ids
+        with open(self.filepath, "rb") as f:
+            for idx in ids[start:]:
+                offset, length = self.index["offsets"][idx]
+                f.seek(offset)
+                yield idx, Example.from_dict(json.loads(f.read(length)), self.pool)
+
+
+def write_compact(examples: list[Example], filepath: str):
+    """Write the examples in the compact form: a string table and the rows of string indices."""
+    table: dict[str, int] = dict()
+    rows = [exp.to_compact(table) for exp in examples]
+    with open(filepath, "w") as f:
+        json.dump({"strings": list(table), "examples": rows}, f, separators=(",", ":"))
+
+
+def read_compact(filepath: str) -> list[Example]:
+    """Read the examples written by write_compact, equal strings share one reference."""
+    with open(filepath, "r") as f:
+        content = json.load(f)
+    strings = content["strings"]
+    return [Example.from_compact(row, strings) for row in content["examples"]]
+
+
+def read_ctx_cache(filepath: str, pool: TextPool = None) -> list[dict]:
+    """
+    Read the cached contexts saved by retrieve_context (outputs/SynBCIATR/cache.json),
+    the texts of the RetCtx lists share one reference with the equal texts in the pool.
+    """
+    pool = pool or TextPool()
+    with open(filepath, "r") as f:
+        caches = json.load(f)
+    for cache in caches:
+        for key, value in cache.items():
+            if isinstance(value, dict):
+                cache[key] = pool.share_ctx(value)
+            elif isinstance(value, list):
+                cache[key] = [pool.share_ctx(ctx) for ctx in value]
+            elif isinstance(value, str):
+                cache[key] = pool.share(value)
+    return caches
+
+
+if __name__ == "__main__":
+    # memory benchmark: python -m utils.dataset [datafile] [size_like]
+    # The examples of datafile are repeated up to the size of size_like (dataset/ceprot/test.json).
+    import sys, tempfile, tracemalloc
+    from .types import UpdateInfo
+    from .helper import read_examples
+
+    datafile = sys.argv[1] if len(sys.argv) > 1 else "dataset/synPTCEvo4j/test.json"
+    size_like = sys.argv[2] if len(sys.argv) > 2 else "dataset/ceprot/test.json"
+    with open(datafile, "r") as f:
+        records = json.load(f)
+    repeat = max(1, round(os.path.getsize(size_like) / os.path.getsize(datafile)))
+    tmp_dir = tempfile.mkdtemp()
+    bench_file = os.path.join(tmp_dir, "bench.json")
+    with open(bench_file, "w") as f:
+        json.dump(records * repeat, f, indent=4)
+    compact_file = os.path.join(tmp_dir, "bench.compact.json")
+    write_compact(read_examples(bench_file), compact_file)
+    print(
+        f"{len(records) * repeat} examples: {os.path.getsize(bench_file) / 2**20:.1f} MB json, "
+        f"{os.path.getsize(compact_file) / 2**20:.1f} MB compact"
+    )
+
+    def measure(name, load):
+        tracemalloc.start()
+        data = load()
+        infos = [UpdateInfo(exp) for exp in data if not isinstance(exp, dict)]
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:>32}: {current / 2**20:.2f} MB")
+        return data, infos
+
+    def load_records():
+        with open(bench_file, "r") as f:
+            return json.load(f)
+
+    measure("json records", load_records)
+    measure("examples w/o shared texts", lambda: [Example.from_dict(r) for r in load_records()])
+    measure("examples (read_examples)", lambda: read_examples(bench_file))
+    measure("examples (read_compact)", lambda: read_compact(compact_file))
+    for fp in [bench_file, compact_file]:
+        os.remove(fp)
+    os.rmdir(tmp_dir)
@@ -0,0 +1,95 @@
+"""
+Deadlines of the stages of an example (LSP startup, usages, class, general, LLM) and of the whole example.
+
+A deadline is entered with `with deadline(name, seconds):`, nested deadlines never extend the enclosing ones.
+The blocking calls bound their waits by remaining_seconds() (e.g. the requests to the language server),
+and the loops stop early by check_deadline() or deadline_passed().
+"""
+
+import time, contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+from typing import Callable, Optional
+from .logger import logger
+
+# the active deadlines of the current thread: ((name, expires_at), ...) from the outermost
+_deadlines = contextvars.ContextVar("deadlines", default=())
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline of {stage} exceeded")
+        self.stage = stage
+
+
+def _first_expired(deadlines: tuple) -> Optional[str]:
+    now = time.time()
+    for name, expires_at in deadlines:
+        if now >= expires_at:
+            return name
+    return None
+
+
+def remaining_seconds() -> Optional[float]:
+    """Seconds left before the nearest deadline, None if there is no deadline."""
+    deadlines = _deadlines.get()
+    if not deadlines:
+        return None
+    return max(0.0, min(expires_at for _, expires_at in deadlines) - time.time())
+
+
+def deadline_passed() -> bool:
+    return _first_expired(_deadlines.get()) is not None
+
+
+def check_deadline():
+    """Raise DeadlineExceeded of the outermost passed deadline."""
+    name = _first_expired(_deadlines.get())
+    if name is not None:
+        raise DeadlineExceeded(name)
+
+
+@contextmanager
+def deadline(name: str, seconds: Optional[float] = None, degrade: bool = False):
+    """
+    Run the block within seconds (None: no deadline of its own).
+    A timeout after the deadline passed is raised as DeadlineExceeded(name), or swallowed if degrade,
+    then the block keeps the results it has collected. The timeouts of the enclosing deadlines always propagate.
+    """
+    enclosing = _deadlines.get()
+    expires_at = None if seconds is None else time.time() + seconds
+    token = None if expires_at is None else _deadlines.set(enclosing + ((name, expires_at),))
+    try:
+        yield
+    except TimeoutError as e:
+        outer = _first_expired(enclosing)
+        if outer is not None:
+            if isinstance(e, DeadlineExceeded) and e.stage == outer:
+                raise
+            raise DeadlineExceeded(outer) from e
+        if expires_at is None or time.time() < expires_at:
+            # not caused by this deadline
+            raise
+        if not degrade:
+            if isinstance(e, DeadlineExceeded) and e.stage == name:
+                raise
+            raise DeadlineExceeded(name) from e
+        logger.warning(f"[Deadline] {name} exceeded {seconds}s, continue with the partial results")
+    finally:
+        if token is not None:
+            _deadlines.reset(token)
+
+
+def call_with_deadline(func: Callable, *args, **kwargs):
+    """
+    Call func in a worker thread and wait until the nearest deadline, for the blocking calls that cannot be interrupted
+    (e.g. an LLM request). The worker is abandoned on timeout and finishes in the background.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        return executor.submit(func, *args, **kwargs).result(timeout=remaining_seconds())
+    except FuturesTimeoutError as e:
+        # the same as TimeoutError since python 3.11
+        raise TimeoutError(f"{getattr(func, '__name__', func)} timed out") from e
+    finally:
+        executor.shutdown(wait=False)
@@ -2,11 +2,13 @@
 Manage git repositories by GitPython
 """
 
-import os, git, json, re
-from git import Repo, Diff, Commit
-from .configs import REPO_BASE
+import os, git, json, re, sqlite3, bisect, shutil, time, threading, functools
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from git import Repo, Diff, Commit, Blob
+from .configs import REPO_BASE, REPO_LAYOUT, SIG_MEMO_PATH
 from .multilspy.multilspy_types import Position
-from .parser import all_method_sig_lines
+from .parser import all_method_sig_intervals, filter_code_lines
 from .formatter import formatted_java_code, formatted_java_code_with_pos
 from .helper import get_diff, line_range_from_diff
 from .logger import logger
@@ -35,6 +37,13 @@ class UpdateRepo(Repo):
         self.git.checkout(commit_id, f=True)
         logger.info(f"-> Repo head commit at: {commit_id[:6]}.")
 
+    def close(self):
+        # release the checkout of an object store (see RepoStore.setup_repo)
+        release_checkout = getattr(self, "release_checkout", None)
+        if release_checkout is not None:
+            release_checkout()
+        super().close()
+
     def checkout_src(self):
         # not suggest: checkout to the commit before commit_id
         logger.info(f"-> Repo checkouts to the src commit.")
@@ -82,6 +91,65 @@ class UpdateRepo(Repo):
             return ""
         return diffs[0].diff.decode()
 
+    def get_commit_hunks(self) -> dict[str, list[tuple[int, int, int, int]]]:
+        """The native hunks of all the java files changed by the commit (cached per commit)."""
+        return commit_hunks(self.working_tree_dir, self.commit_id)
+
+    def get_file_diff_texts(
+        self,
+        rel_path: str,
+        line_limit: int = -1,
+        add_must: bool = False,
+        clean_tests: bool = False,
+        method_src: str = "",
+        method_tgt: str = "",
+    ) -> set[str]:
+        """
+        Diff texts of a file built from git's native hunks, the counterpart of
+        get_diff_texts(filter_file_code(file_src), filter_file_code(file_tgt)).
+        Only the touched lines are filtered (comments, package, imports and tests if clean_tests),
+        and the lines of method_src/method_tgt are excluded.
+        """
+        hunks = self.get_commit_hunks().get(rel_path, [])
+        if not hunks:
+            return set()
+        file_src = self.get_file_src(rel_path)
+        file_tgt = self.get_file_tgt(rel_path)
+        src_lines = filter_code_lines(
+            file_src, [(h[0], h[0] + h[1]) for h in hunks], clean_tests
+        )
+        tgt_lines = filter_code_lines(
+            file_tgt, [(h[2], h[2] + h[3]) for h in hunks], clean_tests
+        )
+        src_skip = method_line_range(file_src, method_src)
+        tgt_skip = method_line_range(file_tgt, method_tgt)
+
+        all_diff = set()
+        for src_start, src_count, tgt_start, tgt_count in hunks:
+            deletes = [
+                src_lines[ln]
+                for ln in range(src_start, src_start + src_count)
+                if ln in src_lines and ln not in src_skip
+            ]
+            adds = [
+                tgt_lines[ln]
+                for ln in range(tgt_start, tgt_start + tgt_count)
+                if ln in tgt_lines and ln not in tgt_skip
+            ]
+            # changes of whitespaces only are dropped, like the diff of formatted files
+            delete_keys = ["".join(line.split()) for line in deletes]
+            add_keys = ["".join(line.split()) for line in adds]
+            common = set(delete_keys) & set(add_keys)
+            item_lines = [
+                "-" + line for line, key in zip(deletes, delete_keys) if key not in common
+            ] + ["+" + line for line, key in zip(adds, add_keys) if key not in common]
+            step = line_limit if line_limit > 0 else max(len(item_lines), 1)
+            for i in range(0, len(item_lines), step):
+                item = item_lines[i : i + step]
+                if not add_must or any(line.startswith("+") for line in item):
+                    all_diff.add("\n".join(item))
+        return all_diff
+
     # return the diff item of the given target position
     # format to transform method_inovation into one line
     # This is used for constructing UsageCtx
@@ -189,12 +257,90 @@ class UpdateRepo(Repo):
         return "\n".join(filter_diff)
 
 
+HUNK_PATTERN = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def changed_files_between(repo_root: str, old_commit: str, new_commit: str) -> list[tuple[str, str]]:
+    """
+    The files changed from old_commit to new_commit (renames as delete + add).
+
+    Returns:
+        list[tuple]: (status, rel_path), status is one of A(dded), M(odified), D(eleted), T(ype changed).
+    """
+    output = Repo(repo_root).git.execute(
+        ["git", "-c", "core.quotepath=off", "diff", "--name-status", "--no-renames",
+         old_commit, new_commit]
+    )
+    changes = []
+    for line in output.splitlines():
+        status, rel_path = line.split("\t", 1)
+        changes.append((status[0], rel_path))
+    return changes
+
+
+@functools.lru_cache(maxsize=64)
+def commit_hunks(repo_root: str, commit_id: str) -> dict[str, list[tuple[int, int, int, int]]]:
+    """
+    Parse `git diff -U0` of a commit against its first parent.
+
+    Returns:
+        dict: rel_path -> [(src_start, src_count, tgt_start, tgt_count)], 0-based line indices.
+    """
+    output = Repo(repo_root).git.execute(
+        ["git", "-c", "core.quotepath=off", "diff", "-U0", "--no-color", "--no-ext-diff",
+         "--no-renames", f"{commit_id}^", commit_id, "--", "*.java"]
+    )
+    hunks: dict[str, list[tuple[int, int, int, int]]] = {}
+    a_path, rel_path = None, None
+    # content lines left in the current hunk
+    remaining = 0
+    for line in output.splitlines():
+        if remaining > 0:
+            if not line.startswith("\\"):
+                remaining -= 1
+            continue
+        if line.startswith("--- "):
+            a_path = line[len("--- a/") :] if line.startswith("--- a/") else None
+        elif line.startswith("+++ "):
+            rel_path = line[len("+++ b/") :] if line.startswith("+++ b/") else a_path
+            hunks.setdefault(rel_path, [])
+        elif line.startswith("@@"):
+            m = HUNK_PATTERN.match(line)
+            src_start, src_count = int(m.group(1)), int(m.group(2) or 1)
+            tgt_start, tgt_count = int(m.group(3)), int(m.group(4) or 1)
+            # an empty range starts after the given line
+            hunks[rel_path].append(
+                (
+                    src_start - 1 if src_count else src_start,
+                    src_count,
+                    tgt_start - 1 if tgt_count else tgt_start,
+                    tgt_count,
+                )
+            )
+            remaining = src_count + tgt_count
+    return hunks
+
+
+def method_line_range(file_str: str, method_str: str) -> range:
+    """The 0-based line range of a method in the file (empty if not found)."""
+    start = file_str.find(method_str) if method_str else -1
+    if start == -1:
+        return range(0)
+    start_ln = file_str.count("\n", 0, start)
+    return range(start_ln, start_ln + method_str.count("\n") + 1)
+
+
 def setup_repo(
-    repo_name: str, commit_id: str, repo_base=REPO_BASE, do_clone=False
+    repo_name: str, commit_id: str, repo_base=REPO_BASE, do_clone=False, layout=REPO_LAYOUT
 ) -> UpdateRepo:
     """
     repo_name: apache/flink
+    layout: "clone", or "worktree"/"alternates" to check out the repo from its object store (see utils/repo_store.py)
     """
+    if layout != "clone":
+        from .repo_store import get_repo_store
+
+        return get_repo_store(layout, repo_base).setup_repo(repo_name, commit_id)
     repo_root = os.path.join(repo_base, repo_name)
     # logger.info(f"Setup Repo: {repo_name} at {repo_root} in {repo_base}.")
     if os.path.exists(repo_root):
@@ -215,55 +361,177 @@ def setup_repo(
             ), f"Repo not found at {repo_root}, set do_clone=True to clone the repo."
 
 
-def setup_repos_from_datafile(datafile: str, repo_base=REPO_BASE):
-    """datafile: in dataset/synPTCEvo4j/xxx.json"""
-    with open(datafile, "r") as f:
-        items = json.load(f)
-    assert items[0].get("repo_name"), "Invalid synPTCEvo4j datafile: {datafile}."
-    error_list = []
-    total_count = len(items)
-    logger.info(f"Repos total counts: {total_count}.")
-    for i, item in enumerate(items):
-        repo_name = item["repo_name"]
-        logger.info(f"Setup Repo-{i}/{total_count}: {repo_name}")
-        try:
-            repo_root = os.path.join(repo_base, repo_name)
-            if os.path.exists(repo_root):
-                logger.info(f"Repo exists at {repo_root}")
-                continue
-            else:
-                repo_url = f"https://github.com/{repo_name}.git"
-                logger.info(f"Cloning Repo from {repo_url}")
-                Repo.clone_from(repo_url, repo_root, progress=Progress())
-                logger.info(f"Repo is cloned at {repo_root}")
-        except Exception as e:
-            error_list.append(repo_name)
+GITHUB_URL_TEMPLATE = "https://github.com/{repo_name}.git"
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            fp = os.path.join(root, name)
+            if not os.path.islink(fp):
+                total += os.path.getsize(fp)
+    return total
+
+
+def has_commit(repo: Repo, commit_id: str) -> bool:
+    try:
+        repo.git.cat_file("-e", f"{commit_id}^{{commit}}")
+        return True
+    except git.GitCommandError:
+        return False
+
+
+def provision_repo(
+    repo_name: str,
+    commit_ids: set[str],
+    repo_base: str = REPO_BASE,
+    url_template: str = GITHUB_URL_TEMPLATE,
+    partial: bool = False,
+):
+    """
+    Clone a repo (if not exists) and make sure the given commits and their parents are available.
+    partial: clone without blobs and working tree (--filter=blob:none --no-checkout),
+             the blobs are fetched lazily by the checkout of a commit before the repo is used.
+    """
+    repo_root = os.path.join(repo_base, repo_name)
+    repo_url = url_template.format(repo_name=repo_name)
+    if not os.path.exists(repo_root):
+        multi_options = ["--filter=blob:none", "--no-checkout"] if partial else []
+        # clone into a temp dir first, an interrupted clone is not mistaken for a complete repo
+        tmp_root = repo_root + ".tmp"
+        if os.path.exists(tmp_root):
+            shutil.rmtree(tmp_root)
+        Repo.clone_from(repo_url, tmp_root, multi_options=multi_options)
+        os.rename(tmp_root, repo_root)
+    repo = Repo(repo_root)
+    for commit_id in commit_ids:
+        if not has_commit(repo, commit_id):
+            # targeted fetch of a commit that is not reachable from the cloned refs
+            fetch_options = ["--filter=blob:none"] if partial else []
+            repo.git.fetch("origin", commit_id, *fetch_options)
+        commit = repo.commit(commit_id)
+        for parent in commit.parents:
+            assert has_commit(repo, parent.hexsha), f"Parent of {commit_id} missing."
+
+
+def provision_repos(
+    repo_commits: dict[str, set[str]],
+    repo_base: str = REPO_BASE,
+    url_template: str = GITHUB_URL_TEMPLATE,
+    workers: int = 4,
+    partial: bool = False,
+    state_file: str = None,
+    layout: str = REPO_LAYOUT,
+) -> list[str]:
+    """
+    Provision repos concurrently with bounded parallelism.
+
+    Args:
+        repo_commits (dict): repo_name -> commit ids (with their parents) needed in the repo.
+        url_template (str): url of a repo, file:// urls of local bare repos can stand in for GitHub.
+        workers (int): The max number of concurrent clones.
+        partial (bool): Partial clones without blobs and working trees (full clones by default).
+        state_file (str): json file recording the state of every repo, done repos are skipped on resume.
+        layout (str): "clone", or "worktree"/"alternates" to fetch the commits into the object stores,
+            the checkouts are created on demand by setup_repo.
+
+    Returns:
+        list[str]: The failed repo names.
+    """
+    state_file = state_file or os.path.join(repo_base, ".provision_state.json")
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file, "r") as f:
+            state = json.load(f)
+    todo = {}
+    for repo_name, commit_ids in repo_commits.items():
+        done_commits = set(state.get(repo_name, {}).get("commits", []))
+        if state.get(repo_name, {}).get("status") == "done" and set(commit_ids) <= done_commits:
+            continue
+        todo[repo_name] = set(commit_ids)
+    total_count = len(todo)
     logger.info(
-        f"Setup {len(items)} repos, {len(error_list)} failed.\nFailed Repos: {', '.join(error_list)}"
+        f"Repos total counts: {len(repo_commits)}, {len(repo_commits) - total_count} already provisioned."
     )
 
+    store = None
+    if layout != "clone":
+        from .repo_store import get_repo_store
+
+        store = get_repo_store(layout, repo_base, url_template=url_template)
+    lock = threading.Lock()
+    start = time.time()
+    total_bytes = 0
+    finished = 0
 
-def setup_repos_from_names(repo_names: list[str], repo_base=REPO_BASE):
-    error_list = []
-    total_count = len(repo_names)
-    logger.info(f"Repos total counts: {total_count}.")
-    for i, repo_name in enumerate(repo_names):
-        logger.info(f"Setup Repo-{i}/{total_count}: {repo_name}")
+    def run(repo_name: str):
+        nonlocal total_bytes, finished
+        repo_start = time.time()
         try:
-            repo_root = os.path.join(repo_base, repo_name)
-            if os.path.exists(repo_root):
-                logger.info(f"Repo exists at {repo_root}")
-                continue
+            if store is not None:
+                store.provision(repo_name, todo[repo_name])
+                size = dir_size(store.bare_path(repo_name))
             else:
-                repo_url = f"https://github.com/{repo_name}.git"
-                logger.info(f"Cloning Repo from {repo_url}")
-                Repo.clone_from(repo_url, repo_root, progress=Progress())
-                logger.info(f"Repo is cloned at {repo_root}")
+                provision_repo(
+                    repo_name, todo[repo_name], repo_base, url_template, partial
+                )
+                size = dir_size(os.path.join(repo_base, repo_name))
+            record = {
+                "status": "done",
+                "commits": sorted(todo[repo_name]),
+                "seconds": round(time.time() - repo_start, 2),
+                "bytes": size,
+            }
         except Exception as e:
-            error_list.append(repo_name)
+            size = 0
+            record = {"status": "failed", "error": str(e)}
+        with lock:
+            finished += 1
+            total_bytes += size
+            state[repo_name] = record
+            with open(state_file, "w") as f:
+                json.dump(state, f, indent=4)
+            elapsed = time.time() - start
+            if record["status"] == "done":
+                logger.info(
+                    f"Setup Repo-{finished}/{total_count}: {repo_name} in {record['seconds']}s "
+                    f"({finished / elapsed * 60:.1f} repos/min, {total_bytes / elapsed / 2**20:.1f} MB/s)"
+                )
+            else:
+                logger.error(
+                    f"Setup Repo-{finished}/{total_count}: {repo_name} failed: {record['error']}"
+                )
+
+    os.makedirs(repo_base, exist_ok=True)
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(run, todo.keys()))
+
+    error_list = [name for name in todo if state[name]["status"] != "done"]
     logger.info(
-        f"Setup {len(repo_names)} repos, {len(error_list)} failed.\nFailed Repos: {', '.join(error_list)}"
+        f"Setup {total_count} repos in {time.time() - start:.1f}s, {len(error_list)} failed.\nFailed Repos: {', '.join(error_list)}"
     )
+    return error_list
+
+
+def setup_repos_from_datafile(datafile: str, repo_base=REPO_BASE, **kwargs):
+    """
+    datafile: in dataset/synPTCEvo4j/xxx.json
+    kwargs: url_template, workers, partial (opt-in), state_file and layout for provision_repos.
+    """
+    with open(datafile, "r") as f:
+        items = json.load(f)
+    assert items[0].get("repo_name"), f"Invalid synPTCEvo4j datafile: {datafile}."
+    repo_commits: dict[str, set[str]] = dict()
+    for item in items:
+        repo_commits.setdefault(item["repo_name"], set()).add(item["commit_id"])
+    return provision_repos(repo_commits, repo_base, **kwargs)
+
+
+def setup_repos_from_names(repo_names: list[str], repo_base=REPO_BASE, **kwargs):
+    """kwargs: url_template, workers, partial (opt-in), state_file and layout for provision_repos."""
+    repo_commits = {repo_name: set() for repo_name in repo_names}
+    return provision_repos(repo_commits, repo_base, **kwargs)
 
 
 ############################################################################################################
@@ -292,49 +560,131 @@ def all_code_delete_lines(diffstr: str):
     return all_lines
 
 
+def focal_pattern_from_test(test_path: str) -> str:
+    """
+    Build the regex pattern of the focal paths for a test path.
+    src/test/java/org/apache/xtable/utilities/TestRunSync.java -> src/main/java/org/apache/xtable/utilities/\S*runsync\S*.java
+    """
+    focal_a_dir = (
+        os.path.dirname(test_path).replace("/test/", "/main/").replace("/tck/", "/main/")
+    )
+    # for some projects addin tests in a specific module
+    # such as, Source/JNA/waffle-tests/src/test/java/waffle/util/AuthorizationHeaderTests.java
+    focal_a_dir = re.sub(r"\S*test[^/]*/", r"\\S+/", focal_a_dir)
+    focal_a_dir = re.sub(r"\S*tck[^/]*/", r"\\S+/", focal_a_dir)
+    # focal_a_dir = focal_a_dir.replace("test", "\S+").replace("tck", "\S+")
+    focal_a_name = os.path.basename(test_path).split(".")[0].lower()
+    focal_a_name = re.sub(r"testcases?", "", focal_a_name)
+    focal_a_name = re.sub(r"tests?", "", focal_a_name)
+    return f"{focal_a_dir}/\S*{focal_a_name}\S*.java"
+
+
+def match_focal_paths(test_paths: list[str], nontest_paths: list[str]) -> set[str]:
+    """
+    Find the focal paths of the changed tests among the changed non-test paths.
+    All the focal patterns are compiled into a single regex, so every path is scanned only once.
+    """
+    if not test_paths or not nontest_paths:
+        return set()
+    focal_patterns = {focal_pattern_from_test(p) for p in test_paths}
+    focal_regex = re.compile(
+        "|".join(f"(?:{p})" for p in sorted(focal_patterns)), re.IGNORECASE
+    )
+    return {p for p in nontest_paths if focal_regex.search(p)}
+
+
+class SigLinesMemo(object):
+    """
+    Persistent memo of the method signature line intervals of blobs, keyed by blob sha (SQLite).
+    Unchanged focal blobs recur across many commits, so each blob is parsed only once.
+    Intervals are stored as a packed int array: [start0, end0, start1, end1, ...].
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path
+        self.memo: dict[str, list[tuple[int, int]]] = dict()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # every (forked) mining process opens its own connection
+        if self._conn is None or self._pid != os.getpid():
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sig_lines (blob_sha TEXT PRIMARY KEY, intervals BLOB)"
+            )
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, blob: Blob) -> list[tuple[int, int]]:
+        sha = blob.hexsha
+        if sha in self.memo:
+            return self.memo[sha]
+        intervals = None
+        if self.db_path:
+            row = (
+                self._connect()
+                .execute("SELECT intervals FROM sig_lines WHERE blob_sha=?", (sha,))
+                .fetchone()
+            )
+            if row:
+                flat = array("i")
+                flat.frombytes(row[0])
+                intervals = list(zip(flat[::2], flat[1::2]))
+        if intervals is None:
+            intervals = all_method_sig_intervals(blob.data_stream.read().decode())
+            if self.db_path:
+                flat = array("i", [ln for interval in intervals for ln in interval])
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO sig_lines VALUES (?, ?)",
+                    (sha, flat.tobytes()),
+                )
+                conn.commit()
+        self.memo[sha] = intervals
+        return intervals
+
+
+sig_lines_memo = SigLinesMemo(SIG_MEMO_PATH)
+
+
+def lines_in_intervals(lines: set[int], intervals: list[tuple[int, int]]) -> set[int]:
+    """The lines covered by the sorted and disjoint intervals (overlap check by binary search)."""
+    starts = [start for start, _ in intervals]
+    res = set()
+    for line in lines:
+        i = bisect.bisect_right(starts, line) - 1
+        if i >= 0 and line <= intervals[i][1]:
+            res.add(line)
+    return res
+
+
 def get_synfps_from_commit(commit: Commit):
     """
     synfps: focal paths that may indicate syntactic production-test co-evolution
     Check if the commit contains syntactic changes for Production-test Co-Evolution Pair and returns the focal paths that may contain syntactic method changes.
     """
-    # get the focal_paths of production-test co-evolution pairs
-    focal_paths = set()
-    focal_patterns = []
     # the focal paths that may contain syntactic method changes.
     syn_focal_paths = []
-    nontest_filestr = ""
+    test_paths = []
+    nontest_paths = []
     pre_commit_id = commit.hexsha + "^"
     for diff in commit.diff(pre_commit_id, R=True).iter_change_type("M"):
         if diff.a_path.endswith(".java") and diff.a_path == diff.b_path:
             a_path = diff.a_path
             if "test" in a_path or "tck" in a_path:
-                # src/test/java/org/apache/xtable/utilities/TestRunSync.java
-                focal_a_dir = (
-                    os.path.dirname(a_path)
-                    .replace("/test/", "/main/")
-                    .replace("/tck/", "/main/")
-                )
-                # for some projects addin tests in a specific module
-                # such as, Source/JNA/waffle-tests/src/test/java/waffle/util/AuthorizationHeaderTests.java
-                focal_a_dir = re.sub(r"\S*test[^/]*/", r"\\S+/", focal_a_dir)
-                focal_a_dir = re.sub(r"\S*tck[^/]*/", r"\\S+/", focal_a_dir)
-                # focal_a_dir = focal_a_dir.replace("test", "\S+").replace("tck", "\S+")
-                focal_a_name = os.path.basename(a_path).split(".")[0].lower()
-                focal_a_name = re.sub(r"testcases?", "", focal_a_name)
-                focal_a_name = re.sub(r"tests?", "", focal_a_name)
-                # src/main/java/org/apache/xtable/utilities/\S*runsync\S*.java
-                focal_pattern = f"{focal_a_dir}/\S*{focal_a_name}\S*.java"
-                focal_patterns.append(focal_pattern)
+                test_paths.append(a_path)
             else:
-                # java file strs split by " "
-                nontest_filestr += a_path + " "
-    # print(f"Focal Regex Patterns: \n{', '.join(focal_patterns)}")
-    for pattern in focal_patterns:
-        matches = re.findall(pattern, nontest_filestr, re.IGNORECASE)
-        if matches:
-            focal_paths.update(matches)
+                nontest_paths.append(a_path)
+    # get the focal_paths of production-test co-evolution pairs
+    focal_paths = match_focal_paths(test_paths, nontest_paths)
     # Analyze the diffs on focal_files to check if it contains syntactic changes on methods
-    for focal_path in focal_paths:
+    for focal_path in sorted(focal_paths):
         focal_diffs = commit.diff(
             pre_commit_id, paths=focal_path, create_patch=True, R=True, unified=0
         )
@@ -342,12 +692,95 @@ def get_synfps_from_commit(commit: Commit):
             continue
         focal_diff = focal_diffs[0]
         diff_lines = all_code_delete_lines(focal_diff.diff.decode())
-        method_lines = all_method_sig_lines(
-            focal_diff.a_blob.data_stream.read().decode()
-        )
-        if diff_lines.intersection(method_lines):
+        if not diff_lines:
+            continue
+        method_intervals = sig_lines_memo.get(focal_diff.a_blob)
+        syn_lines = lines_in_intervals(diff_lines, method_intervals)
+        if syn_lines:
             logger.info(
-                f"Commit {commit.hexsha[:6]} contains syntactic changes at {focal_path}:{diff_lines.intersection(method_lines)}."
+                f"Commit {commit.hexsha[:6]} contains syntactic changes at {focal_path}:{syn_lines}."
             )
             syn_focal_paths.append(focal_path)
     return syn_focal_paths
+
+
+def check_provisioning(work_dir: str) -> None:
+    """
+    Self-check of provision_repos against local bare repos (file:// urls stand in for GitHub):
+    full and partial clones, targeted fetch of an unreachable commit, lazy blobs and resume.
+    """
+    src_root = os.path.join(work_dir, "src")
+    src = Repo.init(src_root)
+    with src.config_writer() as cw:
+        cw.set_value("user", "name", "check")
+        cw.set_value("user", "email", "check@localhost")
+    commits = []
+    for version in range(3):
+        with open(os.path.join(src_root, "A.java"), "w") as f:
+            f.write(f"class A {{ int v() {{ return {version}; }} }}\n")
+        src.index.add(["A.java"])
+        commits.append(src.index.commit(f"v{version}").hexsha)
+    # the last commit is only reachable by its id
+    src.git.reset("--hard", commits[1])
+    upstream = os.path.join(work_dir, "upstream", "org", "repo.git")
+    Repo.clone_from(src_root, upstream, multi_options=["--bare"])
+    upstream_repo = Repo(upstream)
+    upstream_repo.git.fetch(src_root, commits[2])
+    with upstream_repo.config_writer() as cw:
+        cw.set_value("uploadpack", "allowFilter", "true")
+        cw.set_value("uploadpack", "allowAnySHA1InWant", "true")
+    url_template = "file://" + os.path.join(work_dir, "upstream", "{repo_name}.git")
+
+    for partial in [False, True]:
+        repo_base = os.path.join(work_dir, "partial" if partial else "full")
+        failed = provision_repos(
+            {"org/repo": {commits[2]}}, repo_base, url_template, workers=1, partial=partial
+        )
+        assert not failed, f"Provisioning failed (partial={partial})"
+        repo_root = os.path.join(repo_base, "org", "repo")
+        repo = Repo(repo_root)
+        assert all(has_commit(repo, commit_id) for commit_id in commits)
+        missing = repo.git.rev_list("--objects", "--all", "--missing=print").count("\n?")
+        assert os.path.exists(os.path.join(repo_root, "A.java")) != partial
+        assert (missing > 0) == partial, f"{missing} missing objects (partial={partial})"
+        repo.git.checkout(commits[2], detach=True, force=True)
+        with open(os.path.join(repo_root, "A.java"), "r") as f:
+            assert "return 2;" in f.read()
+        # resumed runs skip the provisioned repos
+        started = time.time()
+        assert not provision_repos(
+            {"org/repo": {commits[2]}}, repo_base, url_template, workers=1, partial=partial
+        )
+        assert time.time() - started < 1
+        logger.info(f"Provisioning checked (partial={partial}, {missing} missing objects before checkout)")
+
+    # the store layout: the commits are fetched into the store, the checkouts are created on demand
+    from .repo_store import get_repo_store
+
+    repo_base = os.path.join(work_dir, "store_checkouts")
+    store = get_repo_store(
+        "worktree", repo_base, os.path.join(work_dir, "stores"), url_template=url_template, max_checkouts=0
+    )
+    assert not provision_repos(
+        {"org/repo": {commits[2]}}, repo_base, url_template, workers=1, layout="worktree"
+    )
+    assert has_commit(Repo(store.bare_path("org/repo")), commits[2])
+    repo = setup_repo("org/repo", commits[2], repo_base, layout="worktree")
+    with open(os.path.join(repo.working_tree_dir, "A.java"), "r") as f:
+        assert "return 2;" in f.read()
+    # in use until the repo is closed, evicted after
+    store.evict()
+    assert store.in_use("org/repo") and os.path.exists(repo.working_tree_dir)
+    checkout_path = repo.working_tree_dir
+    repo.close()
+    store.evict()
+    assert not store.in_use("org/repo") and not os.path.exists(checkout_path)
+    logger.info("Provisioning checked (store layout, the checkout in use is kept by eviction)")
+
+
+if __name__ == "__main__":
+    # self-check: python -m utils.gitter
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        check_provisioning(work_dir)
@@ -1,7 +1,13 @@
 import re, json, difflib
+from .configs import DIFF_BACKEND
 from .multilspy.multilspy_types import Position
 from .multilspy.multilspy_utils import TextUtils
-from .types import Example
+from .types import Example, TextPool
+
+try:
+    from cdifflib import CSequenceMatcher
+except ImportError:  # optional, the cdifflib backend falls back to difflib
+    CSequenceMatcher = None
 
 
 def extract_code(input_str: str):
@@ -30,18 +36,65 @@ def read_examples(filepath: str) -> list[Example]:
     """
     with open(filepath, "r") as f:
         item_list = json.load(f)
-    examples = []
-    for item in item_list:
-        repo_name = item["repo_name"]
-        commit_id = item["commit_id"]
-        focal_db = item["focal_db"]
-        test_db = item["test_db"]
-        syn_diff = item["syn_diff"]
-        examples.append(Example(repo_name, commit_id, focal_db, test_db, syn_diff))
+    # the examples share the equal method sources and paths
+    pool = TextPool()
+    examples = [Example.from_dict(item, pool) for item in item_list]
     return examples
 
 
-def get_diff(src_code: str, tgt_code: str, n: int = -1) -> str:
+def _format_range_unified(start: int, stop: int) -> str:
+    """Convert a range to the "ed" format of difflib.unified_diff."""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def unified_diff_lines(
+    src_lines: list[str], tgt_lines: list[str], n: int, backend: str = None
+) -> list[str]:
+    """
+    The lines of difflib.unified_diff without the file headers.
+
+    backend (default DIFF_BACKEND):
+        difflib: difflib.unified_diff.
+        cdifflib: the C implementation of SequenceMatcher over the integer ids of the lines,
+                  byte-identical to difflib (the same matching and autojunk), falls back to difflib if not installed.
+    """
+    backend = backend or DIFF_BACKEND
+    if backend not in ["difflib", "cdifflib"]:
+        raise ValueError(f"Unknown diff backend: {backend}")
+    if backend == "difflib" or CSequenceMatcher is None:
+        diff = difflib.unified_diff(
+            src_lines, tgt_lines, n=n, fromfile="Previous", tofile="Current"
+        )
+        return list(diff)[2:]
+    # equal lines share an id, the matching only compares and hashes the ids
+    line_ids = {}
+    src_ids = [line_ids.setdefault(line, len(line_ids)) for line in src_lines]
+    tgt_ids = [line_ids.setdefault(line, len(line_ids)) for line in tgt_lines]
+    sm = CSequenceMatcher(None, src_ids, tgt_ids)
+    diff = []
+    for group in sm.get_grouped_opcodes(n):
+        first, last = group[0], group[-1]
+        src_range = _format_range_unified(first[1], last[2])
+        tgt_range = _format_range_unified(first[3], last[4])
+        diff.append(f"@@ -{src_range} +{tgt_range} @@\n")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                diff.extend(" " + line for line in src_lines[i1:i2])
+                continue
+            if tag in ["replace", "delete"]:
+                diff.extend("-" + line for line in src_lines[i1:i2])
+            if tag in ["replace", "insert"]:
+                diff.extend("+" + line for line in tgt_lines[j1:j2])
+    return diff
+
+
+def get_diff(src_code: str, tgt_code: str, n: int = -1, backend: str = None) -> str:
     """
     Get the unified diff between two code snippets.
 
@@ -49,6 +102,7 @@ def get_diff(src_code: str, tgt_code: str, n: int = -1) -> str:
         src_code (str): The source code snippet.
         tgt_code (str): The target code snippet.
         n (int): The numbers of context lines. (-1: means no limit)
+        backend (str): The diff backend, see unified_diff_lines (default DIFF_BACKEND).
 
     Returns:
         str: The unified diff between the source and target code snippets (with prefix line: @@).
@@ -58,16 +112,17 @@ def get_diff(src_code: str, tgt_code: str, n: int = -1) -> str:
     if n == -1:
         n = max(len(src_lines), len(tgt_lines))
     # generate unified_diff
-    diff = difflib.unified_diff(
-        src_lines, tgt_lines, n=n, fromfile="Previous", tofile="Current"
-    )
-    diff = list(diff)[2:]
+    diff = unified_diff_lines(src_lines, tgt_lines, n, backend)
     diff_str = "\n".join(diff)
     return diff_str
 
 
 def get_diff_texts(
-    src_code: str, tgt_code: str, line_limit: int = -1, add_must: bool = False
+    src_code: str,
+    tgt_code: str,
+    line_limit: int = -1,
+    add_must: bool = False,
+    backend: str = None,
 ) -> set[str]:
     """
     Get the list of differences between two code snippets.
@@ -77,6 +132,7 @@ def get_diff_texts(
         tgt_code (str): The target code snippet.
         line_limit (int): The max number of lines in a diff_item(-1 not set).
         add_must(bool): diff item must contain additions if True.
+        backend (str): The diff backend, see unified_diff_lines (default DIFF_BACKEND).
 
     Returns:
         set[str]: A sets of diff texts between the two code snippets.
@@ -85,14 +141,12 @@ def get_diff_texts(
     src_lines = src_code.splitlines()
     tgt_lines = tgt_code.splitlines()
     # generate unified_diff
-    diff = difflib.unified_diff(
-        src_lines, tgt_lines, n=0, fromfile="Previous", tofile="Current"
-    )
+    diff = unified_diff_lines(src_lines, tgt_lines, 0, backend)
     diff_item = ""
     item_lines = 0
     # if add_must=False, add_flag will always be True
     add_flag = not add_must
-    for line in list(diff)[2:]:
+    for line in diff:
         if line.startswith("@@") or item_lines == line_limit:
             if diff_item:
                 if add_flag:
@@ -181,3 +235,45 @@ def expand_pos_list_fmtf(
         )
 
     return res_list
+
+
+if __name__ == "__main__":
+    # benchmark: python -m utils.helper [datafile]
+    # Large files with scattered edits are built from the methods of the dataset:
+    # every file concatenates a chunk of the src methods, and its tgt version the tgt methods.
+    import sys, time
+
+    datafile = sys.argv[1] if len(sys.argv) > 1 else "dataset/synPTCEvo4j/test.json"
+    examples = read_examples(datafile)
+    methods = [
+        (db["method_src"], db["method_tgt"])
+        for exp in examples
+        for db in [exp.focal_db, exp.test_db]
+    ]
+    same = sum(
+        get_diff(src, tgt, backend="cdifflib") == get_diff(src, tgt, backend="difflib")
+        for src, tgt in methods
+    )
+    print(f"{same}/{len(methods)} method pairs with the same diff as difflib")
+    for chunk, repeat in [(60, 1), (len(methods), 1), (len(methods), 4)]:
+        files = [
+            (
+                "\n\n".join(src for src, _ in (methods * repeat)[i : i + chunk * repeat]),
+                "\n\n".join(tgt for _, tgt in (methods * repeat)[i : i + chunk * repeat]),
+            )
+            for i in range(0, len(methods) * repeat, chunk * repeat)
+        ]
+        line_count = sum(len(src.splitlines()) for src, _ in files)
+        results = {}
+        for backend in ["difflib", "cdifflib"]:
+            start = time.perf_counter()
+            results[backend] = [
+                (get_diff(src, tgt, 0, backend), get_diff_texts(src, tgt, 10, True, backend))
+                for src, tgt in files
+            ]
+            elapsed = time.perf_counter() - start
+            same = sum(r == e for r, e in zip(results[backend], results["difflib"]))
+            print(
+                f"{len(files)} files of {line_count // len(files)} lines, {backend:>8}: {elapsed * 1000:.1f}ms, "
+                f"{same}/{len(files)} files same as difflib"
+            )
@@ -1,5 +1,12 @@
 from langchain_openai import ChatOpenAI
-from utils.configs import OPENAI_API_KEY, DEEPSEEK_API_KEY
+from utils.configs import (
+    OPENAI_API_KEY,
+    DEEPSEEK_API_KEY,
+    LLM_CACHE_PATH,
+    LLM_CACHE_MODE,
+    STAGE_DEADLINES,
+)
+from utils.llm_cache import LLMCache
 
 
 # model initialization
@@ -14,4 +21,10 @@ model_gpt4 = ChatOpenAI(
     base_url="https://api.deepseek.com/v1",
     model="deepseek-coder",
     temperature=0.1,
+    # a hung request is abandoned at the llm deadline, the timeout frees its thread
+    timeout=STAGE_DEADLINES.get("llm"),
 )
+
+# persistent response cache shared by all the chains
+llm_cache = LLMCache(LLM_CACHE_PATH, mode=LLM_CACHE_MODE)
+model_gpt4_cached = llm_cache.wrap(model_gpt4)
@@ -0,0 +1,131 @@
+"""
+Persistent on-disk cache for LLM responses (SQLite).
+
+A response is keyed by (model, base_url, temperature, hash of rendered messages, sample index),
+so resumed runs, re-runs with the same contexts and pass@k sampling do not resend identical prompts.
+"""
+
+import os, json, sqlite3, hashlib, threading
+from typing import Optional, Union
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, messages_to_dict
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from .logger import logger
+
+# off: always query the model, never touch the cache
+# read_through: serve hits from the cache, query the model on misses and store the response
+# write_through: always query the model and store (overwrite) the response
+# replay_only: only serve from the cache, a miss raises LookupError (no network round-trips)
+CACHE_MODES = ("off", "read_through", "write_through", "replay_only")
+
+
+def hash_messages(model_input: Union[PromptValue, str, list[BaseMessage]]) -> str:
+    """
+    Hash the rendered messages of a chat model input (PromptValue, str or list of messages).
+    """
+    if isinstance(model_input, PromptValue):
+        messages = model_input.to_messages()
+    elif isinstance(model_input, str):
+        messages = [HumanMessage(content=model_input)]
+    else:
+        messages = list(model_input)
+    msg_str = json.dumps(messages_to_dict(messages), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(msg_str.encode()).hexdigest()
+
+
+class LLMCache(object):
+    """
+    SQLite-backed cache of LLM responses shared by all the LangChain chains of SynBCIATR.
+    """
+
+    def __init__(self, db_path: str, mode: str = "off"):
+        assert mode in CACHE_MODES, f"Invalid cache mode: {mode}."
+        self.db_path = db_path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # connect lazily, chains may be batched in threads
+        if self._conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    model TEXT, base_url TEXT, temperature REAL, msg_hash TEXT, sample_idx INTEGER,
+                    response TEXT, PRIMARY KEY (model, base_url, temperature, msg_hash, sample_idx))"""
+            )
+            self._conn.commit()
+        return self._conn
+
+    def lookup(self, key: tuple) -> Optional[str]:
+        """key: (model, base_url, temperature, msg_hash, sample_idx)"""
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT response FROM responses WHERE model=? AND base_url=? AND temperature=? AND msg_hash=? AND sample_idx=?",
+                    key,
+                )
+                .fetchone()
+            )
+        return row[0] if row else None
+
+    def update(self, key: tuple, response: str):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, response),
+            )
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def wrap(self, model: Runnable) -> Runnable:
+        """
+        Wrap a chat model into a runnable that reads/writes the cache according to the cache mode.
+        It can be used in place of the model in chains: `prompt | cache.wrap(model) | StrOutputParser()`.
+        The sample index is read from the config metadata ("sample_idx", default 0), e.g.
+        `chain.batch(queries, config=[{"metadata": {"sample_idx": i}} for i in range(k)])`.
+        """
+        model_name = getattr(model, "model_name", None) or getattr(model, "model", "")
+        base_url = getattr(model, "openai_api_base", None) or ""
+        temperature = getattr(model, "temperature", None)
+        temperature = -1.0 if temperature is None else float(temperature)
+
+        def invoke_cached(model_input, config: RunnableConfig) -> AIMessage:
+            if self.mode == "off":
+                return model.invoke(model_input, config)
+            sample_idx = int(config.get("metadata", {}).get("sample_idx", 0))
+            key = (model_name, base_url, temperature, hash_messages(model_input), sample_idx)
+            if self.mode != "write_through":
+                response = self.lookup(key)
+                if response is not None:
+                    with self._lock:
+                        self.hits += 1
+                    return AIMessage(content=response)
+                if self.mode == "replay_only":
+                    raise LookupError(
+                        f"LLM response not found in cache {self.db_path} (replay_only mode)."
+                    )
+            with self._lock:
+                self.misses += 1
+            message = model.invoke(model_input, config)
+            self.update(key, message.content)
+            return message
+
+        return RunnableLambda(invoke_cached, name=f"Cached{type(model).__name__}")
+
+    def log_stats(self):
+        logger.info(
+            f"LLM cache({self.mode}) at {self.db_path}: {self.hits} hits, {self.misses} misses."
+        )
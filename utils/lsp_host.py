@@ -0,0 +1,154 @@
+"""
+Host several repositories in one language server process (multi-root workspace).
+A repository is added as a workspace folder when it is requested, and the least recently used folders
+beyond max_folders are removed, so the memory of the node is bounded by one server.
+"""
+
+import os, time, pathlib, threading, dataclasses
+from contextlib import contextmanager, ExitStack
+from typing import Iterator, Optional
+from .multilspy import SyncLanguageServer
+from .multilspy.multilspy_config import MultilspyConfig
+from .multilspy.multilspy_logger import MultilspyLogger
+from .multilspy.multi_root import RepositoryView
+from git import Repo
+from .gitter import changed_files_between
+from .deadline import remaining_seconds
+from .logger import logger
+
+# git status -> FileChangeType of LSP
+_FILE_CHANGE_TYPES = {"A": 1, "M": 2, "T": 2, "D": 3}
+
+
+@dataclasses.dataclass
+class HostedFolder:
+    commit_id: Optional[str]
+    last_used: float
+    ref_count: int = 0
+
+
+class LSPHost(object):
+    def __init__(
+        self,
+        config: MultilspyConfig,
+        lsp_logger: MultilspyLogger,
+        max_folders: int = 4,
+        settle_seconds: float = 10,
+    ):
+        """
+        max_folders: the max number of repositories kept in the server (folders in use are never removed).
+        settle_seconds: the time for the server to import a newly added repository.
+        """
+        self.config = dataclasses.replace(config, multi_root=True)
+        self.lsp_logger = lsp_logger
+        self.max_folders = max_folders
+        self.settle_seconds = settle_seconds
+        self.lsp: Optional[SyncLanguageServer] = None
+        self.folders: dict[str, HostedFolder] = dict()
+        self._stack = ExitStack()
+        self._lock = threading.RLock()
+        # notified when a folder becomes idle
+        self._idle = threading.Condition(self._lock)
+
+    def _start(self, repo_root: str):
+        logger.info(f"Starting the multi-root LSP host with {repo_root}")
+        lsp = SyncLanguageServer.create(self.config, self.lsp_logger, repo_root)
+        # the requests wait at most until the nearest deadline of the caller
+        lsp.request_timeout = remaining_seconds
+        self._stack.enter_context(lsp.start_server())
+        self.lsp = lsp
+
+    def close(self):
+        with self._lock:
+            if self.lsp is not None:
+                self._stack.close()
+                self.lsp = None
+                self.folders.clear()
+                self._idle.notify_all()
+                logger.info(f"Stopped the multi-root LSP host")
+
+    def _busy_at_other_commit(self, repo_root: str, commit_id: Optional[str]) -> bool:
+        folder = self.folders.get(repo_root)
+        return (
+            folder is not None
+            and folder.ref_count > 0
+            and commit_id is not None
+            and folder.commit_id not in (None, commit_id)
+        )
+
+    def _sync_commit(self, repo_root: str, folder: HostedFolder, commit_id: Optional[str]):
+        """Notify the server of the files changed by checking out another commit in the hosted repository."""
+        if commit_id is None or folder.commit_id is None or commit_id == folder.commit_id:
+            folder.commit_id = commit_id or folder.commit_id
+            return
+        changed_files = changed_files_between(repo_root, folder.commit_id, commit_id)
+        changes = [
+            {
+                "uri": pathlib.Path(repo_root, rel_path).as_uri(),
+                "type": _FILE_CHANGE_TYPES.get(status, 2),
+            }
+            for status, rel_path in changed_files
+        ]
+        if changes:
+            # the server ignores the disk changes of open documents, they are closed (or refreshed if in use) first
+            self.lsp.reload_files([os.path.join(repo_root, rel_path) for _, rel_path in changed_files])
+            self.lsp.language_server.server.notify.did_change_watched_files({"changes": changes})
+        logger.info(
+            f"Notified {len(changes)} changed files of {repo_root} ({folder.commit_id[:6]} -> {commit_id[:6]})"
+        )
+        folder.commit_id = commit_id
+
+    def _evict(self):
+        unused = sorted(
+            (root for root, folder in self.folders.items() if folder.ref_count == 0),
+            key=lambda root: self.folders[root].last_used,
+        )
+        for repo_root in unused[: max(0, len(self.folders) - self.max_folders)]:
+            self.lsp.remove_workspace_folder(repo_root)
+            del self.folders[repo_root]
+            logger.info(f"Removed {repo_root} from the multi-root LSP host")
+
+    @contextmanager
+    def repository(self, repo_root: str, commit_id: str = None) -> Iterator[RepositoryView]:
+        """
+        Serve the repository checked out at commit_id by the shared server,
+        the view takes and returns the paths relative to the repository.
+        The commit of a folder in use is not switched: the block waits until its users are done
+        (TimeoutError at the nearest deadline), then the repository is checked out here.
+        """
+        repo_root = os.path.abspath(repo_root)
+        added = False
+        with self._lock:
+            while self._busy_at_other_commit(repo_root, commit_id):
+                logger.info(f"Waiting for the users of {repo_root} at another commit")
+                if not self._idle.wait(timeout=remaining_seconds()):
+                    raise TimeoutError(f"{repo_root} is in use at commit {self.folders[repo_root].commit_id[:6]}")
+            if commit_id is not None:
+                repo = Repo(repo_root)
+                if repo.head.commit.hexsha != commit_id:
+                    repo.git.checkout(commit_id, f=True)
+            if self.lsp is None:
+                self._start(repo_root)
+                self.folders[repo_root] = HostedFolder(commit_id, time.time())
+                added = True
+            elif repo_root not in self.folders:
+                self.lsp.add_workspace_folder(repo_root)
+                self.folders[repo_root] = HostedFolder(commit_id, time.time())
+                added = True
+                logger.info(f"Added {repo_root} to the multi-root LSP host")
+            folder = self.folders[repo_root]
+            self._sync_commit(repo_root, folder, commit_id)
+            folder.ref_count += 1
+            folder.last_used = time.time()
+            self._evict()
+        if added:
+            # import and build
+            time.sleep(self.settle_seconds)
+        try:
+            yield RepositoryView(self.lsp, repo_root)
+        finally:
+            with self._lock:
+                folder.ref_count -= 1
+                folder.last_used = time.time()
+                if folder.ref_count == 0:
+                    self._idle.notify_all()
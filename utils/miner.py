@@ -0,0 +1,360 @@
+"""
+Mine the histories of repositories for syntactic-induced production-test co-evolution candidates.
+"""
+
+import os, json, time, hashlib
+from multiprocessing import Pool
+from typing import Optional, Iterator
+from git import Repo, Commit
+from .configs import REPO_BASE
+from .gitter import get_synfps_from_commit, all_code_delete_lines, match_focal_paths
+from .parser import (
+    all_methods_from_file,
+    has_method_invocation,
+    compare_syndiff,
+    extract_method_metadata,
+)
+from .types import Example
+from .logger import logger
+
+# every worker process opens the repository once
+_worker_repo: Optional[Repo] = None
+
+
+def _init_mine_worker(repo_root: str):
+    global _worker_repo
+    _worker_repo = Repo(repo_root)
+
+
+def _mine_commit(commit_id: str) -> tuple[str, list[str]]:
+    try:
+        commit = _worker_repo.commit(commit_id)
+        # root commits have no parents to compare with
+        if not commit.parents:
+            return commit_id, []
+        return commit_id, get_synfps_from_commit(commit)
+    except Exception as e:
+        logger.warning(f"Failed to mine commit {commit_id[:6]}: {e}")
+        return commit_id, []
+
+
+def list_commits(repo_root: str, rev: str = "HEAD", max_count: int = -1) -> list[str]:
+    """List the non-merge commits reachable from rev (newest first)."""
+    args = ["--no-merges", rev]
+    if max_count > 0:
+        args.insert(0, f"--max-count={max_count}")
+    return Repo(repo_root).git.rev_list(*args).split()
+
+
+def mine_repo(
+    repo_name: str,
+    output_file: str,
+    repo_base: str = REPO_BASE,
+    rev: str = "HEAD",
+    max_count: int = -1,
+    workers: int = None,
+) -> int:
+    """
+    Walk the history of a repository in a process pool and stream the candidate commits to a jsonl file.
+    Every line: {"repo_name": ..., "commit_id": ..., "focal_paths": [...]}
+    The mined commits are recorded in output_file + ".ckpt", so a rerun skips them
+    (and the commits already in output_file) instead of appending duplicates.
+
+    Returns:
+        int: The number of new candidate commits.
+    """
+    repo_root = os.path.join(repo_base, repo_name)
+    ckpt_file = output_file + ".ckpt"
+    done = set()
+    if os.path.exists(ckpt_file):
+        with open(ckpt_file, "r") as f:
+            done = {line.strip() for line in f if line.strip()}
+    done |= {
+        f"{record['repo_name']} {record['commit_id']}"
+        for record in read_jsonl(output_file)
+        if record["repo_name"] == repo_name
+    }
+    commit_ids = [
+        commit_id
+        for commit_id in list_commits(repo_root, rev, max_count)
+        if f"{repo_name} {commit_id}" not in done
+    ]
+    workers = workers or os.cpu_count()
+    logger.info(
+        f"Mining {len(commit_ids)} commits of {repo_name} ({len(done)} mined) with {workers} workers"
+    )
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    candidate_count = 0
+    start = time.time()
+    with Pool(workers, initializer=_init_mine_worker, initargs=(repo_root,)) as pool, open(
+        output_file, "a"
+    ) as fo, open(ckpt_file, "a") as fc:
+        results = pool.imap_unordered(_mine_commit, commit_ids, chunksize=16)
+        for i, (commit_id, focal_paths) in enumerate(results):
+            if focal_paths:
+                candidate_count += 1
+                record = {
+                    "repo_name": repo_name,
+                    "commit_id": commit_id,
+                    "focal_paths": focal_paths,
+                }
+                fo.write(json.dumps(record) + "\n")
+                fo.flush()
+            # checkpoint after the candidate is written
+            fc.write(f"{repo_name} {commit_id}\n")
+            if (i + 1) % 1000 == 0:
+                fc.flush()
+                logger.info(
+                    f"{repo_name}: {i + 1}/{len(commit_ids)} commits mined ({(i + 1) / (time.time() - start):.1f} commits/s)"
+                )
+    logger.info(
+        f"Mined {len(commit_ids)} commits of {repo_name} in {time.time() - start:.1f}s, {candidate_count} candidates."
+    )
+    return candidate_count
+
+
+############################################################################################################
+# The methods below build dataset examples (focal/test method pairs) from the mined candidate commits
+############################################################################################################
+
+
+def is_test_path(rel_path: str) -> bool:
+    return "test" in rel_path or "tck" in rel_path
+
+
+def file_at_commit(commit: Commit, rel_path: str) -> str:
+    try:
+        return commit.tree[rel_path].data_stream.read().decode()
+    except KeyError:
+        return ""
+
+
+def text_hash(*texts: str) -> str:
+    return hashlib.sha1("\0".join(texts).encode()).hexdigest()
+
+
+def changed_focal_pairs(
+    file_src: str, file_tgt: str, delete_lines: set[int]
+) -> list[tuple[str, str]]:
+    """
+    Pair the src methods whose signature lines are deleted with their tgt methods.
+    Overloads are disambiguated by excluding unchanged methods and then by the number of parameters.
+    """
+    src_methods = all_methods_from_file(file_src)
+    tgt_methods = all_methods_from_file(file_tgt)
+    src_texts = {m["text"] for m in src_methods}
+    pairs = []
+    for m in src_methods:
+        sig_lines = range(m["start_line"], m["sig_end_line"] + 1)
+        if not any(ln in delete_lines for ln in sig_lines):
+            continue
+        candidates = [t for t in tgt_methods if t["name"] == m["name"]]
+        candidates = [t for t in candidates if t["text"] not in src_texts] or candidates
+        if len(candidates) > 1:
+            candidates = [
+                t for t in candidates if t["param_count"] == m["param_count"]
+            ] or candidates
+        if len(candidates) == 1:
+            pairs.append((m["text"], candidates[0]["text"]))
+    return pairs
+
+
+def changed_test_pairs(
+    file_src: str, file_tgt: str, focal_name: str
+) -> list[tuple[str, str]]:
+    """Pair the changed test methods (by name) whose src version invokes the focal method."""
+    src_methods = {}
+    for m in all_methods_from_file(file_src):
+        src_methods.setdefault(m["name"], []).append(m["text"])
+    tgt_methods = {}
+    for m in all_methods_from_file(file_tgt):
+        tgt_methods.setdefault(m["name"], []).append(m["text"])
+    pairs = []
+    for name, src_texts in src_methods.items():
+        tgt_texts = tgt_methods.get(name, [])
+        # overloaded test methods are ambiguous
+        if len(src_texts) != 1 or len(tgt_texts) != 1:
+            continue
+        if src_texts[0] != tgt_texts[0] and has_method_invocation(
+            src_texts[0], focal_name
+        ):
+            pairs.append((src_texts[0], tgt_texts[0]))
+    return pairs
+
+
+def extract_examples_from_commit(
+    repo: Repo, repo_name: str, commit_id: str, focal_paths: list[str]
+) -> list[dict]:
+    """
+    Extract the examples(focal method with syntactic changes, co-evolved test method) from a candidate commit.
+    """
+    commit = repo.commit(commit_id)
+    if not commit.parents:
+        return []
+    parent = commit.parents[0]
+    test_paths = [
+        diff.a_path
+        for diff in commit.diff(parent, R=True).iter_change_type("M")
+        if diff.a_path.endswith(".java")
+        and diff.a_path == diff.b_path
+        and is_test_path(diff.a_path)
+    ]
+    test_files = {}
+    examples = []
+    for focal_path in focal_paths:
+        focal_diffs = commit.diff(
+            parent, paths=focal_path, create_patch=True, R=True, unified=0
+        )
+        if not focal_diffs:
+            continue
+        delete_lines = all_code_delete_lines(focal_diffs[0].diff.decode())
+        focal_pairs = changed_focal_pairs(
+            file_at_commit(parent, focal_path),
+            file_at_commit(commit, focal_path),
+            delete_lines,
+        )
+        if not focal_pairs:
+            continue
+        # the co-evolved tests of the focal file
+        related_tests = [t for t in test_paths if match_focal_paths([t], [focal_path])]
+        for focal_src, focal_tgt in focal_pairs:
+            syn_diff = compare_syndiff(focal_src, focal_tgt)
+            if syn_diff["overall"] <= 0:
+                continue
+            focal_name = extract_method_metadata(focal_src)["name"]
+            for test_path in related_tests:
+                if test_path not in test_files:
+                    test_files[test_path] = (
+                        file_at_commit(parent, test_path),
+                        file_at_commit(commit, test_path),
+                    )
+                test_pairs = changed_test_pairs(*test_files[test_path], focal_name)
+                for test_src, test_tgt in test_pairs:
+                    focal_db = {
+                        "id": text_hash(repo_name, commit_id, focal_path, focal_src)[:12],
+                        "rel_path": focal_path,
+                        "method_src": focal_src,
+                        "method_tgt": focal_tgt,
+                    }
+                    test_db = {
+                        "id": text_hash(repo_name, commit_id, test_path, test_src)[:12],
+                        "rel_path": test_path,
+                        "method_src": test_src,
+                        "method_tgt": test_tgt,
+                    }
+                    exp = Example(repo_name, commit_id, focal_db, test_db, syn_diff)
+                    examples.append(exp.to_dict())
+    return examples
+
+
+def example_key(record: dict) -> str:
+    """Deduplicate examples by the repo and the contents of the method pairs."""
+    return text_hash(
+        record["repo_name"],
+        record["focal_db"]["method_src"],
+        record["focal_db"]["method_tgt"],
+        record["test_db"]["method_src"],
+        record["test_db"]["method_tgt"],
+    )
+
+
+# every worker process opens each repository once
+_worker_repos: dict[str, Repo] = dict()
+_worker_repo_base: str = REPO_BASE
+
+
+def _init_build_worker(repo_base: str):
+    global _worker_repo_base
+    _worker_repo_base = repo_base
+
+
+def _build_from_candidate(candidate: dict) -> tuple[dict, list[dict]]:
+    repo_name = candidate["repo_name"]
+    try:
+        if repo_name not in _worker_repos:
+            _worker_repos[repo_name] = Repo(os.path.join(_worker_repo_base, repo_name))
+        records = extract_examples_from_commit(
+            _worker_repos[repo_name],
+            repo_name,
+            candidate["commit_id"],
+            candidate["focal_paths"],
+        )
+        return candidate, records
+    except Exception as e:
+        logger.warning(
+            f"Failed to extract examples from {repo_name}@{candidate['commit_id'][:6]}: {e}"
+        )
+        return candidate, []
+
+
+def read_jsonl(filepath: str) -> Iterator[dict]:
+    if not os.path.exists(filepath):
+        return
+    with open(filepath, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build_dataset(
+    candidate_file: str,
+    output_file: str,
+    repo_base: str = REPO_BASE,
+    workers: int = None,
+) -> int:
+    """
+    Build deduplicated examples from the candidate commits (jsonl from mine_repo) in a process pool.
+    Examples are streamed to output_file (jsonl), and the processed candidates are recorded in
+    output_file + ".ckpt", so an interrupted build resumes from the unprocessed candidates.
+
+    Returns:
+        int: The number of new examples.
+    """
+    ckpt_file = output_file + ".ckpt"
+    done = set()
+    if os.path.exists(ckpt_file):
+        with open(ckpt_file, "r") as f:
+            done = {line.strip() for line in f if line.strip()}
+    seen = {example_key(record) for record in read_jsonl(output_file)}
+    candidates = [
+        c
+        for c in read_jsonl(candidate_file)
+        if f"{c['repo_name']} {c['commit_id']}" not in done
+    ]
+    workers = workers or os.cpu_count()
+    logger.info(
+        f"Building examples from {len(candidates)} candidates ({len(done)} processed, {len(seen)} examples) with {workers} workers"
+    )
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    new_count = 0
+    start = time.time()
+    with Pool(workers, initializer=_init_build_worker, initargs=(repo_base,)) as pool, open(
+        output_file, "a"
+    ) as fo, open(ckpt_file, "a") as fc:
+        results = pool.imap_unordered(_build_from_candidate, candidates, chunksize=4)
+        for i, (candidate, records) in enumerate(results):
+            for record in records:
+                key = example_key(record)
+                if key in seen:
+                    continue
+                seen.add(key)
+                fo.write(json.dumps(record) + "\n")
+                new_count += 1
+            fo.flush()
+            # checkpoint after the examples are written
+            fc.write(f"{candidate['repo_name']} {candidate['commit_id']}\n")
+            fc.flush()
+            if (i + 1) % 100 == 0:
+                logger.info(
+                    f"{i + 1}/{len(candidates)} candidates processed, {new_count} new examples ({(i + 1) / (time.time() - start):.1f} candidates/s)"
+                )
+    logger.info(
+        f"Processed {len(candidates)} candidates in {time.time() - start:.1f}s, {new_count} new examples."
+    )
+    return new_count
@@ -12,6 +12,7 @@ import logging
 import os
 import pathlib
 import threading
+from collections import OrderedDict
 from contextlib import asynccontextmanager, contextmanager
 from .lsp_protocol_handler.lsp_constants import LSPConstants
 from .lsp_protocol_handler import lsp_types as LSPTypes
@@ -26,9 +27,11 @@ from .multilspy_config import MultilspyConfig, Language
 from .multilspy_exceptions import MultilspyException
 from .multilspy_utils import PathUtils, FileUtils, TextUtils
 from pathlib import PurePath
-from typing import AsyncIterator, Iterator, List, Dict, Union, Tuple
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterator, List, Dict, Optional, TypeVar, Union, Tuple
 from .type_helpers import ensure_all_methods_implemented
 
+T = TypeVar("T")
+
 
 @dataclasses.dataclass
 class LSPFileBuffer:
@@ -51,6 +54,35 @@ class LSPFileBuffer:
     # reference count of the file
     ref_count: int
 
+    # (mtime, size) of the file on disk when its contents were read
+    disk_stat: Optional[Tuple[int, int]] = None
+
+
+def file_disk_stat(absolute_file_path: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (mtime, size) of the file, None if it does not exist.
+    """
+    try:
+        stat = os.stat(absolute_file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def relative_to_workspace_folders(
+    absolute_path: str, workspace_folders: List[str], default_root: str
+) -> str:
+    """
+    Returns the path relative to the workspace folder (repository) containing it,
+    the innermost one if the folders are nested, or relative to default_root if no folder contains it.
+    """
+    owner = None
+    for folder in workspace_folders:
+        if absolute_path == folder or absolute_path.startswith(folder.rstrip(os.sep) + os.sep):
+            if owner is None or len(folder) > len(owner):
+                owner = folder
+    return str(PurePath(os.path.relpath(absolute_path, owner or default_root)))
+
 
 class LanguageServer:
     """
@@ -151,7 +183,11 @@ class LanguageServer:
         )
 
         self.language_id = language_id
-        self.open_file_buffers: Dict[str, LSPFileBuffer] = {}
+        # open documents in the order of use, unused ones (ref_count == 0) are kept open up to max_open_files
+        self.open_file_buffers: Dict[str, LSPFileBuffer] = OrderedDict()
+        self.max_open_files = config.max_open_files
+        # the repositories served by the server, file paths of the responses are relative to their folder
+        self.workspace_folders: List[str] = [os.path.abspath(repository_root_path)]
 
     @asynccontextmanager
     async def start_server(self) -> AsyncIterator["LanguageServer"]:
@@ -169,8 +205,12 @@ class LanguageServer:
         ```
         """
         self.server_started = True
-        yield self
-        self.server_started = False
+        try:
+            yield self
+        finally:
+            # the documents are dropped with the server
+            self.open_file_buffers.clear()
+            self.server_started = False
 
     # TODO: Add support for more LSP features
 
@@ -194,18 +234,47 @@ class LanguageServer:
         uri = pathlib.Path(absolute_file_path).as_uri()
 
         if uri in self.open_file_buffers:
-            assert self.open_file_buffers[uri].uri == uri
-            assert self.open_file_buffers[uri].ref_count >= 1
-
-            self.open_file_buffers[uri].ref_count += 1
-            yield
-            self.open_file_buffers[uri].ref_count -= 1
+            file_buffer = self.open_file_buffers[uri]
+            assert file_buffer.uri == uri
+            contents = file_buffer.contents
+            if file_buffer.ref_count == 0:
+                # kept open after the last use, re-read only if the file is changed on disk since
+                disk_stat = file_disk_stat(absolute_file_path)
+                if disk_stat is None or disk_stat != file_buffer.disk_stat:
+                    contents = FileUtils.read_file(self.logger, absolute_file_path)
+                    file_buffer.disk_stat = disk_stat
+            if contents != file_buffer.contents:
+                # kept open after the last use and the file is changed on disk, send only the changed span
+                start_l, start_c, end_l, end_c, text = TextUtils.get_incremental_change(
+                    file_buffer.contents, contents
+                )
+                file_buffer.version += 1
+                file_buffer.contents = contents
+                self.server.notify.did_change_text_document(
+                    {
+                        LSPConstants.TEXT_DOCUMENT: {
+                            LSPConstants.VERSION: file_buffer.version,
+                            LSPConstants.URI: uri,
+                        },
+                        LSPConstants.CONTENT_CHANGES: [
+                            {
+                                LSPConstants.RANGE: {
+                                    "start": {"line": start_l, "character": start_c},
+                                    "end": {"line": end_l, "character": end_c},
+                                },
+                                "text": text,
+                            }
+                        ],
+                    }
+                )
+            self.open_file_buffers.move_to_end(uri)
         else:
+            disk_stat = file_disk_stat(absolute_file_path)
             contents = FileUtils.read_file(self.logger, absolute_file_path)
 
             version = 0
             self.open_file_buffers[uri] = LSPFileBuffer(
-                uri, contents, version, self.language_id, 1
+                uri, contents, version, self.language_id, 0, disk_stat
             )
 
             self.server.notify.did_open_text_document(
@@ -218,10 +287,29 @@ class LanguageServer:
                     }
                 }
             )
+
+        file_buffer = self.open_file_buffers[uri]
+        file_buffer.ref_count += 1
+        try:
             yield
-            self.open_file_buffers[uri].ref_count -= 1
+        finally:
+            file_buffer.ref_count -= 1
+            # the documents are dropped without notifications when the server stops inside the block
+            if self.server_started and self.open_file_buffers.get(uri) is file_buffer:
+                self.close_unused_files(self.max_open_files)
 
-        if self.open_file_buffers[uri].ref_count == 0:
+    def close_unused_files(self, max_open_files: int = 0) -> None:
+        """
+        Close the least recently used documents that are not in use, until at most max_open_files are open.
+
+        :param max_open_files: The number of documents to keep open, 0 closes all the documents kept open after use.
+        """
+        excess = len(self.open_file_buffers) - max_open_files
+        for uri in [
+            uri for uri, buffer in self.open_file_buffers.items() if buffer.ref_count == 0
+        ]:
+            if excess <= 0:
+                break
             self.server.notify.did_close_text_document(
                 {
                     LSPConstants.TEXT_DOCUMENT: {
@@ -230,6 +318,112 @@ class LanguageServer:
                 }
             )
             del self.open_file_buffers[uri]
+            excess -= 1
+
+    def reload_files(self, file_paths: List[str]) -> None:
+        """
+        Bring the open documents of the files changed on disk (e.g. by a checkout) in sync with the Language Server,
+        which ignores the disk changes of open documents: the ones kept open after use are closed,
+        the ones in use are replaced by the contents on disk.
+
+        :param file_paths: The paths of the changed files, absolute or relative to the repository root.
+        """
+        for file_path in file_paths:
+            absolute_file_path = str(PurePath(self.repository_root_path, file_path))
+            uri = pathlib.Path(absolute_file_path).as_uri()
+            if uri not in self.open_file_buffers:
+                continue
+            file_buffer = self.open_file_buffers[uri]
+            if file_buffer.ref_count == 0:
+                self.server.notify.did_close_text_document(
+                    {
+                        LSPConstants.TEXT_DOCUMENT: {
+                            LSPConstants.URI: uri,
+                        }
+                    }
+                )
+                del self.open_file_buffers[uri]
+                continue
+            file_buffer.disk_stat = file_disk_stat(absolute_file_path)
+            contents = (
+                FileUtils.read_file(self.logger, absolute_file_path)
+                if file_buffer.disk_stat is not None
+                else ""
+            )
+            if contents == file_buffer.contents:
+                continue
+            file_buffer.version += 1
+            file_buffer.contents = contents
+            self.server.notify.did_change_text_document(
+                {
+                    LSPConstants.TEXT_DOCUMENT: {
+                        LSPConstants.VERSION: file_buffer.version,
+                        LSPConstants.URI: uri,
+                    },
+                    LSPConstants.CONTENT_CHANGES: [{"text": contents}],
+                }
+            )
+
+    def add_workspace_folder(self, repository_root_path: str) -> None:
+        """
+        Add a repository to the workspace folders of the Language Server, its files are addressed by absolute paths
+        (or by paths relative to it through `multi_root.RepositoryView`).
+
+        :param repository_root_path: The root path of the repository.
+        """
+        if not self.server_started:
+            self.logger.log(
+                "add_workspace_folder called before Language Server started",
+                logging.ERROR,
+            )
+            raise MultilspyException("Language Server not started")
+
+        folder = os.path.abspath(repository_root_path)
+        if folder in self.workspace_folders:
+            return
+        self.workspace_folders.append(folder)
+        self.server.notify.did_change_workspace_folders(
+            {
+                "event": {
+                    "added": [
+                        {"uri": pathlib.Path(folder).as_uri(), "name": os.path.basename(folder)}
+                    ],
+                    "removed": [],
+                }
+            }
+        )
+
+    def remove_workspace_folder(self, repository_root_path: str) -> None:
+        """
+        Remove a repository from the workspace folders of the Language Server, its open documents are closed.
+
+        :param repository_root_path: The root path of the repository.
+        """
+        folder = os.path.abspath(repository_root_path)
+        if folder not in self.workspace_folders:
+            return
+        folder_uri = pathlib.Path(folder).as_uri().rstrip("/") + "/"
+        for uri in [uri for uri in self.open_file_buffers if uri.startswith(folder_uri)]:
+            assert self.open_file_buffers[uri].ref_count == 0, f"{uri} is still in use"
+            self.server.notify.did_close_text_document(
+                {
+                    LSPConstants.TEXT_DOCUMENT: {
+                        LSPConstants.URI: uri,
+                    }
+                }
+            )
+            del self.open_file_buffers[uri]
+        self.workspace_folders.remove(folder)
+        self.server.notify.did_change_workspace_folders(
+            {
+                "event": {
+                    "added": [],
+                    "removed": [
+                        {"uri": pathlib.Path(folder).as_uri(), "name": os.path.basename(folder)}
+                    ],
+                }
+            }
+        )
 
     def insert_text_at_position(
         self, relative_file_path: str, line: int, column: int, text_to_be_inserted: str
@@ -268,6 +462,8 @@ class LanguageServer:
             + text_to_be_inserted
             + file_buffer.contents[change_index:]
         )
+        # edited in memory, re-read on the next use after being kept open
+        file_buffer.disk_stat = None
         self.server.notify.did_change_text_document(
             {
                 LSPConstants.TEXT_DOCUMENT: {
@@ -326,6 +522,7 @@ class LanguageServer:
         file_buffer.contents = (
             file_buffer.contents[:del_start_idx] + file_buffer.contents[del_end_idx:]
         )
+        file_buffer.disk_stat = None
         self.server.notify.did_change_text_document(
             {
                 LSPConstants.TEXT_DOCUMENT: {
@@ -442,12 +639,10 @@ class LanguageServer:
                     new_item: multilspy_types.Location = {}
                     new_item.update(item)
                     new_item["absolutePath"] = PathUtils.uri_to_path(new_item["uri"])
-                    new_item["relativePath"] = str(
-                        PurePath(
-                            os.path.relpath(
-                                new_item["absolutePath"], self.repository_root_path
-                            )
-                        )
+                    new_item["relativePath"] = relative_to_workspace_folders(
+                        new_item["absolutePath"],
+                        self.workspace_folders,
+                        self.repository_root_path,
                     )
                     ret.append(multilspy_types.Location(new_item))
                 elif (
@@ -459,12 +654,10 @@ class LanguageServer:
                     new_item: multilspy_types.Location = {}
                     new_item["uri"] = item[LSPConstants.TARGET_URI]
                     new_item["absolutePath"] = PathUtils.uri_to_path(new_item["uri"])
-                    new_item["relativePath"] = str(
-                        PurePath(
-                            os.path.relpath(
-                                new_item["absolutePath"], self.repository_root_path
-                            )
-                        )
+                    new_item["relativePath"] = relative_to_workspace_folders(
+                        new_item["absolutePath"],
+                        self.workspace_folders,
+                        self.repository_root_path,
                     )
                     new_item["range"] = item[LSPConstants.TARGET_SELECTION_RANGE]
                     ret.append(multilspy_types.Location(**new_item))
@@ -478,10 +671,8 @@ class LanguageServer:
             new_item: multilspy_types.Location = {}
             new_item.update(response)
             new_item["absolutePath"] = PathUtils.uri_to_path(new_item["uri"])
-            new_item["relativePath"] = str(
-                PurePath(
-                    os.path.relpath(new_item["absolutePath"], self.repository_root_path)
-                )
+            new_item["relativePath"] = relative_to_workspace_folders(
+                new_item["absolutePath"], self.workspace_folders, self.repository_root_path
             )
             ret.append(multilspy_types.Location(**new_item))
         else:
@@ -534,15 +725,71 @@ class LanguageServer:
             new_item: multilspy_types.Location = {}
             new_item.update(item)
             new_item["absolutePath"] = PathUtils.uri_to_path(new_item["uri"])
-            new_item["relativePath"] = str(
-                PurePath(
-                    os.path.relpath(new_item["absolutePath"], self.repository_root_path)
-                )
+            new_item["relativePath"] = relative_to_workspace_folders(
+                new_item["absolutePath"], self.workspace_folders, self.repository_root_path
             )
             ret.append(multilspy_types.Location(**new_item))
 
         return ret
 
+    async def request_references_stream(
+        self, relative_file_path: str, line: int, column: int
+    ) -> AsyncIterator[List[multilspy_types.Location]]:
+        """
+        Raise a [textDocument/references](https://microsoft.github.io/language-server-protocol/specifications/lsp/3.17/specification/#textDocument_references) request to the Language Server
+        with a partial result token, and yield the batches of references as they arrive. The server may send
+        all the references in the final response, then there is only one batch.
+
+        :param relative_file_path: The relative path of the file that has the symbol for which references should be looked up
+        :param line: The line number of the symbol
+        :param column: The column number of the symbol
+
+        :return AsyncIterator[List[multilspy_types.Location]]: The batches of locations where the symbol is referenced
+        """
+
+        if not self.server_started:
+            self.logger.log(
+                "request_references_stream called before Language Server started",
+                logging.ERROR,
+            )
+            raise MultilspyException("Language Server not started")
+
+        with self.open_file(relative_file_path):
+            responses = self.server.send_request_with_partial_results(
+                "textDocument/references",
+                {
+                    "context": {"includeDeclaration": False},
+                    "textDocument": {
+                        "uri": pathlib.Path(
+                            os.path.join(self.repository_root_path, relative_file_path)
+                        ).as_uri()
+                    },
+                    "position": {"line": line, "character": column},
+                },
+            )
+            try:
+                async for response in responses:
+                    if not response:
+                        continue
+                    assert isinstance(response, list)
+                    batch: List[multilspy_types.Location] = []
+                    for item in response:
+                        assert isinstance(item, dict)
+                        assert LSPConstants.URI in item
+                        assert LSPConstants.RANGE in item
+
+                        new_item: multilspy_types.Location = {}
+                        new_item.update(item)
+                        new_item["absolutePath"] = PathUtils.uri_to_path(new_item["uri"])
+                        new_item["relativePath"] = relative_to_workspace_folders(
+                            new_item["absolutePath"], self.workspace_folders, self.repository_root_path
+                        )
+                        batch.append(multilspy_types.Location(**new_item))
+                    yield batch
+            finally:
+                # unregister the request even if the caller stops early
+                await responses.aclose()
+
     async def request_completions(
         self,
         relative_file_path: str,
@@ -755,6 +1002,9 @@ class SyncLanguageServer:
         self.language_server = language_server
         self.loop = None
         self.loop_thread = None
+        # returns the seconds to wait for the server (None: no limit), e.g. the time left before a deadline of the caller,
+        # the request is cancelled and TimeoutError is raised when it runs out
+        self.request_timeout: Optional[Callable[[], Optional[float]]] = None
 
     @classmethod
     def create(
@@ -785,6 +1035,38 @@ class SyncLanguageServer:
         with self.language_server.open_file(relative_file_path):
             yield
 
+    def close_unused_files(self, max_open_files: int = 0) -> None:
+        """
+        Close the least recently used documents that are not in use, until at most max_open_files are open.
+
+        :param max_open_files: The number of documents to keep open, 0 closes all the documents kept open after use.
+        """
+        self.language_server.close_unused_files(max_open_files)
+
+    def reload_files(self, file_paths: List[str]) -> None:
+        """
+        Bring the open documents of the files changed on disk in sync with the Language Server.
+
+        :param file_paths: The paths of the changed files, absolute or relative to the repository root.
+        """
+        self.language_server.reload_files(file_paths)
+
+    def add_workspace_folder(self, repository_root_path: str) -> None:
+        """
+        Add a repository to the workspace folders of the Language Server.
+
+        :param repository_root_path: The root path of the repository.
+        """
+        self.language_server.add_workspace_folder(repository_root_path)
+
+    def remove_workspace_folder(self, repository_root_path: str) -> None:
+        """
+        Remove a repository from the workspace folders of the Language Server, its open documents are closed.
+
+        :param repository_root_path: The root path of the repository.
+        """
+        self.language_server.remove_workspace_folder(repository_root_path)
+
     def insert_text_at_position(
         self, relative_file_path: str, line: int, column: int, text_to_be_inserted: str
     ) -> multilspy_types.Position:
@@ -846,13 +1128,36 @@ class SyncLanguageServer:
         loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
         loop_thread.start()
         ctx = self.language_server.start_server()
-        asyncio.run_coroutine_threadsafe(ctx.__aenter__(), loop=self.loop).result()
-        yield self
-        asyncio.run_coroutine_threadsafe(
-            ctx.__aexit__(None, None, None), loop=self.loop
-        ).result()
-        self.loop.call_soon_threadsafe(self.loop.stop)
-        loop_thread.join()
+        try:
+            # the startup is bounded by request_timeout too, a timed out startup cleans up the server
+            self._run(ctx.__aenter__())
+        except BaseException:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            loop_thread.join()
+            raise
+        try:
+            yield self
+        finally:
+            asyncio.run_coroutine_threadsafe(
+                ctx.__aexit__(None, None, None), loop=self.loop
+            ).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            loop_thread.join()
+
+    def _run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """
+        Run the coroutine in the event loop of the server and wait for its result, at most request_timeout() seconds
+        """
+        timeout = self.request_timeout() if self.request_timeout is not None else None
+        try:
+            return asyncio.run_coroutine_threadsafe(
+                asyncio.wait_for(coro, timeout), self.loop
+            ).result()
+        except asyncio.TimeoutError as e:
+            if timeout is None:
+                raise
+            # the same as TimeoutError since python 3.11
+            raise TimeoutError(f"No response from the Language Server in {timeout:.1f}s") from e
 
     def request_definition(
         self, file_path: str, line: int, column: int
@@ -867,9 +1172,9 @@ class SyncLanguageServer:
 
         :return List[multilspy_types.Location]: A list of locations where the symbol is defined
         """
-        result = asyncio.run_coroutine_threadsafe(
-            self.language_server.request_definition(file_path, line, column), self.loop
-        ).result()
+        result = self._run(
+            self.language_server.request_definition(file_path, line, column)
+        )
         return result
 
     def request_references(
@@ -885,11 +1190,36 @@ class SyncLanguageServer:
 
         :return List[multilspy_types.Location]: A list of locations where the symbol is referenced
         """
-        result = asyncio.run_coroutine_threadsafe(
-            self.language_server.request_references(file_path, line, column), self.loop
-        ).result()
+        result = self._run(
+            self.language_server.request_references(file_path, line, column)
+        )
         return result
 
+    def request_references_stream(
+        self, file_path: str, line: int, column: int
+    ) -> Iterator[List[multilspy_types.Location]]:
+        """
+        Raise a [textDocument/references](https://microsoft.github.io/language-server-protocol/specifications/lsp/3.17/specification/#textDocument_references) request to the Language Server
+        with a partial result token, and yield the batches of references as they arrive, so that the caller
+        can process a batch while the server is still searching.
+
+        :param relative_file_path: The relative path of the file that has the symbol for which references should be looked up
+        :param line: The line number of the symbol
+        :param column: The column number of the symbol
+
+        :return Iterator[List[multilspy_types.Location]]: The batches of locations where the symbol is referenced
+        """
+        stream = self.language_server.request_references_stream(file_path, line, column)
+        try:
+            while True:
+                try:
+                    batch = self._run(stream.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield batch
+        finally:
+            asyncio.run_coroutine_threadsafe(stream.aclose(), self.loop).result()
+
     def request_completions(
         self,
         relative_file_path: str,
@@ -907,12 +1237,11 @@ class SyncLanguageServer:
 
         :return List[multilspy_types.CompletionItem]: A list of completions
         """
-        result = asyncio.run_coroutine_threadsafe(
+        result = self._run(
             self.language_server.request_completions(
                 relative_file_path, line, column, allow_incomplete
-            ),
-            self.loop,
-        ).result()
+            )
+        )
         return result
 
     def request_document_symbols(self, relative_file_path: str) -> Tuple[
@@ -927,9 +1256,9 @@ class SyncLanguageServer:
 
         :return Tuple[List[multilspy_types.UnifiedSymbolInformation], Union[List[multilspy_types.TreeRepr], None]]: A list of symbols in the file, and the tree representation of the symbols
         """
-        result = asyncio.run_coroutine_threadsafe(
-            self.language_server.request_document_symbols(relative_file_path), self.loop
-        ).result()
+        result = self._run(
+            self.language_server.request_document_symbols(relative_file_path)
+        )
         return result
 
     def request_hover(
@@ -945,8 +1274,7 @@ class SyncLanguageServer:
 
         :return None
         """
-        result = asyncio.run_coroutine_threadsafe(
-            self.language_server.request_hover(relative_file_path, line, column),
-            self.loop,
-        ).result()
+        result = self._run(
+            self.language_server.request_hover(relative_file_path, line, column)
+        )
         return result
@@ -0,0 +1,138 @@
+"""
+JVM class-data-sharing (AppCDS) archive of EclipseJDTLS.
+
+The first launch without a valid archive dumps the loaded classes at exit (-XX:ArchiveClassesAtExit),
+the later launches map the archive (-XX:SharedArchiveFile) instead of loading and verifying the classes again.
+An archive is keyed by the JRE release and the JDTLS launcher/plugins, so it is regenerated when any of them changes.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import PurePath
+from typing import Dict, List, Optional
+
+from ...multilspy_settings import MultilspySettings
+from .workspaces import try_lock
+
+# seconds for the JVM of the creating launch to exit by itself (the archive is only dumped by a normal exit)
+DUMP_EXIT_SECONDS = 300
+
+
+def cds_directory() -> str:
+    return str(
+        PurePath(MultilspySettings.get_language_server_directory(), "EclipseJDTLS", "cds")
+    )
+
+
+def runtime_key(jre_home_path: str, jdtls_launcher_jar_path: str) -> str:
+    """Hash of the JRE release file and the jars of the JDTLS plugins (names, sizes and mtimes)."""
+    digest = hashlib.sha1()
+    release_path = os.path.join(jre_home_path, "release")
+    if os.path.exists(release_path):
+        with open(release_path, "rb") as f:
+            digest.update(f.read())
+    plugins_dir = os.path.dirname(jdtls_launcher_jar_path)
+    for name in sorted(os.listdir(plugins_dir)):
+        stat = os.stat(os.path.join(plugins_dir, name))
+        digest.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}".encode())
+    return digest.hexdigest()[:16]
+
+
+class CDSArchive:
+    """
+    The archive of a JDTLS runtime: <cds>/jdtls-<key>.jsa with <cds>/jdtls-<key>.json (versions of the runtime).
+    """
+
+    def __init__(self, jre_home_path: str, jdtls_launcher_jar_path: str, log_class_loading: bool = False):
+        """
+        log_class_loading: log the class loading of the launch, to count the classes served by the archive
+        (see class_load_stats). The plugin classes loaded by the class loaders of Equinox are not archived by the JVM.
+        """
+        base = cds_directory()
+        os.makedirs(base, exist_ok=True)
+        self.key = runtime_key(jre_home_path, jdtls_launcher_jar_path)
+        self.archive_path = os.path.join(base, f"jdtls-{self.key}.jsa")
+        self.meta_path = os.path.join(base, f"jdtls-{self.key}.json")
+        self.dump_path = self.archive_path + f".{os.getpid()}.tmp"
+        self.jre_home_path = jre_home_path
+        self.jdtls_launcher_jar_path = jdtls_launcher_jar_path
+        self._lock_file = None
+        self.class_load_log = (
+            os.path.join(base, f"jdtls-{self.key}.{os.getpid()}.{id(self)}.classload.log")
+            if log_class_loading
+            else None
+        )
+        # use: map the archive | create: dump the archive at exit | None: run without archive
+        self.mode: Optional[str] = None
+
+    def is_valid(self) -> bool:
+        if not (os.path.exists(self.archive_path) and os.path.exists(self.meta_path)):
+            return False
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+        except ValueError:
+            return False
+        return meta.get("key") == self.key and os.path.getsize(self.archive_path) == meta.get("size")
+
+    def jvm_args(self) -> List[str]:
+        """The JVM options of this launch, only one launch creates the archive at a time."""
+        log_args = [f"-Xlog:class+load=info:file={self.class_load_log}"] if self.class_load_log else []
+        if self.is_valid():
+            self.mode = "use"
+            return [f"-XX:SharedArchiveFile={self.archive_path}", "-Xshare:auto", *log_args]
+        self._lock_file = try_lock(self.archive_path + ".lock")
+        if self._lock_file is None:
+            # being created by another launch
+            return log_args
+        self.mode = "create"
+        return [f"-XX:ArchiveClassesAtExit={self.dump_path}", *log_args]
+
+    def class_load_stats(self) -> Optional[Dict]:
+        """
+        The classes loaded so far by the launch (with log_class_loading) by their source:
+        the base archive of the JDK, the top (dynamic) archive of JDTLS, or the jars and the jrt image (not archived).
+        """
+        if not self.class_load_log or not os.path.exists(self.class_load_log):
+            return None
+        stats = {"loaded": 0, "base_archive": 0, "top_archive": 0}
+        with open(self.class_load_log, "r", errors="replace") as f:
+            for line in f:
+                source = line.rsplit("source: ", 1)[-1].strip() if "source: " in line else None
+                if source is None:
+                    continue
+                stats["loaded"] += 1
+                if source == "shared objects file (top)":
+                    stats["top_archive"] += 1
+                elif source.startswith("shared objects file"):
+                    stats["base_archive"] += 1
+        stats["not_archived"] = stats["loaded"] - stats["base_archive"] - stats["top_archive"]
+        return stats
+
+    def finalize(self, exited_normally: bool = True) -> bool:
+        """
+        Publish the archive dumped at the exit of the created launch, return True if published.
+        A JVM killed while dumping leaves a truncated archive, which is discarded.
+        """
+        if self.class_load_log and os.path.exists(self.class_load_log):
+            os.remove(self.class_load_log)
+        if self.mode != "create":
+            return False
+        published = False
+        if exited_normally and os.path.exists(self.dump_path) and os.path.getsize(self.dump_path) > 0:
+            os.replace(self.dump_path, self.archive_path)
+            meta = {
+                "key": self.key,
+                "size": os.path.getsize(self.archive_path),
+                "jre_home_path": self.jre_home_path,
+                "jdtls_launcher_jar_path": self.jdtls_launcher_jar_path,
+            }
+            with open(self.meta_path, "w") as f:
+                json.dump(meta, f, indent=4)
+            published = True
+        elif os.path.exists(self.dump_path):
+            os.remove(self.dump_path)
+        self._lock_file.close()
+        self._lock_file = None
+        return published
@@ -10,6 +10,7 @@ import os
 import pathlib
 import shutil
 import stat
+import time
 import uuid
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
@@ -22,6 +23,8 @@ from ...multilspy_config import MultilspyConfig
 from ...multilspy_settings import MultilspySettings
 from ...multilspy_utils import FileUtils
 from ...multilspy_utils import PlatformUtils
+from .workspaces import JDTLSWorkspace, workspaces_directory
+from .cds import CDSArchive, DUMP_EXIT_SECONDS
 from pathlib import PurePath
 
 
@@ -60,101 +63,131 @@ class EclipseJDTLS(LanguageServer):
         runtime_dependency_paths = self.setupRuntimeDependencies(logger, config)
         self.runtime_dependency_paths = runtime_dependency_paths
 
-        # ws_dir is the workspace directory for the EclipseJDTLS server
-        ws_dir = str(
-            PurePath(
-                MultilspySettings.get_language_server_directory(),
-                "EclipseJDTLS",
-                "workspaces",
-                uuid.uuid4().hex,
-            )
-        )
+        assert config.import_mode in ["full", "light"], f"Invalid import mode: {config.import_mode}"
+        self.import_mode = config.import_mode
+        self.source_paths = config.source_paths or []
+        assert config.init_profile in ["full", "retrieval"], f"Invalid init profile: {config.init_profile}"
+        self.init_profile = config.init_profile
+        self.multi_root = config.multi_root
 
-        # shared_cache_location is the global cache used by Eclipse JDTLS across all workspaces
-        shared_cache_location = str(
-            PurePath(
-                MultilspySettings.get_global_cache_directory(),
-                "lsp",
-                "EclipseJDTLS",
-                "sharedIndex",
+        # ws_dir is the workspace directory for the EclipseJDTLS server
+        self.workspace = None
+        if config.persistent_workspace:
+            # the multi-root servers keep the projects of several repositories in their workspace
+            variant = "" if self.import_mode == "full" else self.import_mode
+            if config.multi_root:
+                variant = f"{variant}-multiroot".lstrip("-")
+            self.workspace = JDTLSWorkspace.acquire(repository_root_path, variant=variant)
+            ws_dir = self.workspace.ws_dir
+        else:
+            ws_dir = str(PurePath(workspaces_directory(), uuid.uuid4().hex))
+        # the workspace lock is released by start_server, or here if the initialization fails
+        try:
+            self.ws_dir = ws_dir
+            # seconds from launching the server to ServiceReady, and whether the workspace was reused
+            self.startup_metrics = None
+
+            # shared_cache_location is the global cache used by Eclipse JDTLS across all workspaces
+            shared_cache_location = str(
+                PurePath(
+                    MultilspySettings.get_global_cache_directory(),
+                    "lsp",
+                    "EclipseJDTLS",
+                    "sharedIndex",
+                )
             )
-        )
-
-        jre_path = self.runtime_dependency_paths.jre_path
-        lombok_jar_path = self.runtime_dependency_paths.lombok_jar_path
 
-        jdtls_launcher_jar = self.runtime_dependency_paths.jdtls_launcher_jar_path
+            jre_path = self.runtime_dependency_paths.jre_path
+            lombok_jar_path = self.runtime_dependency_paths.lombok_jar_path
 
-        os.makedirs(ws_dir, exist_ok=True)
+            jdtls_launcher_jar = self.runtime_dependency_paths.jdtls_launcher_jar_path
 
-        data_dir = str(PurePath(ws_dir, "data_dir"))
-        jdtls_config_path = str(PurePath(ws_dir, "config_path"))
+            os.makedirs(ws_dir, exist_ok=True)
 
-        jdtls_readonly_config_path = (
-            self.runtime_dependency_paths.jdtls_readonly_config_path
-        )
+            data_dir = str(PurePath(ws_dir, "data_dir"))
+            jdtls_config_path = str(PurePath(ws_dir, "config_path"))
 
-        if not os.path.exists(jdtls_config_path):
-            shutil.copytree(jdtls_readonly_config_path, jdtls_config_path)
+            jdtls_readonly_config_path = (
+                self.runtime_dependency_paths.jdtls_readonly_config_path
+            )
 
-        for static_path in [
-            jre_path,
-            lombok_jar_path,
-            jdtls_launcher_jar,
-            jdtls_config_path,
-            jdtls_readonly_config_path,
-        ]:
-            assert os.path.exists(static_path), static_path
+            if not os.path.exists(jdtls_config_path):
+                shutil.copytree(jdtls_readonly_config_path, jdtls_config_path)
 
-        proc_env = {"syntaxserver": "false"}
-        proc_cwd = repository_root_path
-        cmd = " ".join(
-            [
+            for static_path in [
                 jre_path,
-                "--add-modules=ALL-SYSTEM",
-                "--add-opens",
-                "java.base/java.util=ALL-UNNAMED",
-                "--add-opens",
-                "java.base/java.lang=ALL-UNNAMED",
-                "--add-opens",
-                "java.base/sun.nio.fs=ALL-UNNAMED",
-                "-Declipse.application=org.eclipse.jdt.ls.core.id1",
-                "-Dosgi.bundles.defaultStartLevel=4",
-                "-Declipse.product=org.eclipse.jdt.ls.core.product",
-                "-Djava.import.generatesMetadataFilesAtProjectRoot=false",
-                "-Dfile.encoding=utf8",
-                "-noverify",
-                "-XX:+UseParallelGC",
-                "-XX:GCTimeRatio=4",
-                "-XX:AdaptiveSizePolicyWeight=90",
-                "-Dsun.zip.disableMemoryMapping=true",
-                "-Djava.lsp.joinOnCompletion=true",
-                "-Xmx3G",
-                "-Xms100m",
-                "-Xlog:disable",
-                "-Dlog.level=ALL",
-                f"-javaagent:{lombok_jar_path}",
-                f"-Djdt.core.sharedIndexLocation={shared_cache_location}",
-                "-jar",
+                lombok_jar_path,
                 jdtls_launcher_jar,
-                "-configuration",
                 jdtls_config_path,
-                "-data",
-                data_dir,
-            ]
-        )
+                jdtls_readonly_config_path,
+            ]:
+                assert os.path.exists(static_path), static_path
+
+            # class-data-sharing archive of the JDTLS runtime, created by the first launch and mapped by the later ones
+            self.cds_archive = None
+            cds_args = []
+            if config.jvm_cds:
+                self.cds_archive = CDSArchive(
+                    self.runtime_dependency_paths.jre_home_path,
+                    jdtls_launcher_jar,
+                    log_class_loading=config.jvm_cds_log,
+                )
+                cds_args = self.cds_archive.jvm_args()
+
+            proc_env = {"syntaxserver": "false"}
+            proc_cwd = repository_root_path
+            cmd = " ".join(
+                [
+                    jre_path,
+                    "--add-modules=ALL-SYSTEM",
+                    "--add-opens",
+                    "java.base/java.util=ALL-UNNAMED",
+                    "--add-opens",
+                    "java.base/java.lang=ALL-UNNAMED",
+                    "--add-opens",
+                    "java.base/sun.nio.fs=ALL-UNNAMED",
+                    "-Declipse.application=org.eclipse.jdt.ls.core.id1",
+                    "-Dosgi.bundles.defaultStartLevel=4",
+                    "-Declipse.product=org.eclipse.jdt.ls.core.product",
+                    "-Djava.import.generatesMetadataFilesAtProjectRoot=false",
+                    "-Dfile.encoding=utf8",
+                    "-noverify",
+                    "-XX:+UseParallelGC",
+                    "-XX:GCTimeRatio=4",
+                    "-XX:AdaptiveSizePolicyWeight=90",
+                    "-Dsun.zip.disableMemoryMapping=true",
+                    "-Djava.lsp.joinOnCompletion=true",
+                    "-Xmx3G",
+                    "-Xms100m",
+                    "-Xlog:disable",
+                    "-Dlog.level=ALL",
+                    f"-javaagent:{lombok_jar_path}",
+                    f"-Djdt.core.sharedIndexLocation={shared_cache_location}",
+                    *cds_args,
+                    "-jar",
+                    jdtls_launcher_jar,
+                    "-configuration",
+                    jdtls_config_path,
+                    "-data",
+                    data_dir,
+                ]
+            )
 
-        self.service_ready_event = asyncio.Event()
-        self.intellicode_enable_command_available = asyncio.Event()
-        self.initialize_searcher_command_available = asyncio.Event()
+            self.service_ready_event = asyncio.Event()
+            self.intellicode_enable_command_available = asyncio.Event()
+            self.initialize_searcher_command_available = asyncio.Event()
 
-        super().__init__(
-            config,
-            logger,
-            repository_root_path,
-            ProcessLaunchInfo(cmd, proc_env, proc_cwd),
-            "java",
-        )
+            super().__init__(
+                config,
+                logger,
+                repository_root_path,
+                ProcessLaunchInfo(cmd, proc_env, proc_cwd),
+                "java",
+            )
+        except BaseException:
+            if self.workspace is not None:
+                self.workspace.release()
+            raise
 
     def setupRuntimeDependencies(
         self, logger: MultilspyLogger, config: MultilspyConfig
@@ -369,6 +402,48 @@ class EclipseJDTLS(LanguageServer):
             "home"
         ] = self.runtime_dependency_paths.jre_path
 
+        if self.init_profile == "retrieval":
+            # only the capabilities used by the retrievers, and no IntelliCode bundle
+            capabilities = d["capabilities"]
+            text_document = capabilities["textDocument"]
+            workspace_capabilities = ["workspaceFolders", "configuration", "didChangeConfiguration"]
+            if self.multi_root:
+                # the checkouts of the hosted repositories are notified as changed files (see utils/lsp_host.py)
+                workspace_capabilities.append("didChangeWatchedFiles")
+            d["capabilities"] = {
+                "workspace": {k: capabilities["workspace"][k] for k in workspace_capabilities},
+                "textDocument": {
+                    "synchronization": {"dynamicRegistration": False, "didSave": False},
+                    "definition": {"dynamicRegistration": False, "linkSupport": True},
+                    "references": {"dynamicRegistration": False},
+                    "documentSymbol": {
+                        **text_document["documentSymbol"],
+                        "dynamicRegistration": False,
+                    },
+                },
+                "general": {"positionEncodings": ["utf-16"]},
+            }
+            d["initializationOptions"]["bundles"] = []
+            java_settings = d["initializationOptions"]["settings"]["java"]
+            java_settings["completion"]["enabled"] = False
+            java_settings["signatureHelp"]["enabled"] = False
+            java_settings["format"]["enabled"] = False
+            java_settings["referencesCodeLens"]["enabled"] = False
+            java_settings["implementationsCodeLens"]["enabled"] = False
+            java_settings["foldingRange"]["enabled"] = False
+            java_settings["selectionRange"]["enabled"] = False
+            java_settings["inlayHints"]["parameterNames"]["enabled"] = "none"
+
+        if self.import_mode == "light":
+            # no build import: the repository is an invisible project of the given source roots,
+            # the classpath of the dependencies is not resolved and nothing is built
+            java_settings = d["initializationOptions"]["settings"]["java"]
+            java_settings["import"]["maven"]["enabled"] = False
+            java_settings["import"]["gradle"]["enabled"] = False
+            java_settings["autobuild"]["enabled"] = False
+            java_settings["project"]["sourcePaths"] = self.source_paths or ["."]
+            java_settings["project"]["referencedLibraries"] = []
+
         return d
 
     @asynccontextmanager
@@ -438,42 +513,92 @@ class EclipseJDTLS(LanguageServer):
 
         async with super().start_server():
             self.logger.log("Starting EclipseJDTLS server process", logging.INFO)
-            await self.server.start()
-            initialize_params = self._get_initialize_params(self.repository_root_path)
-
-            self.logger.log(
-                "Sending initialize request from LSP client to LSP server and awaiting response",
-                logging.INFO,
-            )
-            init_response = await self.server.send.initialize(initialize_params)
-            assert init_response["capabilities"]["textDocumentSync"]["change"] == 2
-            assert "completionProvider" not in init_response["capabilities"]
-            assert "executeCommandProvider" not in init_response["capabilities"]
-
-            self.server.notify.initialized({})
-
-            self.server.notify.workspace_did_change_configuration(
-                {"settings": initialize_params["initializationOptions"]["settings"]}
-            )
-
-            await self.intellicode_enable_command_available.wait()
-
-            java_intellisense_members_path = (
-                self.runtime_dependency_paths.intellisense_members_path
-            )
-            assert os.path.exists(java_intellisense_members_path)
-            intellicode_enable_result = await self.server.send.execute_command(
-                {
-                    "command": "java.intellicode.enable",
-                    "arguments": [True, java_intellisense_members_path],
+            start_time = time.time()
+            # the cleanup also runs when the startup fails or is cancelled (e.g. timed out)
+            try:
+                await self.server.start()
+                initialize_params = self._get_initialize_params(self.repository_root_path)
+
+                self.logger.log(
+                    "Sending initialize request from LSP client to LSP server and awaiting response",
+                    logging.INFO,
+                )
+                init_response = await self.server.send.initialize(initialize_params)
+                # handshake: from launching the server process to the initialize response
+                handshake_seconds = time.time() - start_time
+                assert init_response["capabilities"]["textDocumentSync"]["change"] == 2
+                if self.init_profile == "full":
+                    assert "completionProvider" not in init_response["capabilities"]
+                    assert "executeCommandProvider" not in init_response["capabilities"]
+
+                self.server.notify.initialized({})
+
+                self.server.notify.workspace_did_change_configuration(
+                    {"settings": initialize_params["initializationOptions"]["settings"]}
+                )
+
+                if self.init_profile == "full":
+                    await self.intellicode_enable_command_available.wait()
+
+                    java_intellisense_members_path = (
+                        self.runtime_dependency_paths.intellisense_members_path
+                    )
+                    assert os.path.exists(java_intellisense_members_path)
+                    intellicode_enable_result = await self.server.send.execute_command(
+                        {
+                            "command": "java.intellicode.enable",
+                            "arguments": [True, java_intellisense_members_path],
+                        }
+                    )
+                    assert intellicode_enable_result
+
+                # TODO: Add comments about why we wait here, and how this can be optimized
+                await self.service_ready_event.wait()
+
+                warm = self.workspace is not None and self.workspace.warm
+                self.startup_metrics = {
+                    "seconds": time.time() - start_time,
+                    "handshake_seconds": handshake_seconds,
+                    "warm": warm,
+                    "init_profile": self.init_profile,
+                    "cds": self.cds_archive.mode if self.cds_archive else None,
+                    # the classes loaded until ready by their source (with jvm_cds_log)
+                    "cds_classes": self.cds_archive.class_load_stats() if self.cds_archive else None,
                 }
-            )
-            assert intellicode_enable_result
-
-            # TODO: Add comments about why we wait here, and how this can be optimized
-            await self.service_ready_event.wait()
-
-            yield self
-
-            await self.server.shutdown()
-            await self.server.stop()
+                if self.workspace is not None:
+                    self.workspace.record_startup(
+                        self.startup_metrics["seconds"], handshake_seconds=handshake_seconds
+                    )
+                self.logger.log(
+                    f"EclipseJDTLS ready in {self.startup_metrics['seconds']:.1f}s "
+                    f"(handshake {handshake_seconds:.1f}s, {self.init_profile} profile, {'warm' if warm else 'cold'} start, "
+                    f"cds: {self.startup_metrics['cds']})",
+                    logging.INFO,
+                )
+
+                yield self
+            finally:
+                if self.server.process is not None and self.server.process.returncode is None:
+                    try:
+                        # an unresponsive server is killed by stop
+                        await asyncio.wait_for(self.server.shutdown(), timeout=30)
+                    except asyncio.TimeoutError:
+                        pass
+                if self.cds_archive is not None and self.cds_archive.mode == "create":
+                    # the archive is only dumped by a normal exit of the JVM (also on the terminate signal), not killed
+                    exited_normally = await self.server.stop(
+                        exit_timeout=DUMP_EXIT_SECONDS, kill_grace_seconds=DUMP_EXIT_SECONDS
+                    )
+                else:
+                    exited_normally = await self.server.stop()
+                if self.workspace is not None:
+                    self.workspace.release()
+                else:
+                    # the per-instance workspace is never reused
+                    shutil.rmtree(self.ws_dir, ignore_errors=True)
+                # the archive is dumped when the JVM exits, a killed JVM leaves no usable archive
+                if self.cds_archive is not None and self.cds_archive.finalize(exited_normally):
+                    self.logger.log(
+                        f"Created the CDS archive of EclipseJDTLS at {self.cds_archive.archive_path}",
+                        logging.INFO,
+                    )
@@ -0,0 +1,251 @@
+"""
+Persistent workspaces of EclipseJDTLS, keyed by the repository.
+
+The workspace (data directory and configuration) of a repository is reused across runs and commits,
+so JDTLS only refreshes the changed files instead of importing and indexing the project from scratch.
+A workspace is locked by the server using it; concurrent servers of the same repository take the next slot.
+
+Usage:
+    python -m utils.multilspy.language_servers.eclipse_jdtls.workspaces stats
+    python -m utils.multilspy.language_servers.eclipse_jdtls.workspaces gc [--max-age-days 14] [--dry-run]
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import PurePath
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+from ...multilspy_settings import MultilspySettings
+
+# name of the metadata file in a workspace
+WORKSPACE_META = "workspace.json"
+# number of startup records kept in the metadata
+MAX_STARTUP_RECORDS = 20
+
+
+def workspaces_directory() -> str:
+    return str(
+        PurePath(
+            MultilspySettings.get_language_server_directory(), "EclipseJDTLS", "workspaces"
+        )
+    )
+
+
+def workspace_key(repository_root_path: str, variant: str = "") -> str:
+    """Deterministic workspace name of a repository: <basename>-<hash of the real path>[-<variant>]."""
+    real_path = os.path.realpath(repository_root_path)
+    digest = hashlib.sha1(real_path.encode()).hexdigest()[:12]
+    key = f"{os.path.basename(real_path.rstrip(os.sep)) or 'root'}-{digest}"
+    return f"{key}-{variant}" if variant else key
+
+
+def try_lock(lock_path: str):
+    """Take the exclusive lock of lock_path without blocking, return the locked file or None."""
+    f = open(lock_path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _is_locked(lock_path: str) -> bool:
+    if not os.path.exists(lock_path):
+        return False
+    f = try_lock(lock_path)
+    if f is None:
+        return True
+    f.close()
+    return False
+
+
+class JDTLSWorkspace:
+    """
+    A locked workspace of a repository: <workspaces>/<key>[.<slot>]/{data_dir, config_path, workspace.json}
+    """
+
+    def __init__(self, ws_dir: str, lock_file, repository_root_path: str):
+        self.ws_dir = ws_dir
+        self.data_dir = str(PurePath(ws_dir, "data_dir"))
+        self.config_path = str(PurePath(ws_dir, "config_path"))
+        self.repository_root_path = os.path.realpath(repository_root_path)
+        self._lock_file = lock_file
+        self.meta = self._load_meta()
+        # warm: the project has been imported into the data directory by a server that got ready
+        self.warm = self.meta.get("ready_count", 0) > 0 and os.path.exists(self.data_dir)
+
+    @classmethod
+    def acquire(
+        cls, repository_root_path: str, variant: str = "", max_slots: int = 8
+    ) -> "JDTLSWorkspace":
+        """
+        Lock the first free slot of the repository's workspace, slot 0 is shared by the sequential runs.
+        variant: the servers with different project setups (e.g. import modes) use separate workspaces.
+        """
+        base = workspaces_directory()
+        os.makedirs(base, exist_ok=True)
+        key = workspace_key(repository_root_path, variant)
+        for slot in range(max_slots):
+            ws_dir = os.path.join(base, key if slot == 0 else f"{key}.{slot}")
+            lock_file = try_lock(ws_dir + ".lock")
+            if lock_file is not None:
+                os.makedirs(ws_dir, exist_ok=True)
+                workspace = cls(ws_dir, lock_file, repository_root_path)
+                workspace._save_meta()
+                return workspace
+        raise RuntimeError(
+            f"All the {max_slots} workspaces of {repository_root_path} are locked"
+        )
+
+    def _load_meta(self) -> Dict:
+        meta_path = os.path.join(self.ws_dir, WORKSPACE_META)
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, "r") as f:
+                    return json.load(f)
+            except ValueError:
+                pass
+        return {"repository_root_path": self.repository_root_path, "ready_count": 0, "startups": []}
+
+    def _save_meta(self):
+        self.meta["last_used"] = time.time()
+        tmp_path = os.path.join(self.ws_dir, WORKSPACE_META + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f, indent=4)
+        os.replace(tmp_path, os.path.join(self.ws_dir, WORKSPACE_META))
+
+    def record_startup(
+        self, seconds: float, ready: bool = True, handshake_seconds: float = None
+    ) -> Dict:
+        """Record the time from launching the server to ServiceReady (and to the initialize response)."""
+        record = {"time": time.time(), "seconds": round(seconds, 3), "warm": self.warm, "ready": ready}
+        if handshake_seconds is not None:
+            record["handshake_seconds"] = round(handshake_seconds, 3)
+        if ready:
+            self.meta["ready_count"] = self.meta.get("ready_count", 0) + 1
+        self.meta["startups"] = (self.meta.get("startups", []) + [record])[-MAX_STARTUP_RECORDS:]
+        self._save_meta()
+        return record
+
+    def release(self):
+        if self._lock_file is not None:
+            self._save_meta()
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def list_workspaces() -> List[Dict]:
+    """The workspaces with their metadata, size and lock state."""
+    base = workspaces_directory()
+    if not os.path.exists(base):
+        return []
+    workspaces = []
+    for name in sorted(os.listdir(base)):
+        ws_dir = os.path.join(base, name)
+        if not os.path.isdir(ws_dir):
+            continue
+        meta: Optional[Dict] = None
+        meta_path = os.path.join(ws_dir, WORKSPACE_META)
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, "r") as f:
+                    meta = json.load(f)
+            except ValueError:
+                pass
+        size = 0
+        for root, _, files in os.walk(ws_dir):
+            for fn in files:
+                fp = os.path.join(root, fn)
+                if not os.path.islink(fp):
+                    size += os.path.getsize(fp)
+        workspaces.append(
+            {
+                "name": name,
+                "path": ws_dir,
+                "meta": meta,
+                "size": size,
+                "locked": _is_locked(ws_dir + ".lock"),
+                "last_used": meta.get("last_used", 0) if meta else os.path.getmtime(ws_dir),
+            }
+        )
+    return workspaces
+
+
+def gc_workspaces(max_age_days: float = 14, dry_run: bool = False) -> List[str]:
+    """
+    Remove the stale workspaces that are not locked:
+    the ones of the per-instance layout (no metadata), of removed repositories, or unused for max_age_days.
+    """
+    removed = []
+    now = time.time()
+    for ws in list_workspaces():
+        if ws["locked"]:
+            continue
+        meta = ws["meta"]
+        if meta is None:
+            reason = "no metadata"
+        elif not os.path.exists(meta.get("repository_root_path", "")):
+            reason = "repository removed"
+        elif now - ws["last_used"] > max_age_days * 86400:
+            reason = f"unused for {(now - ws['last_used']) / 86400:.0f} days"
+        else:
+            continue
+        print(f"{'Would remove' if dry_run else 'Removing'} {ws['name']} ({ws['size'] / 2**20:.1f} MB): {reason}")
+        if not dry_run:
+            shutil.rmtree(ws["path"], ignore_errors=True)
+            if os.path.exists(ws["path"] + ".lock"):
+                os.remove(ws["path"] + ".lock")
+        removed.append(ws["path"])
+    return removed
+
+
+def startup_stats() -> Dict[str, Dict]:
+    """Mean startup seconds of the warm and the cold starts over all the workspaces."""
+    stats = {"warm": [], "cold": []}
+    for ws in list_workspaces():
+        for record in (ws["meta"] or {}).get("startups", []):
+            if record.get("ready"):
+                stats["warm" if record["warm"] else "cold"].append(record["seconds"])
+    return {
+        k: {"count": len(v), "mean_seconds": round(sum(v) / len(v), 3) if v else None}
+        for k, v in stats.items()
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the persistent workspaces of EclipseJDTLS")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gc_parser = subparsers.add_parser("gc", help="remove the stale workspaces")
+    gc_parser.add_argument("--max-age-days", type=float, default=14)
+    gc_parser.add_argument("--dry-run", action="store_true")
+    subparsers.add_parser("stats", help="show the workspaces and the warm/cold startup times")
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        removed = gc_workspaces(args.max_age_days, args.dry_run)
+        print(f"{len(removed)} workspaces {'to remove' if args.dry_run else 'removed'}")
+    else:
+        for ws in list_workspaces():
+            meta = ws["meta"] or {}
+            print(
+                f"{ws['name']}: {ws['size'] / 2**20:.1f} MB, {'locked' if ws['locked'] else 'free'}, "
+                f"{len(meta.get('startups', []))} startups, repo {meta.get('repository_root_path', '-')}"
+            )
+        for kind, stat in startup_stats().items():
+            print(f"{kind} starts: {stat['count']}, mean {stat['mean_seconds']} s")
@@ -32,10 +32,11 @@ import asyncio
 import dataclasses
 import json
 import os
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
 
 from .lsp_requests import LspNotification, LspRequest
 from .lsp_types import ErrorCodes
+from ..supervisor import KILL_GRACE_SECONDS, ServerSupervisor, popen_kwargs
 
 StringDict = Dict[str, Any]
 PayloadLike = Union[List[StringDict], StringDict, None]
@@ -128,6 +129,32 @@ class Request:
             self.cv.notify()
 
 
+class PartialResultRequest(Request):
+    """
+    A request with a partialResultToken: the partial results ($/progress of the token) and
+    the final result (or error) are queued in the order of arrival.
+    """
+
+    # marks the final response in the queue
+    DONE = object()
+
+    def __init__(self, token: str) -> None:
+        super().__init__()
+        self.token = token
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def on_partial_result(self, value: PayloadLike) -> None:
+        self.queue.put_nowait(value)
+
+    async def on_result(self, params: PayloadLike) -> None:
+        self.result = params
+        self.queue.put_nowait(self.DONE)
+
+    async def on_error(self, err: Error) -> None:
+        self.error = err
+        self.queue.put_nowait(self.DONE)
+
+
 def content_length(line: bytes) -> Optional[int]:
     if line.startswith(b"Content-Length: "):
         _, value = line.split(b"Content-Length: ")
@@ -189,12 +216,16 @@ class LanguageServerHandler:
 
         self.request_id = 1
         self._response_handlers: Dict[Any, Request] = {}
+        # partialResultToken -> the request receiving the partial results
+        self._partial_result_requests: Dict[str, PartialResultRequest] = {}
         self.on_request_handlers = {}
         self.on_notification_handlers = {}
         self.logger = logger
         self.tasks = {}
         self.task_counter = 0
         self.loop = None
+        # created here (usually in the main thread) to install the signal handlers
+        self.supervisor = ServerSupervisor.get()
 
     async def start(self) -> None:
         """
@@ -210,6 +241,11 @@ class LanguageServerHandler:
             stderr=asyncio.subprocess.PIPE,
             env=child_proc_env,
             cwd=self.process_launch_info.cwd,
+            **popen_kwargs(),
+        )
+        # the process group of the server is killed on stop, on exit of this process, or reaped by the next run
+        self.supervisor.register(
+            self.process.pid, self.process_launch_info.cmd, self.process_launch_info.cwd
         )
 
         self.loop = asyncio.get_event_loop()
@@ -218,9 +254,13 @@ class LanguageServerHandler:
         self.tasks[self.task_counter] = self.loop.create_task(self.run_forever_stderr())
         self.task_counter += 1
 
-    async def stop(self) -> None:
+    async def stop(self, exit_timeout: float = 60, kill_grace_seconds: float = KILL_GRACE_SECONDS) -> bool:
         """
         Sends the terminate signal to the language server process and waits for it to exit, with a timeout, killing it if necessary
+
+        :param exit_timeout: The seconds to wait for the server to exit by itself after the shutdown sequence.
+        :param kill_grace_seconds: The seconds between the terminate signal and the kill signal.
+        :return: False if any process of the server had to be killed.
         """
         for task in self.tasks.values():
             task.cancel()
@@ -231,15 +271,31 @@ class LanguageServerHandler:
         self.process = None
 
         if process:
-            # TODO: Ideally, we should terminate the process here,
-            # However, there's an issue with asyncio terminating processes documented at
-            # https://bugs.python.org/issue35539 and https://bugs.python.org/issue41320
-            # process.terminate()
-            wait_for_end = process.wait()
+            if self._received_shutdown:
+                # the server exits by itself after the exit notification, process.wait() would also wait for
+                # the pipes, which stay open while any process left by the server is alive
+                for _ in range(int(exit_timeout * 10)):
+                    if process.returncode is not None:
+                        break
+                    await asyncio.sleep(0.1)
+            # kill the whole process tree (the shell may exit before the server it launched), and reap the leader
+            killed = await asyncio.get_event_loop().run_in_executor(
+                None, self.supervisor.kill, process.pid, kill_grace_seconds
+            )
             try:
-                await asyncio.wait_for(wait_for_end, timeout=60)
+                await asyncio.wait_for(process.wait(), timeout=10)
             except asyncio.TimeoutError:
-                process.kill()
+                pass
+            return not killed
+        return True
+
+    def resource_usage(self) -> Optional[Dict]:
+        """
+        Resident memory (MB) and cpu time (seconds) of the server's process tree, None if not running or not supported
+        """
+        if not self.process:
+            return None
+        return self.supervisor.usage(self.process.pid)
 
     async def shutdown(self) -> None:
         """
@@ -366,13 +422,53 @@ class LanguageServerHandler:
         request_id = self.request_id
         self.request_id += 1
         self._response_handlers[request_id] = request
-        async with request.cv:
-            await self._send_payload(make_request(method, request_id, params))
-            await request.cv.wait()
+        try:
+            async with request.cv:
+                await self._send_payload(make_request(method, request_id, params))
+                await request.cv.wait()
+        except asyncio.CancelledError:
+            # e.g. the caller timed out, the server needn't finish the request
+            self._response_handlers.pop(request_id, None)
+            self.send_notification("$/cancelRequest", {"id": request_id})
+            raise
         if isinstance(request.error, Error):
             raise request.error
         return request.result
 
+    async def send_request_with_partial_results(
+        self, method: str, params: dict
+    ) -> AsyncIterator[PayloadLike]:
+        """
+        Send request to the server with a partialResultToken, and yield the partial results as they arrive
+        followed by the final result (the whole result if the server does not support partial results)
+        """
+        request_id = self.request_id
+        self.request_id += 1
+        token = f"partial-result-{request_id}"
+        request = PartialResultRequest(token)
+        self._response_handlers[request_id] = request
+        self._partial_result_requests[token] = request
+        done = False
+        try:
+            await self._send_payload(
+                make_request(method, request_id, {**params, "partialResultToken": token})
+            )
+            while True:
+                value = await request.queue.get()
+                if value is PartialResultRequest.DONE:
+                    break
+                yield value
+            done = True
+            if isinstance(request.error, Error):
+                raise request.error
+            yield request.result
+        finally:
+            if not done:
+                # the caller stopped consuming, the server needn't finish the request
+                self.send_notification("$/cancelRequest", {"id": request_id})
+            self._partial_result_requests.pop(token, None)
+            self._response_handlers.pop(request_id, None)
+
     def _send_payload_sync(self, payload: StringDict) -> None:
         """
         Send the payload to the server by writing to its stdin synchronously
@@ -412,7 +508,10 @@ class LanguageServerHandler:
         """
         Handle the response received from the server for a request, using the id to determine the request
         """
-        request = self._response_handlers.pop(response["id"])
+        request = self._response_handlers.pop(response["id"], None)
+        if request is None:
+            # the response of a cancelled request
+            return
         if "result" in response and "error" not in response:
             await request.on_result(response["result"])
         elif "result" not in response and "error" in response:
@@ -450,6 +549,9 @@ class LanguageServerHandler:
         """
         method = response.get("method", "")
         params = response.get("params")
+        if method == "$/progress" and params and params.get("token") in self._partial_result_requests:
+            self._partial_result_requests[params["token"]].on_partial_result(params.get("value"))
+            return
         handler = self.on_notification_handlers.get(method)
         if not handler:
             self._log(f"unhandled {method}")
@@ -0,0 +1,96 @@
+"""
+Access to one repository of a multi-root language server, i.e. a server with several repositories as workspace folders.
+"""
+
+import os
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple, Union
+
+from . import multilspy_types
+from .language_server import LanguageServer, SyncLanguageServer
+
+
+class RepositoryView:
+    """
+    The requests of SyncLanguageServer with file paths relative to one of its workspace folders,
+    the relative paths of the responses are resolved against the folder containing each file.
+    """
+
+    def __init__(self, lsp: SyncLanguageServer, repository_root_path: str) -> None:
+        self.lsp = lsp
+        self.repository_root_path = os.path.abspath(repository_root_path)
+
+    @property
+    def language_server(self) -> LanguageServer:
+        return self.lsp.language_server
+
+    def _path(self, relative_file_path: str) -> str:
+        return os.path.join(self.repository_root_path, relative_file_path)
+
+    @contextmanager
+    def open_file(self, relative_file_path: str) -> Iterator[None]:
+        with self.lsp.open_file(self._path(relative_file_path)):
+            yield
+
+    def get_open_file_text(self, relative_file_path: str) -> str:
+        return self.lsp.get_open_file_text(self._path(relative_file_path))
+
+    def get_text_between_positions(
+        self,
+        relative_file_path: str,
+        start: multilspy_types.Position,
+        end: multilspy_types.Position,
+    ) -> str:
+        return self.lsp.get_text_between_positions(self._path(relative_file_path), start, end)
+
+    def insert_text_at_position(
+        self, relative_file_path: str, line: int, column: int, text_to_be_inserted: str
+    ) -> multilspy_types.Position:
+        return self.lsp.insert_text_at_position(
+            self._path(relative_file_path), line, column, text_to_be_inserted
+        )
+
+    def delete_text_between_positions(
+        self,
+        relative_file_path: str,
+        start: multilspy_types.Position,
+        end: multilspy_types.Position,
+    ) -> str:
+        return self.lsp.delete_text_between_positions(self._path(relative_file_path), start, end)
+
+    def request_definition(
+        self, relative_file_path: str, line: int, column: int
+    ) -> List[multilspy_types.Location]:
+        return self.lsp.request_definition(self._path(relative_file_path), line, column)
+
+    def request_references(
+        self, relative_file_path: str, line: int, column: int
+    ) -> List[multilspy_types.Location]:
+        return self.lsp.request_references(self._path(relative_file_path), line, column)
+
+    def request_references_stream(
+        self, relative_file_path: str, line: int, column: int
+    ) -> Iterator[List[multilspy_types.Location]]:
+        return self.lsp.request_references_stream(self._path(relative_file_path), line, column)
+
+    def request_completions(
+        self,
+        relative_file_path: str,
+        line: int,
+        column: int,
+        allow_incomplete: bool = False,
+    ) -> List[multilspy_types.CompletionItem]:
+        return self.lsp.request_completions(
+            self._path(relative_file_path), line, column, allow_incomplete
+        )
+
+    def request_document_symbols(self, relative_file_path: str) -> Tuple[
+        List[multilspy_types.UnifiedSymbolInformation],
+        Union[List[multilspy_types.TreeRepr], None],
+    ]:
+        return self.lsp.request_document_symbols(self._path(relative_file_path))
+
+    def request_hover(
+        self, relative_file_path: str, line: int, column: int
+    ) -> Union[multilspy_types.Hover, None]:
+        return self.lsp.request_hover(self._path(relative_file_path), line, column)
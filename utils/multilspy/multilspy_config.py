@@ -4,6 +4,7 @@ Configuration parameters for Multilspy.
 
 from enum import Enum
 from dataclasses import dataclass
+from typing import List, Optional
 
 class Language(str, Enum):
     """
@@ -25,6 +26,27 @@ class MultilspyConfig:
     """
     code_language: Language
     trace_lsp_communication: bool = False
+    # max number of documents kept open in the server after use, the least recently used ones are closed first
+    # (documents in use are never closed), 0 closes a document as soon as it is not used
+    max_open_files: int = 0
+    # reuse the workspace (project import and index) of a repository across runs, see eclipse_jdtls/workspaces.py
+    # otherwise every server instance gets a new workspace
+    persistent_workspace: bool = True
+    # project import of the language server (only for java)
+    # full: import the maven/gradle build | light: no build import, an invisible project of the source_paths
+    import_mode: str = "full"
+    # source roots (relative to the repository root) of the light import
+    source_paths: Optional[List[str]] = None
+    # initialization of the language server (only for java)
+    # full: all the client capabilities and IntelliCode | retrieval: only document sync, definition, references and symbols
+    init_profile: str = "full"
+    # create (on the first launch) and map a class-data-sharing archive of the server's JVM (only for java)
+    # experimental: the startup gain is not measured yet, see run_lsp_benchmark.py
+    jvm_cds: bool = False
+    # log the class loading of the server's JVM to count the classes served by the archive (only for java)
+    jvm_cds_log: bool = False
+    # the server hosts several repositories as workspace folders (see multi_root.py), only for java
+    multi_root: bool = False
 
     @classmethod
     def from_dict(cls, env: dict):
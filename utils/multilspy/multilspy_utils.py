@@ -71,6 +71,34 @@ class TextUtils:
             c += len(text_to_be_inserted)
         return (l, c)
 
+    @staticmethod
+    def get_incremental_change(old_text: str, new_text: str) -> Tuple[int, int, int, int, str]:
+        """
+        Returns the single range edit (start_line, start_col, end_line, end_col, text) of old_text
+        that results in new_text, i.e. the span between the common prefix and the common suffix.
+        The columns are in UTF-16 code units, as the positions of LSP.
+        """
+        limit = min(len(old_text), len(new_text))
+        start = 0
+        while start < limit and old_text[start] == new_text[start]:
+            start += 1
+        suffix = 0
+        while (
+            suffix < limit - start
+            and old_text[len(old_text) - 1 - suffix] == new_text[len(new_text) - 1 - suffix]
+        ):
+            suffix += 1
+        old_end = len(old_text) - suffix
+
+        def line_col(index: int) -> Tuple[int, int]:
+            line = old_text.count("\n", 0, index)
+            line_start = old_text.rfind("\n", 0, index) + 1
+            return line, len(old_text[line_start:index].encode("utf-16-le")) // 2
+
+        start_l, start_c = line_col(start)
+        end_l, end_c = line_col(old_end)
+        return start_l, start_c, end_l, end_c, new_text[start : len(new_text) - suffix]
+
 
 class PathUtils:
     """
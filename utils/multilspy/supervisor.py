@@ -0,0 +1,290 @@
+"""
+Supervision of the language server processes.
+
+Every server is launched in its own process group (session) and registered in <lsp>/supervisor/<pid>.json
+with the pid of the python process owning it. The whole group (the launching shell, the JVM and its children)
+is killed when the server is stopped, when the owner exits (normally, by an uncaught exception or by SIGTERM/SIGINT/SIGHUP),
+and the groups left by owners that died without cleanup (e.g. SIGKILL, OOM) are reaped by the next supervisor.
+
+Usage:
+    python -m utils.multilspy.supervisor ps
+    python -m utils.multilspy.supervisor reap
+"""
+
+import atexit
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+from pathlib import PurePath
+from typing import Dict, List, Optional
+
+from .multilspy_settings import MultilspySettings
+
+# seconds between SIGTERM and SIGKILL of a process group
+KILL_GRACE_SECONDS = 5
+# signals that kill the supervised servers before the default handling
+_EXIT_SIGNALS = [getattr(signal, name) for name in ("SIGTERM", "SIGINT", "SIGHUP") if hasattr(signal, name)]
+
+
+def registry_directory() -> str:
+    path = str(PurePath(MultilspySettings.get_language_server_directory(), "supervisor"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def popen_kwargs() -> Dict:
+    """The arguments of (asyncio.create_subprocess_*) launching a server in a new process group."""
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:  # windows: the process does not exist
+        return False
+    return True
+
+
+def _start_time(pid: int) -> Optional[int]:
+    """Start time (clock ticks since boot) of a process, to tell it from a later process with the same pid (linux only)."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the fields after the command name (which may contain spaces) in parentheses
+    return int(stat[stat.rfind(")") + 2 :].split()[19])
+
+
+def group_pids(pgid: int) -> List[int]:
+    """The live processes of a process group (linux only, otherwise the group leader)."""
+    if not os.path.exists("/proc"):
+        return [pgid] if _is_alive(pgid) else []
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        # fields[0]: state, fields[2]: process group
+        if int(fields[2]) == pgid and fields[0] != "Z":
+            pids.append(int(name))
+    return pids
+
+
+def resource_usage(pgid: int) -> Optional[Dict]:
+    """Resident memory and cpu time of all the processes in a server's group (linux only)."""
+    if not os.path.exists("/proc"):
+        return None
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    rss, cpu_ticks = 0, 0
+    pids = group_pids(pgid)
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                rss += int(f.read().split()[1]) * page_size
+            with open(f"/proc/{pid}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # utime, stime
+            cpu_ticks += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError):
+            continue
+    return {
+        "processes": len(pids),
+        "rss_mb": round(rss / 2**20, 1),
+        "cpu_seconds": round(cpu_ticks / clock_ticks, 2),
+    }
+
+
+def kill_group(pgid: int, grace_seconds: float = KILL_GRACE_SECONDS) -> bool:
+    """
+    Terminate a process group, then kill the processes left after grace_seconds.
+    Return True if any process had to be killed (did not exit on the terminate signal).
+    """
+    if os.name == "nt":
+        if not _is_alive(pgid):
+            return False
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(pgid)], capture_output=True)
+        return True
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return False
+    deadline = time.time() + grace_seconds
+    while time.time() < deadline and group_pids(pgid):
+        time.sleep(0.1)
+    killed = bool(group_pids(pgid))
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    return killed
+
+
+class ServerSupervisor:
+    """
+    The registry of the servers launched by this python process, use ServerSupervisor.get() for the shared instance.
+    """
+
+    _instance: Optional["ServerSupervisor"] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.registry_dir = registry_directory()
+        self.owner_pid = os.getpid()
+        self.servers: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+        self._previous_handlers = {}
+        reap_orphans()
+        atexit.register(self.kill_all)
+        self._install_signal_handlers()
+
+    @classmethod
+    def get(cls) -> "ServerSupervisor":
+        with cls._instance_lock:
+            # a forked worker gets its own registry entries
+            if cls._instance is None or cls._instance.owner_pid != os.getpid():
+                cls._instance = cls()
+            return cls._instance
+
+    def _install_signal_handlers(self):
+        # only the main thread can set signal handlers, the other threads rely on atexit and the orphan reaping
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for signum in _EXIT_SIGNALS:
+            previous = signal.getsignal(signum)
+            if previous is signal.SIG_IGN:
+                continue
+            self._previous_handlers[signum] = previous
+            signal.signal(signum, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self.kill_all()
+        previous = self._previous_handlers.get(signum)
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    def _entry_path(self, pid: int) -> str:
+        return os.path.join(self.registry_dir, f"{pid}.json")
+
+    def register(self, pid: int, cmd: str, cwd: str = None) -> None:
+        """Register a server launched (by popen_kwargs) as the leader of its process group."""
+        entry = {
+            "pid": pid,
+            "pgid": pid,
+            "start_time": _start_time(pid),
+            "owner_pid": self.owner_pid,
+            "owner_start_time": _start_time(self.owner_pid),
+            "cmd": cmd,
+            "cwd": cwd,
+            "launched": time.time(),
+        }
+        with self._lock:
+            self.servers[pid] = entry
+        with open(self._entry_path(pid), "w") as f:
+            json.dump(entry, f, indent=4)
+
+    def unregister(self, pid: int) -> None:
+        with self._lock:
+            self.servers.pop(pid, None)
+        try:
+            os.remove(self._entry_path(pid))
+        except FileNotFoundError:
+            pass
+
+    def kill(self, pid: int, grace_seconds: float = KILL_GRACE_SECONDS) -> bool:
+        """Kill the process tree of a server and unregister it, return True if any process had to be killed."""
+        killed = kill_group(pid, grace_seconds)
+        self.unregister(pid)
+        return killed
+
+    def kill_all(self) -> None:
+        if os.getpid() != self.owner_pid:
+            return
+        for pid in list(self.servers):
+            self.kill(pid, grace_seconds=1)
+
+    def usage(self, pid: int) -> Optional[Dict]:
+        return resource_usage(pid)
+
+
+def _same_process(pid: int, start_time: Optional[int]) -> bool:
+    """The pid is not reused by another process since it was registered."""
+    current = _start_time(pid)
+    return current is None or start_time is None or current == start_time
+
+
+def list_servers() -> List[Dict]:
+    """The registered servers with their liveness (any process of the group), owner liveness and resource usage."""
+    servers = []
+    for name in sorted(os.listdir(registry_directory())):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(registry_directory(), name), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # the group outlives its leader (e.g. the JVM of an exited shell), the leader pid is not reused while it exists
+        entry["alive"] = bool(group_pids(entry["pgid"])) and _same_process(entry["pid"], entry.get("start_time"))
+        entry["owner_alive"] = _is_alive(entry["owner_pid"]) and _same_process(
+            entry["owner_pid"], entry.get("owner_start_time")
+        )
+        entry["usage"] = resource_usage(entry["pgid"]) if entry["alive"] else None
+        servers.append(entry)
+    return servers
+
+
+def reap_orphans() -> List[int]:
+    """Kill the server groups whose owners are dead, and remove the registry entries of the exited servers."""
+    reaped = []
+    for entry in list_servers():
+        if entry["owner_alive"] and entry["alive"]:
+            continue
+        if entry["alive"]:
+            kill_group(entry["pgid"])
+            reaped.append(entry["pid"])
+        try:
+            os.remove(os.path.join(registry_directory(), f"{entry['pid']}.json"))
+        except FileNotFoundError:
+            pass
+    return reaped
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show or reap the supervised language server processes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("ps", help="show the registered servers with their memory and cpu time")
+    subparsers.add_parser("reap", help="kill the servers whose owner processes are dead")
+    args = parser.parse_args()
+
+    if args.command == "reap":
+        reaped = reap_orphans()
+        print(f"{len(reaped)} orphaned servers reaped: {reaped}")
+    else:
+        for entry in list_servers():
+            usage = entry["usage"] or {}
+            print(
+                f"{entry['pid']}: {'alive' if entry['alive'] else 'exited'}, "
+                f"owner {entry['owner_pid']} {'alive' if entry['owner_alive'] else 'dead'}, "
+                f"{usage.get('processes', 0)} processes, {usage.get('rss_mb', 0)} MB, {usage.get('cpu_seconds', 0)} s cpu, "
+                f"{entry['cmd'][:80]}"
+            )
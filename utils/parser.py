@@ -1,10 +1,12 @@
-import re, warnings
-from typing import Optional
+import re, os, json, time, bisect, warnings, itertools
+from typing import Optional, Iterator
+from concurrent.futures import ProcessPoolExecutor
 from tree_sitter import Language, Parser
 import tree_sitter_java as tsjava
 from .types import MethodMD, SynDiff
 from .multilspy.multilspy_types import Position
 from .formatter import formatted_java_code
+from .dataset import iter_json_records
 from .logger import logger
 
 warnings.filterwarnings("ignore")
@@ -19,10 +21,102 @@ parser.set_language(JAVA_LANGUAGE)
 
 def has_parse_error(code_str: str) -> bool:
     """check whether the code has parse error"""
-    tree = parser.parse(bytes(code_str, "utf8"))
+    tree = parser.parse(code_str.encode())
     return tree.root_node.has_error
 
 
+def find_error_nodes(node):
+    """yield the ERROR and MISSING nodes, only subtrees containing errors are visited"""
+    if node.type == "ERROR" or node.is_missing:
+        yield node
+    elif node.has_error:
+        for child in node.children:
+            yield from find_error_nodes(child)
+
+
+def get_parse_errors(code_str: str, _parser: Parser = parser) -> list[dict]:
+    """
+    Get the locations of parse errors in the code.
+
+    Returns:
+        list[dict]: Every error has the keys "type"(ERROR or MISSING), "start" and "end"(Position).
+    """
+    tree = _parser.parse(code_str.encode())
+    if not tree.root_node.has_error:
+        return []
+    errors = []
+    for node in find_error_nodes(tree.root_node):
+        errors.append(
+            {
+                "type": "MISSING" if node.is_missing else "ERROR",
+                "start": {"line": node.start_point[0], "character": node.start_point[1]},
+                "end": {"line": node.end_point[0], "character": node.end_point[1]},
+            }
+        )
+    return errors
+
+
+def iter_predictions(filepath: str, field: str = "prediction") -> Iterator[dict]:
+    """
+    Stream the predictions from an output file (json list or jsonl).
+    Every sample of pass@k outputs ("predictions") is yielded separately.
+
+    Yields:
+        dict: {"file": filepath, "id": item id, "sample": sample index, "code": prediction}
+    """
+    # the json lists are decoded incrementally, the whole file is never loaded
+    items = (record for _, _, record in iter_json_records(filepath))
+    for i, item in enumerate(items):
+        item_id = item.get("id", i)
+        samples = item.get(f"{field}s") or [item.get(field, "")]
+        for sample_idx, code in enumerate(samples):
+            yield {"file": filepath, "id": item_id, "sample": sample_idx, "code": code}
+
+
+# every worker process reuses its own parser
+_worker_parser: Optional[Parser] = None
+
+
+def _init_syntax_worker():
+    global _worker_parser
+    _worker_parser = Parser()
+    _worker_parser.set_language(JAVA_LANGUAGE)
+
+
+def _check_syntax_batch(codes: list[str]) -> list[list[dict]]:
+    return [get_parse_errors(code, _worker_parser) for code in codes]
+
+
+def check_syntax_bulk(
+    filepaths: list[str], workers: int = None, batch_size: int = 256
+) -> Iterator[dict]:
+    """
+    Check the syntax of all the predictions in several output files in a process pool.
+    Predictions are streamed and sent to the workers in batches.
+
+    Yields:
+        dict: the sample from iter_predictions (without "code") with "errors" (list of error locations).
+    """
+    samples = itertools.chain.from_iterable(iter_predictions(fp) for fp in filepaths)
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers, initializer=_init_syntax_worker) as executor:
+        while True:
+            # keep a bounded number of batches in flight
+            batches = [
+                list(itertools.islice(samples, batch_size)) for _ in range(workers * 2)
+            ]
+            batches = [b for b in batches if b]
+            if not batches:
+                break
+            codes = [[sample.pop("code") for sample in b] for b in batches]
+            for batch, errors_list in zip(
+                batches, executor.map(_check_syntax_batch, codes)
+            ):
+                for sample, errors in zip(batch, errors_list):
+                    sample["errors"] = errors
+                    yield sample
+
+
 # public  static -> public static
 def get_text(node):
     if node is None:
@@ -168,11 +262,11 @@ def get_method_signature(method_str: str) -> str:
         return method_str.strip()
 
 
-def all_method_sig_lines(file_str: str) -> set[str]:
-    """given a file, find all the lines defining method(without body)"""
-    all_lines = set()
-    tree = parser.parse(bytes(file_str, "utf8"))
-    for node in list(traverse_tree(tree)):
+def all_method_sig_intervals(file_str: str) -> list[tuple[int, int]]:
+    """given a file, find the sorted and merged line intervals [start, end] defining methods(without body)"""
+    intervals = []
+    tree = parser.parse(file_str.encode())
+    for node in traverse_tree(tree):
         if node.type in ["method_declaration", "constructor_declaration"]:
             # # only consider public methods
             # if "public" not in get_text(node.child_by_field_name("modifiers")):
@@ -183,7 +277,21 @@ def all_method_sig_lines(file_str: str) -> set[str]:
                 sig_end = body_node.start_point[0]
             else:
                 sig_end = node.end_point[0]
-            all_lines.update(range(sig_start, sig_end + 1))
+            intervals.append((sig_start, sig_end))
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def all_method_sig_lines(file_str: str) -> set[int]:
+    """given a file, find all the lines defining method(without body)"""
+    all_lines = set()
+    for start, end in all_method_sig_intervals(file_str):
+        all_lines.update(range(start, end + 1))
     return all_lines
 
 
@@ -451,6 +559,110 @@ def extract_method_from_line(file_str: str, sig_line: int) -> str:
     return ""
 
 
+def all_methods_from_file(file_str: str) -> list[dict]:
+    """
+    Find all the methods and constructors in a file.
+
+    Returns:
+        list[dict]: Every method has the keys "name", "param_count", "varargs", "start_line", "sig_end_line", "end_line"(index from 0) and "text".
+    """
+    methods = []
+    tree = parser.parse(file_str.encode())
+    for node in traverse_tree(tree):
+        if node.type == "method_declaration" or node.type == "constructor_declaration":
+            body_node = node.child_by_field_name("body")
+            params_node = node.child_by_field_name("parameters")
+            methods.append(
+                {
+                    "name": get_text(node.child_by_field_name("name")),
+                    "param_count": params_node.named_child_count if params_node else 0,
+                    "varargs": any(
+                        p.type == "spread_parameter"
+                        for p in (params_node.named_children if params_node else [])
+                    ),
+                    "start_line": node.start_point[0],
+                    "sig_end_line": (
+                        body_node.start_point[0] if body_node else node.end_point[0]
+                    ),
+                    "end_line": node.end_point[0],
+                    "text": node.text.decode(),
+                }
+            )
+    return methods
+
+
+def has_method_invocation(code_str: str, method_name: str) -> bool:
+    """check whether the code invokes the method (or constructs the class for constructors)"""
+    tree = parser.parse(code_str.encode())
+    for node in traverse_tree(tree):
+        if node.type == "method_invocation":
+            if get_text(node.child_by_field_name("name")) == method_name:
+                return True
+        elif node.type == "object_creation_expression":
+            type_name = get_text(node.child_by_field_name("type"))
+            if type_name.split("<")[0].split(".")[-1] == method_name:
+                return True
+    return False
+
+
+def utf16_character(line: bytes, byte_col: int) -> int:
+    """Convert a tree-sitter column (utf-8 bytes) to the LSP character (utf-16 code units) of a line."""
+    return len(line[:byte_col].decode("utf-8", errors="ignore").encode("utf-16-le")) // 2
+
+
+def find_method_invocations(file_str: str, method_name: str) -> list[dict]:
+    """
+    Find the call sites of a method (or the creations for constructors) in a file.
+
+    Returns:
+        list[dict]: Every call site has the keys "line", "character"(start of the name, index from 0, in UTF-16 code units as LSP positions) and "arg_count".
+    """
+    calls = []
+    file_bytes = file_str.encode()
+    lines = file_bytes.split(b"\n")
+    tree = parser.parse(file_bytes)
+    for node in traverse_tree(tree):
+        if node.type == "method_invocation":
+            name_node = node.child_by_field_name("name")
+            if get_text(name_node) != method_name:
+                continue
+        elif node.type == "object_creation_expression":
+            name_node = node.child_by_field_name("type")
+            if get_text(name_node).split("<")[0].split(".")[-1] != method_name:
+                continue
+        else:
+            continue
+        args_node = node.child_by_field_name("arguments")
+        args = args_node.named_children if args_node else []
+        calls.append(
+            {
+                "line": name_node.start_point[0],
+                "character": utf16_character(lines[name_node.start_point[0]], name_node.start_point[1]),
+                "arg_count": len([a for a in args if "comment" not in a.type]),
+            }
+        )
+    return calls
+
+
+def get_source_root(file_str: str, rel_path: str) -> str:
+    """
+    get the source root of a java file, i.e. the directory of rel_path without the package directories.
+    e.g. core/src/main/java/org/foo/Bar.java (package org.foo) -> core/src/main/java
+    """
+    tree = parser.parse(bytes(file_str, "utf8"))
+    file_dir = os.path.dirname(rel_path).replace(os.sep, "/")
+    for node in tree.root_node.named_children:
+        if node.type == "package_declaration":
+            package_node = [n for n in node.named_children if "identifier" in n.type][0]
+            package_dir = get_text(package_node).replace(".", "/")
+            if file_dir == package_dir:
+                return ""
+            if file_dir.endswith("/" + package_dir):
+                return file_dir[: -len(package_dir) - 1]
+            break
+    return file_dir
+
+
 def find_parent_classes(file_str: str, class_pos: Position) -> list[Position]:
     """
     get the location of superclass and interfaces of the given class.
@@ -617,6 +829,47 @@ def filter_file_code(file_str: str, clean_tests=False) -> str:
     return res_fmt if res_fmt else res_str
 
 
+def filter_code_lines(
+    file_str: str, line_ranges: list[tuple[int, int]], clean_tests=False
+) -> dict[int, str]:
+    """
+    filter the touched lines of file code by blanking comments, package and imports (tests if clean_tests).
+    Unlike filter_file_code, the file is not reformatted.
+
+    Args:
+        line_ranges: [(start, end)], 0-based lines with end excluded.
+
+    Returns:
+        dict[int, str]: line index -> filtered line, empty lines after filtering are dropped.
+    """
+    file_bytes = file_str.encode()
+    line_starts = [0] + [m.end() for m in re.finditer(b"\n", file_bytes)]
+    touched: dict[int, bytearray] = {}
+    for start, end in line_ranges:
+        for ln in range(max(start, 0), min(end, len(line_starts))):
+            if ln not in touched:
+                line_end = line_starts[ln + 1] - 1 if ln + 1 < len(line_starts) else len(file_bytes)
+                touched[ln] = bytearray(file_bytes[line_starts[ln] : line_end])
+    if not touched:
+        return {}
+    tree = parser.parse(file_bytes)
+    for ex_start, ex_end in find_excludes(tree.root_node, clean_tests):
+        first_ln = bisect.bisect_right(line_starts, ex_start) - 1
+        last_ln = bisect.bisect_right(line_starts, max(ex_start, ex_end - 1)) - 1
+        for ln in range(first_ln, last_ln + 1):
+            if ln in touched:
+                line = touched[ln]
+                s = max(ex_start - line_starts[ln], 0)
+                e = min(ex_end - line_starts[ln], len(line))
+                line[s:e] = b" " * (e - s)
+    res = {}
+    for ln, line in touched.items():
+        text = line.decode(errors="replace").rstrip()
+        if text.strip():
+            res[ln] = text
+    return res
+
+
 def get_unique_text(text_str: str) -> str:
     """
     get the unique string of text
@@ -658,3 +911,33 @@ def divide_texts_by_type(
             continue
         others.append(text)
     return targets, others
+
+
+if __name__ == "__main__":
+    # benchmark: python -m utils.parser [output files ...]
+    import sys, tempfile
+
+    output_files = sys.argv[1:] or [
+        "outputs/CEPROT/test_ceprot.json",
+        "outputs/NaiveLLM/test_woctx.json",
+        "outputs/SynBCIATR/test_all_ctx_wot.json",
+    ]
+    sample_num = 10000
+    base = [s["code"] for fp in output_files for s in iter_predictions(fp)]
+    codes = [base[i % len(base)] for i in range(sample_num)]
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+        for i, code in enumerate(codes):
+            f.write(json.dumps({"id": i, "prediction": code}) + "\n")
+        bench_file = f.name
+
+    start = time.perf_counter()
+    seq_errors = sum(has_parse_error(code) for code in codes)
+    seq_time = time.perf_counter() - start
+    start = time.perf_counter()
+    bulk_errors = sum(1 for s in check_syntax_bulk([bench_file]) if s["errors"])
+    bulk_time = time.perf_counter() - start
+    os.remove(bench_file)
+
+    print(f"{sample_num} samples, {seq_errors} with syntax errors")
+    print(f"has_parse_error loop: {seq_time:.2f}s")
+    print(f"check_syntax_bulk({os.cpu_count()} workers): {bulk_time:.2f}s ({bulk_errors} with syntax errors)")
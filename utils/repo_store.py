@@ -0,0 +1,292 @@
+"""
+Manage the storage layout of repos: one bare object store per upstream repository,
+and lightweight worktrees (or alternates-backed clones) in REPO_BASE created on demand.
+"""
+
+import os, json, time, shutil, threading, weakref
+from contextlib import contextmanager
+from git import Repo
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+from .configs import REPO_BASE, REPO_STORE_BASE
+from .gitter import UpdateRepo, GITHUB_URL_TEMPLATE, dir_size, has_commit
+from .logger import logger
+
+
+class RepoStore(object):
+    """
+    Layout:
+        REPO_STORE_BASE/<owner>/<name>.git: bare (blob-less) object store of an upstream repo,
+            forks and mirrors are fetched into the store of their upstream as extra remotes.
+        REPO_BASE/<owner>/<name>: worktree(mode="worktree") or alternates-backed clone(mode="alternates").
+    Cold checkouts are evicted when more than max_checkouts exist, the ones in use are kept:
+    a checkout is in use until the UpdateRepo of setup_repo is closed or collected (shared file lock across processes).
+    """
+
+    def __init__(
+        self,
+        store_base: str = REPO_STORE_BASE,
+        repo_base: str = REPO_BASE,
+        url_template: str = GITHUB_URL_TEMPLATE,
+        upstreams: dict[str, str] = None,
+        mode: str = "worktree",
+        max_checkouts: int = 8,
+    ):
+        """
+        upstreams: fork/mirror repo_name -> upstream repo_name, repos sharing an upstream share one store.
+        """
+        assert mode in ["worktree", "alternates"], f"Invalid store mode: {mode}."
+        self.store_base = store_base
+        self.repo_base = repo_base
+        self.url_template = url_template
+        self.upstreams = upstreams or dict()
+        self.mode = mode
+        self.max_checkouts = max_checkouts
+        # repo_name -> last used time of its checkout
+        self.usage_file = os.path.join(store_base, ".checkouts.json")
+        # the threads of this process, then the processes sharing the store (file lock)
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+        # repo_name -> number of UpdateRepo objects of this process using its checkout
+        self._in_use: dict[str, int] = dict()
+
+    @contextmanager
+    def _locked(self):
+        """Re-entrant lock of the store and its checkouts across threads and processes."""
+        with self._lock:
+            if self._lock_depth == 0:
+                os.makedirs(self.store_base, exist_ok=True)
+                self._lock_file = open(os.path.join(self.store_base, ".lock"), "a+")
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._lock_file.seek(0)
+                    msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def upstream_of(self, repo_name: str) -> str:
+        return self.upstreams.get(repo_name, repo_name)
+
+    def bare_path(self, repo_name: str) -> str:
+        return os.path.join(self.store_base, f"{self.upstream_of(repo_name)}.git")
+
+    def checkout_path(self, repo_name: str) -> str:
+        return os.path.join(self.repo_base, repo_name)
+
+    def _remote_name(self, repo_name: str) -> str:
+        return "origin" if self.upstream_of(repo_name) == repo_name else repo_name.replace("/", "_")
+
+    def ensure_bare(self, repo_name: str) -> Repo:
+        """Create the bare store of the upstream and add the repo as a remote if it is a fork."""
+        bare_path = self.bare_path(repo_name)
+        with self._locked():
+            if not os.path.exists(bare_path):
+                upstream = self.upstream_of(repo_name)
+                logger.info(f"Creating object store for {upstream} at {bare_path}")
+                tmp_path = bare_path + ".tmp"
+                if os.path.exists(tmp_path):
+                    shutil.rmtree(tmp_path)
+                Repo.clone_from(
+                    self.url_template.format(repo_name=upstream),
+                    tmp_path,
+                    multi_options=["--bare", "--filter=blob:none"],
+                )
+                os.rename(tmp_path, bare_path)
+            bare = Repo(bare_path)
+            remote_name = self._remote_name(repo_name)
+            if remote_name not in [r.name for r in bare.remotes]:
+                logger.info(f"Adding {repo_name} to the object store of {self.upstream_of(repo_name)}")
+                bare.git.remote("add", remote_name, self.url_template.format(repo_name=repo_name))
+                bare.git.config(f"remote.{remote_name}.promisor", "true")
+                bare.git.config(f"remote.{remote_name}.partialclonefilter", "blob:none")
+                bare.git.fetch(remote_name, "--filter=blob:none")
+            return bare
+
+    def ensure_commit(self, repo_name: str, commit_id: str):
+        with self._locked():
+            bare = self.ensure_bare(repo_name)
+            if not has_commit(bare, commit_id):
+                bare.git.fetch(self._remote_name(repo_name), commit_id, "--filter=blob:none")
+
+    def provision(self, repo_name: str, commit_ids: set[str]):
+        """provision_repo backed by the store: the commits and their parents are fetched into the store."""
+        with self._locked():
+            bare = self.ensure_bare(repo_name)
+            for commit_id in commit_ids:
+                self.ensure_commit(repo_name, commit_id)
+                for parent in bare.commit(commit_id).parents:
+                    assert has_commit(bare, parent.hexsha), f"Parent of {commit_id} missing."
+
+    def _in_use_path(self, repo_name: str) -> str:
+        return os.path.join(self.store_base, ".in_use", repo_name.replace("/", "_") + ".lock")
+
+    def _acquire(self, repo_name: str):
+        """Mark the checkout in use, return the function to release it."""
+        with self._lock:
+            self._in_use[repo_name] = self._in_use.get(repo_name, 0) + 1
+        lock_file = None
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self._in_use_path(repo_name)), exist_ok=True)
+            lock_file = open(self._in_use_path(repo_name), "a+")
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH)
+
+        def release():
+            if lock_file is not None:
+                lock_file.close()
+            with self._lock:
+                self._in_use[repo_name] -= 1
+                if self._in_use[repo_name] == 0:
+                    del self._in_use[repo_name]
+
+        return release
+
+    def in_use(self, repo_name: str) -> bool:
+        """Whether the checkout is used by this process or by another one."""
+        with self._lock:
+            if self._in_use.get(repo_name, 0) > 0:
+                return True
+        if fcntl is None or not os.path.exists(self._in_use_path(repo_name)):
+            return False
+        with open(self._in_use_path(repo_name), "a+") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return False
+
+    def _load_usage(self) -> dict[str, float]:
+        if os.path.exists(self.usage_file):
+            with open(self.usage_file, "r") as f:
+                return json.load(f)
+        return {}
+
+    def _save_usage(self, usage: dict[str, float]):
+        os.makedirs(self.store_base, exist_ok=True)
+        with open(self.usage_file, "w") as f:
+            json.dump(usage, f, indent=4)
+
+    def checkout(self, repo_name: str, commit_id: str = None) -> str:
+        """Create the checkout of a repo on demand, and return its path."""
+        path = self.checkout_path(repo_name)
+        with self._locked():
+            if commit_id:
+                self.ensure_commit(repo_name, commit_id)
+            else:
+                self.ensure_bare(repo_name)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                bare = Repo(self.bare_path(repo_name))
+                rev = commit_id or "HEAD"
+                if self.mode == "worktree":
+                    bare.git.worktree("add", "--detach", os.path.abspath(path), rev)
+                else:
+                    # objects are borrowed from the store through .git/objects/info/alternates
+                    Repo.clone_from(bare.git_dir, path, multi_options=["--shared", "--no-checkout"])
+                    clone = Repo(path)
+                    # the store is blob-less: the missing blobs are fetched lazily from the repo's remote
+                    clone.git.remote("set-url", "origin", self.url_template.format(repo_name=repo_name))
+                    clone.git.config("remote.origin.promisor", "true")
+                    clone.git.config("remote.origin.partialclonefilter", "blob:none")
+                    clone.git.checkout(rev, detach=True, f=True)
+                logger.info(f"Created {self.mode} of {repo_name} at {path}")
+            elif commit_id:
+                # move the existing checkout to the commit (its objects are in the store)
+                Repo(path).git.checkout(commit_id, detach=True, f=True)
+            usage = self._load_usage()
+            usage[repo_name] = time.time()
+            self._save_usage(usage)
+            self.evict(keep={repo_name})
+        return path
+
+    def setup_repo(self, repo_name: str, commit_id: str) -> UpdateRepo:
+        """setup_repo backed by the store, the checkout is in use (not evicted) until the returned repo is closed."""
+        with self._locked():
+            repo = UpdateRepo(self.checkout(repo_name, commit_id), commit_id)
+            # called once, by close() or when the repo is collected
+            repo.release_checkout = weakref.finalize(repo, self._acquire(repo_name))
+        return repo
+
+    def remove_checkout(self, repo_name: str):
+        path = self.checkout_path(repo_name)
+        with self._locked():
+            if os.path.exists(path):
+                if self.mode == "worktree":
+                    bare = Repo(self.bare_path(repo_name))
+                    bare.git.worktree("remove", "--force", os.path.abspath(path))
+                    bare.git.worktree("prune")
+                else:
+                    shutil.rmtree(path)
+                logger.info(f"Evicted {self.mode} of {repo_name} at {path}")
+            usage = self._load_usage()
+            usage.pop(repo_name, None)
+            self._save_usage(usage)
+
+    def evict(self, keep: set[str] = set(), max_checkouts: int = None):
+        """Remove the least recently used checkouts beyond max_checkouts, the ones in use are skipped."""
+        max_checkouts = self.max_checkouts if max_checkouts is None else max_checkouts
+        with self._locked():
+            usage = self._load_usage()
+            cold = sorted(
+                (name for name in usage if name not in keep), key=lambda n: usage[n]
+            )
+            excess = len(usage) - max_checkouts
+            for repo_name in cold:
+                if excess <= 0:
+                    break
+                if self.in_use(repo_name):
+                    continue
+                self.remove_checkout(repo_name)
+                excess -= 1
+
+    def disk_usage(self) -> dict[str, dict[str, int]]:
+        """Bytes of the object store (shared by forks) and of the checkout for every known repo."""
+        report = {}
+        repo_names = set(self._load_usage()) | set(self.upstreams) | set(self.upstreams.values())
+        for root, dirs, _ in os.walk(self.store_base):
+            for d in list(dirs):
+                if d.endswith(".git"):
+                    rel = os.path.relpath(os.path.join(root, d), self.store_base)
+                    repo_names.add(rel[: -len(".git")])
+                    dirs.remove(d)
+        for repo_name in sorted(repo_names):
+            bare_path = self.bare_path(repo_name)
+            path = self.checkout_path(repo_name)
+            report[repo_name] = {
+                "store": dir_size(bare_path) if os.path.exists(bare_path) else 0,
+                "checkout": dir_size(path) if os.path.exists(path) else 0,
+            }
+        for repo_name, sizes in report.items():
+            logger.info(
+                f"{repo_name}: store({self.upstream_of(repo_name)}) {sizes['store'] / 2**20:.1f} MB, checkout {sizes['checkout'] / 2**20:.1f} MB"
+            )
+        return report
+
+
+# the stores of this process: (mode, repo_base) -> RepoStore
+_stores: dict[tuple, RepoStore] = dict()
+
+
+def get_repo_store(
+    mode: str = "worktree", repo_base: str = REPO_BASE, store_base: str = REPO_STORE_BASE, **kwargs
+) -> RepoStore:
+    """
+    The store of the checkouts in repo_base shared by the callers of this process (the in-use checkouts are tracked per store),
+    store_base and kwargs of RepoStore are taken by the first call.
+    """
+    key = (mode, repo_base)
+    if key not in _stores:
+        _stores[key] = RepoStore(store_base, repo_base, mode=mode, **kwargs)
+    return _stores[key]
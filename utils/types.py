@@ -1,5 +1,6 @@
 from typing import TypedDict, Optional, Literal
-import os
+from dataclasses import dataclass
+import os, sys
 from .configs import REPO_BASE
 
 
@@ -46,22 +47,65 @@ class RetCtx(TypedDict):
     contexts: list[str]
 
 
+# the flags of SynDiff in the compact form
+SYN_DIFF_FLAGS = ("modifiers", "type_params", "type", "name", "param_types", "throw_types")
+
+
+class TextPool(object):
+    """
+    Share one reference among equal strings (method sources, paths and contexts),
+    the texts loaded from different records are otherwise separate copies.
+    """
+
+    __slots__ = ("texts",)
+
+    def __init__(self):
+        self.texts: dict[str, str] = dict()
+
+    def share(self, text: str) -> str:
+        return self.texts.setdefault(text, text)
+
+    def share_db(self, db: MethodDB) -> MethodDB:
+        return {k: self.share(v) if isinstance(v, str) else v for k, v in db.items()}
+
+    def share_ctx(self, ctx: dict) -> dict:
+        """Share the texts of a RetCtx/ClassCtx."""
+        return {
+            k: (
+                [self.share(t) for t in v]
+                if isinstance(v, list)
+                else self.share(v) if isinstance(v, str) else v
+            )
+            for k, v in ctx.items()
+        }
+
+
 # Reading Exmaples from a data file built by run_prepdata.py
+@dataclass(slots=True)
 class Example(object):
-    def __init__(
-        self,
-        repo_name: str,
-        commit_id: str,
-        focal_db: MethodDB,
-        test_db: MethodDB,
-        syn_diff: SynDiff,
-    ):
-        self.repo_name = repo_name
-        self.commit_id = commit_id
-        self.commit_url = f"https://github.com/{repo_name}/commit/{commit_id}"
-        self.focal_db = focal_db
-        self.test_db = test_db
-        self.syn_diff = syn_diff
+    repo_name: str
+    commit_id: str
+    focal_db: MethodDB
+    test_db: MethodDB
+    syn_diff: SynDiff
+
+    def __post_init__(self):
+        # repo names and commits are shared by many examples
+        self.repo_name = sys.intern(self.repo_name)
+        self.commit_id = sys.intern(self.commit_id)
+
+    @property
+    def commit_url(self) -> str:
+        return f"https://github.com/{self.repo_name}/commit/{self.commit_id}"
+
+    @classmethod
+    def from_dict(cls, record: dict, pool: TextPool = None) -> "Example":
+        focal_db, test_db = record["focal_db"], record["test_db"]
+        if pool is not None:
+            focal_db, test_db = pool.share_db(focal_db), pool.share_db(test_db)
+        return cls(
+            record["repo_name"], record["commit_id"], focal_db, test_db, record["syn_diff"]
+        )
 
     def to_dict(self):
         return {
@@ -73,12 +117,58 @@ class Example(object):
             "syn_diff": self.syn_diff,
         }
 
+    def to_compact(self, table: dict[str, int]) -> list:
+        """
+        Compact form: every string is an index into a string table (string -> index, filled on the way),
+        and the syn_diff flags are packed into bits.
+        """
+
+        def ref(text: str) -> int:
+            return table.setdefault(text, len(table))
+
+        def db_row(db: MethodDB) -> list[int]:
+            return [ref(db["id"]), ref(db["rel_path"]), ref(db["method_src"]), ref(db["method_tgt"])]
+
+        bits = sum(1 << i for i, flag in enumerate(SYN_DIFF_FLAGS) if self.syn_diff.get(flag))
+        return [
+            ref(self.repo_name),
+            ref(self.commit_id),
+            db_row(self.focal_db),
+            db_row(self.test_db),
+            [self.syn_diff["overall"], bits],
+        ]
+
+    @classmethod
+    def from_compact(cls, row: list, strings: list[str]) -> "Example":
+        def db_dict(db_row: list[int]) -> MethodDB:
+            keys = ("id", "rel_path", "method_src", "method_tgt")
+            return {k: strings[i] for k, i in zip(keys, db_row)}
+
+        overall, bits = row[4]
+        syn_diff = {"overall": overall}
+        syn_diff.update({flag: (bits >> i) & 1 for i, flag in enumerate(SYN_DIFF_FLAGS)})
+        return cls(strings[row[0]], strings[row[1]], db_dict(row[2]), db_dict(row[3]), syn_diff)
+
 
 # Type def of the focal_info and test_info dict
 # note: if the test is not updated, test_tgt = ""
 class UpdateInfo(object):
+    # the sources refer to the strings of the example, nothing is copied
+    __slots__ = (
+        "repo_root",
+        "commit_id",
+        "focal_src",
+        "focal_tgt",
+        "focal_relpath",
+        "test_src",
+        "test_tgt",
+        "test_relpath",
+        "syn_diff",
+        "test_lines",
+    )
+
     def __init__(self, exp: Example):
-        self.repo_root = os.path.join(REPO_BASE, exp.repo_name)
+        self.repo_root = sys.intern(os.path.join(REPO_BASE, exp.repo_name))
         self.commit_id = exp.commit_id
         self.focal_src = exp.focal_db["method_src"]
         self.focal_tgt = exp.focal_db["method_tgt"]
@@ -87,3 +177,32 @@ class UpdateInfo(object):
         self.test_tgt = exp.test_db["method_tgt"]
         self.test_relpath = exp.test_db["rel_path"]
         self.syn_diff = exp.syn_diff
+        # (start, end) lines of the test method in the tgt file, located by str.find if None
+        self.test_lines: Optional[tuple[int, int]] = None
+
+    @classmethod
+    def practical(
+        cls,
+        repo_root: str,
+        commit_id: str,
+        focal_relpath: str,
+        focal_src: str,
+        focal_tgt: str,
+        syn_diff: SynDiff,
+        test_relpath: str,
+        test_src: str,
+        test_lines: tuple[int, int],
+    ) -> "UpdateInfo":
+        """Practical repair: the test is not updated (test_tgt = ""), and its lines are already located."""
+        info = cls.__new__(cls)
+        info.repo_root = sys.intern(repo_root)
+        info.commit_id = commit_id
+        info.focal_src = focal_src
+        info.focal_tgt = focal_tgt
+        info.focal_relpath = focal_relpath
+        info.test_src = test_src
+        info.test_tgt = ""
+        info.test_relpath = test_relpath
+        info.syn_diff = syn_diff
+        info.test_lines = test_lines
+        return info